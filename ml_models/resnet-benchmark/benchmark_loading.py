@@ -0,0 +1,64 @@
+"""
+Compare dataset scan time and data loading throughput of ImageFolder against the
+manifest and the preprocessed tensor cache.
+
+Usage: python benchmark_loading.py [--data ./data] [--cache ./data_cache]
+                                   [--batches 50] [--workers 1]
+"""
+import argparse
+import time
+
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+
+import tensor_cache
+from manifest import ManifestImageFolder
+
+
+def throughput(dataset, batch_size, workers, batches):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers)
+    images = 0
+    start = time.perf_counter()
+    for i, (inputs, _) in enumerate(loader):
+        if i == batches:
+            break
+        images += len(inputs)
+    return images / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data loading throughput benchmark.")
+    parser.add_argument("--data", default="./data", help="ImageFolder dataset directory.")
+    parser.add_argument("--cache", default="./data_cache", help="Tensor cache directory.")
+    parser.add_argument("--batches", type=int, default=50, help="Batches to load per run.")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="DataLoader workers.")
+    args = parser.parse_args()
+
+    if not tensor_cache.is_cached(args.cache):
+        start = time.perf_counter()
+        tensor_cache.build_cache(args.data, args.cache, args.workers)
+        print("Built cache in %.1f s" % (time.perf_counter() - start))
+
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=tensor_cache.MEAN, std=tensor_cache.STD),
+    ])
+    # Dataset construction (directory scan) time
+    start = time.perf_counter()
+    folder = datasets.ImageFolder(args.data, transform=transform)
+    print("ImageFolder scan:   %8.3f s" % (time.perf_counter() - start))
+    ManifestImageFolder(args.data, transform=transform)  # Makes sure the manifest exists
+    start = time.perf_counter()
+    ManifestImageFolder(args.data, transform=transform)
+    print("Manifest load:      %8.3f s" % (time.perf_counter() - start))
+
+    runs = [
+        ("ImageFolder", folder),
+        ("Tensor cache", tensor_cache.CachedImageDataset(args.cache)),
+    ]
+    for name, dataset in runs:
+        rate = throughput(dataset, args.batch_size, args.workers, args.batches)
+        print("%-12s %10.1f images/s" % (name, rate))
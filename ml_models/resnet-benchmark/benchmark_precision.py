@@ -0,0 +1,93 @@
+"""
+Compare training modes of the damage classifier against the fp32 baseline: mixed
+precision (--amp in train.py) and channels_last memory format, alone and combined.
+Each mode trains a fresh model for the same epochs on the same split, and reports
+step time, peak memory and validation accuracy.
+
+Usage: python benchmark_precision.py [--epochs 1] [--steps 0] [train.py options...]
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torchvision
+
+import train
+
+MODES = [
+    ("fp32", False, False),
+    ("amp", True, False),
+    ("channels_last", False, True),
+    ("amp+channels_last", True, True),
+]
+
+
+def run_mode(args, amp, channels_last, queue):
+    torch.manual_seed(0)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    dataset = train.load_dataset(args)
+    split = train.load_split(args.split, len(dataset), args.seed)
+    trainloader, valloader, _ = train.build_loaders(dataset, split, args)
+    if args.steps:
+        # Only time the first steps of each epoch
+        trainloader = [batch for _, batch in zip(range(args.steps), trainloader)]
+
+    model = torchvision.models.resnet50().to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.CrossEntropyLoss()
+    scaler = torch.cuda.amp.GradScaler() if amp and device.type == "cuda" else None
+
+    steps = 0
+    elapsed = 0.0
+    for epoch in range(args.epochs):
+        model.train()
+        start = time.perf_counter()
+        _, batches, _ = train.train_epoch(model, trainloader, optimizer, criterion, device,
+                                          scaler, amp, channels_last)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - start
+        steps += batches
+
+    model.eval()
+    accuracy = train.evaluate(model, valloader, device, amp, channels_last)
+    if device.type == "cuda":
+        memory = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        # Peak resident memory of this process (kilobytes on Linux)
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    queue.put((1000 * elapsed / max(steps, 1), memory, accuracy))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--steps", type=int, default=0,
+                        help="Training steps per epoch (all batches if 0).")
+    bench_args, rest = parser.parse_known_args()
+    sys.argv = [sys.argv[0]] + rest
+    args = train.parse_args()
+    if "--epochs" not in rest:
+        args.epochs = 1
+    args.steps = bench_args.steps
+
+    # Each mode runs in its own process, so peak memory is measured separately
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name, amp, channels_last in MODES:
+        queue = context.Queue()
+        process = context.Process(target=run_mode, args=(args, amp, channels_last, queue))
+        process.start()
+        results.append((name,) + queue.get())
+        process.join()
+
+    print("%-18s %14s %14s %14s" % ("Mode", "Step time (ms)", "Memory (MB)", "Val acc (%)"))
+    base_time = results[0][1]
+    for name, step_time, memory, accuracy in results:
+        print("%-18s %14.1f %14.1f %14.2f  (%.2fx)" %
+              (name, step_time, memory, accuracy, base_time / step_time))
@@ -0,0 +1,76 @@
+"""
+Dataset manifest: the file list of an ImageFolder dataset (with file sizes and image
+dimensions) is scanned once, and stored next to the dataset directory. On later runs
+only the directories are checked for changes (added or removed files change their
+mtime), instead of walking the whole dataset.
+"""
+import json
+import os
+
+import torchvision.datasets as datasets
+from PIL import Image
+
+
+def _dir_mtimes(dirs):
+    try:
+        return {d: os.stat(d).st_mtime_ns for d in dirs}
+    except OSError:
+        return None
+
+
+def _make_entry(path, root):
+    width = height = None
+    if datasets.folder.has_file_allowed_extension(path, datasets.folder.IMG_EXTENSIONS):
+        with Image.open(path) as img:  # Only the header is read
+            width, height = img.size
+    return {"path": path, "class": os.path.relpath(path, root).split(os.sep)[0],
+            "size": os.path.getsize(path), "width": width, "height": height}
+
+
+def load_manifest(manifest_path, root):
+    """
+    Load manifest entries of all files in the class folders of root, or (re)build
+    the manifest if there is none, or if a directory was modified since.
+    """
+    previous = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if _dir_mtimes(manifest["dirs"]) == manifest["dirs"]:
+            return manifest["entries"]
+        # Entries of files that are still there are reused
+        previous = {entry["path"]: entry for entry in manifest["entries"]}
+
+    dirs, entries = [root], []
+    for class_dir in sorted(entry.path for entry in os.scandir(root) if entry.is_dir()):
+        # Same order as ImageFolder
+        for dirpath, _, filenames in sorted(os.walk(class_dir, followlinks=True)):
+            dirs.append(dirpath)
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                entries.append(previous.get(path) or _make_entry(path, root))
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"dirs": _dir_mtimes(dirs), "entries": entries}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return entries
+
+
+class ManifestImageFolder(datasets.ImageFolder):
+    """
+    ImageFolder that reads its file list from a manifest (by default ROOT_manifest.json
+    next to the dataset directory) instead of walking the dataset on construction.
+    """
+
+    def __init__(self, root, manifest_path=None, **kwargs):
+        self.manifest_path = manifest_path or os.path.normpath(root) + "_manifest.json"
+        super().__init__(root, **kwargs)
+
+    def make_dataset(self, directory, class_to_idx, extensions=None, is_valid_file=None,
+                     *args, **kwargs):
+        if is_valid_file is None:
+            extensions = extensions or datasets.folder.IMG_EXTENSIONS
+            is_valid_file = lambda path: datasets.folder.has_file_allowed_extension(path, extensions)
+        self.manifest = [entry for entry in load_manifest(self.manifest_path, directory)
+                         if entry["class"] in class_to_idx and is_valid_file(entry["path"])]
+        return [(entry["path"], class_to_idx[entry["class"]]) for entry in self.manifest]
@@ -0,0 +1,140 @@
+"""
+Preprocessed tensor cache for the damage classifier.
+
+Images of an ImageFolder dataset are decoded and resized once, and stored as a
+single memory-mapped uint8 array of shape (N, 3, 224, 224) along with labels, so
+training no longer re-decodes and re-resizes every PNG in each epoch.
+
+Usage: python tensor_cache.py [--data ./data] [--out ./data_cache] [--workers 4]
+"""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+from torch.utils.data import Dataset
+
+from manifest import ManifestImageFolder
+
+IMAGE_SIZE = 224
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+IMAGES_FILE = "images.npy"
+LABELS_FILE = "labels.npy"
+INFO_FILE = "info.json"
+
+
+def _decode(path):
+    # Same decoding and resizing as ImageFolder with Resize((224, 224)); ToTensor
+    # is a plain division by 255, which is done when reading the cache instead.
+    img = datasets.folder.default_loader(path)
+    img = transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))(img)
+    return np.asarray(img, dtype=np.uint8).transpose(2, 0, 1)
+
+
+def _write_chunk(args):
+    out_path, start, paths = args
+    images = np.load(os.path.join(out_path, IMAGES_FILE), mmap_mode="r+")
+    for offset, path in enumerate(paths):
+        images[start + offset] = _decode(path)
+    images.flush()
+    return len(paths)
+
+
+def build_cache(data_path, out_path, workers=1, chunk_size=64):
+    """
+    Decode all images of an ImageFolder directory into a memory-mapped cache.
+    Returns the number of cached images.
+    """
+    folder = ManifestImageFolder(data_path)
+    paths = [path for path, _ in folder.samples]
+    os.makedirs(out_path, exist_ok=True)
+    if is_cached(out_path):
+        os.remove(os.path.join(out_path, INFO_FILE))
+
+    images = np.lib.format.open_memmap(os.path.join(out_path, IMAGES_FILE), mode="w+",
+                                       dtype=np.uint8,
+                                       shape=(len(paths), 3, IMAGE_SIZE, IMAGE_SIZE))
+    del images
+    np.save(os.path.join(out_path, LABELS_FILE), np.array(folder.targets, dtype=np.int64))
+
+    chunks = [(out_path, start, paths[start:start + chunk_size])
+              for start in range(0, len(paths), chunk_size)]
+    if workers > 1:
+        with Pool(workers) as pool:
+            done = sum(pool.imap_unordered(_write_chunk, chunks))
+    else:
+        done = sum(map(_write_chunk, chunks))
+
+    # Written last, so an interrupted build is not mistaken for a complete cache
+    with open(os.path.join(out_path, INFO_FILE), "w") as f:
+        json.dump({"classes": folder.classes, "samples": folder.samples,
+                   "image_size": IMAGE_SIZE}, f)
+    return done
+
+
+def is_cached(cache_path):
+    return os.path.isfile(os.path.join(cache_path, INFO_FILE))
+
+
+class CachedImageDataset(Dataset):
+    """
+    Dataset reading images from a cache made by build_cache. Samples are slices of a
+    memory-mapped array, turned into tensors without copying. With normalize=False,
+    uint8 images are returned, and normalize_batch can be applied to whole batches
+    (e.g. on the training device) instead.
+    """
+
+    def __init__(self, cache_path, normalize=True):
+        with open(os.path.join(cache_path, INFO_FILE)) as f:
+            info = json.load(f)
+        self.classes = info["classes"]
+        self.samples = [tuple(sample) for sample in info["samples"]]
+        self.images_path = os.path.join(cache_path, IMAGES_FILE)
+        self.images = None
+        self.targets = np.load(os.path.join(cache_path, LABELS_FILE)).tolist()
+        self.normalize = normalize
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getstate__(self):
+        # Workers map the cache themselves, instead of receiving a pickled copy
+        return dict(self.__dict__, images=None)
+
+    def __getitem__(self, index):
+        if self.images is None:
+            # Copy-on-write mapping: pages are shared and read lazily, but tensors
+            # can still be created from them without copying
+            self.images = np.load(self.images_path, mmap_mode="c")
+        image = torch.from_numpy(self.images[index])
+        if self.normalize:
+            image = normalize_batch(image)
+        return image, self.targets[index]
+
+
+def normalize_batch(images):
+    """
+    Equivalent of ToTensor + Normalize(MEAN, STD) for uint8 images of shape
+    (..., 3, H, W).
+    """
+    mean = torch.tensor(MEAN, device=images.device).view(3, 1, 1)
+    std = torch.tensor(STD, device=images.device).view(3, 1, 1)
+    return (images.float().div_(255.0) - mean).div_(std)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a preprocessed tensor cache of an "
+                                                 "ImageFolder dataset.")
+    parser.add_argument("--data", default="./data", help="ImageFolder dataset directory.")
+    parser.add_argument("--out", default="./data_cache", help="Cache directory.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of decoding processes.")
+    args = parser.parse_args()
+
+    print("Cached %d images in %s" % (build_cache(args.data, args.out, args.workers), args.out))
@@ -1,20 +1,33 @@
+import argparse
+import json
+import os
+import time
+import uuid
+
+import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torchvision
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
-from torch.utils.data import DataLoader, SubsetRandomSampler
-import uuid
-import numpy as np
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset, SubsetRandomSampler
+from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
-import os
+
+import tensor_cache
+from manifest import ManifestImageFolder
 
 BATCH_SIZE = 16
 LEARNING_RATE = 0.0001
 NUM_WORKERS = 1
 NUM_EPOCHS = 15
+CACHE_PATH = './data_cache'  # Built with tensor_cache.py; ImageFolder is used if missing
+SPLIT_PATH = './splits/split.json'
 
-DEVICE = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+classes = ('Damaged', 'Not Damaged')
 
 transform = transforms.Compose([
     transforms.Resize((224, 224)),
@@ -22,49 +35,102 @@ transform = transforms.Compose([
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
 ])
 
-dataset = datasets.ImageFolder('./data', transform=transform)
-classes = ('Damaged', 'Not Damaged')
-
-print("Loaded Data.....")
-
-"""
-Split: 70% train | 15% validation | 15% test
-"""
-dataset_size = len(dataset)
-train_split = int(np.floor(0.70 * dataset_size))
-val_split = train_split + int(np.floor(0.15 * dataset_size))
-
-indices = list(range(dataset_size))
-np.random.shuffle(indices)
-train_idxs, val_idxs, test_idxs = indices[:train_split], indices[train_split:val_split], indices[val_split:]
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the ResNet damage classifier.")
+    parser.add_argument("--data", default="./data", help="ImageFolder dataset directory.")
+    parser.add_argument("--cache", default=CACHE_PATH,
+                        help="Tensor cache directory (see tensor_cache.py), used if it exists.")
+    parser.add_argument("--split", default=SPLIT_PATH,
+                        help="Split file; created on first run, and reused afterwards.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the random split (only used when creating the split).")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE,
+                        help="Batch size per process.")
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--epochs", type=int, default=NUM_EPOCHS)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS,
+                        help="DataLoader workers per process.")
+    parser.add_argument("--checkpoints", default="./checkpoints",
+                        help="Directory of per-epoch checkpoints.")
+    parser.add_argument("--resume", default=None,
+                        help="Checkpoint file, or run id in the checkpoint directory, to resume.")
+    parser.add_argument("--nprocs", type=int, default=1,
+                        help="Number of local data-parallel training processes. "
+                             "Ignored when launched with torchrun, which sets WORLD_SIZE.")
+    parser.add_argument("--backend", default="gloo", choices=("gloo", "nccl"),
+                        help="torch.distributed backend: gloo trains on CPU, nccl on one GPU "
+                             "per process (cuda:LOCAL_RANK).")
+    parser.add_argument("--amp", action="store_true",
+                        help="Mixed precision: bf16 autocast on CPU, fp16 autocast with gradient "
+                             "scaling on GPU.")
+    parser.add_argument("--channels_last", action="store_true",
+                        help="Use channels_last memory format for the model and inputs.")
+    return parser.parse_args()
 
-train_sampler = SubsetRandomSampler(train_idxs)
-val_sampler = SubsetRandomSampler(val_idxs)
-test_sampler = SubsetRandomSampler(test_idxs)
-
-print("Split Data.....")
 
 """
 Load data
 """
 
-trainloader = DataLoader(
-    dataset, batch_size=BATCH_SIZE, sampler=train_sampler,
-    num_workers=NUM_WORKERS,
-)
-
-valloader = DataLoader(
-    dataset, batch_size=BATCH_SIZE, sampler=val_sampler,
-    num_workers=NUM_WORKERS,
-)
-
-testloader = DataLoader(
-    dataset, batch_size=BATCH_SIZE, sampler=test_sampler,
-    num_workers=NUM_WORKERS,
-)
+def load_dataset(args):
+    if tensor_cache.is_cached(args.cache):
+        return tensor_cache.CachedImageDataset(args.cache)
+    return ManifestImageFolder(args.data, transform=transform)
+
+
+def load_split(path, dataset_size, seed=None):
+    """
+    Split: 70% train | 15% validation | 15% test
+
+    The split is stored in a file, so that resumed and later runs (and the test
+    set) use the same examples.
+    """
+    if os.path.isfile(path):
+        with open(path) as f:
+            split = json.load(f)
+        if split["dataset_size"] != dataset_size:
+            raise ValueError("Split file %s is made for %d examples, but the dataset has %d. "
+                             "Remove it to make a new split." %
+                             (path, split["dataset_size"], dataset_size))
+        return split
+
+    train_split = int(np.floor(0.70 * dataset_size))
+    val_split = train_split + int(np.floor(0.15 * dataset_size))
+
+    indices = np.random.RandomState(seed).permutation(dataset_size).tolist()
+    split = {"dataset_size": dataset_size, "seed": seed,
+             "train": indices[:train_split], "val": indices[train_split:val_split],
+             "test": indices[val_split:]}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(split, f)
+    os.replace(path + ".tmp", path)
+    return split
+
+
+def build_loaders(dataset, split, args, world_size=1, rank=0):
+    if world_size > 1:
+        # Each process trains on a disjoint shard of the training set
+        train_set = Subset(dataset, split["train"])
+        train_sampler = DistributedSampler(train_set, num_replicas=world_size, rank=rank,
+                                           shuffle=True)
+        trainloader = DataLoader(train_set, batch_size=args.batch_size, sampler=train_sampler,
+                                 num_workers=args.workers)
+    else:
+        trainloader = DataLoader(dataset, batch_size=args.batch_size,
+                                 sampler=SubsetRandomSampler(split["train"]),
+                                 num_workers=args.workers)
+
+    # Each process validates a disjoint shard of the validation set (see evaluate)
+    valloader = DataLoader(dataset, batch_size=args.batch_size,
+                           sampler=SubsetRandomSampler(split["val"][rank::world_size]),
+                           num_workers=args.workers)
+    testloader = DataLoader(dataset, batch_size=args.batch_size,
+                            sampler=SubsetRandomSampler(split["test"]), num_workers=args.workers)
+    return trainloader, valloader, testloader
 
-print("Loaded Data Splits.....")
 
 """
 Examine class balances in splits
@@ -83,101 +149,240 @@ def view_class_balance(dataloader):
     print("%i or %.2f%% are cracked" % (total - not_cracked_total, ((total - not_cracked_total) / total) * 100))
     print()
 
-print("View class balance.....")
-#view_class_balance(trainloader)
-#view_class_balance(valloader)
-#view_class_balance(testloader)
 
 """
-Set up to train
+Checkpoints
 """
 
-model = torchvision.models.resnet50().to(DEVICE)
-optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE)
-criterion = nn.CrossEntropyLoss()
+def save_checkpoint(path, run_id, epoch, model, optimizer, scaler=None):
+    checkpoint = {"run_id": str(run_id), "epoch": epoch,
+                  "model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                  "scaler": scaler.state_dict() if scaler is not None else None}
+    run_dir = os.path.join(path, str(run_id))
+    os.makedirs(run_dir, exist_ok=True)
+    torch.save(checkpoint, os.path.join(run_dir, "epoch_%d.pth" % epoch))
+    # Written to a temporary file first, so an interrupted save keeps the former latest
+    torch.save(checkpoint, os.path.join(run_dir, "latest.pth.tmp"))
+    os.replace(os.path.join(run_dir, "latest.pth.tmp"), os.path.join(run_dir, "latest.pth"))
+
+
+def load_checkpoint(path, resume):
+    if not os.path.isfile(resume):
+        resume = os.path.join(path, resume, "latest.pth")
+    return torch.load(resume, map_location="cpu")
 
-print("Loaded Model and Optimizer.....")
 
 """
-Train model
+Train and evaluate
 """
 
-print("Beginning to Train.....")
+def autocast(device, enabled=True):
+    # Mixed precision: fp16 on GPU (use together with a GradScaler), bf16 on CPU
+    dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+    return torch.autocast(device_type=device.type, dtype=dtype, enabled=enabled)
 
-# Write to training log
-new_id = uuid.uuid4()
-f = open("./logs/train_" + str(new_id) + ".txt", "w")
 
-for epoch in range(NUM_EPOCHS):
-    print('\nSTARTING EPOCH:', epoch+1,'/',NUM_EPOCHS)
+def to_device(inputs, device, channels_last=False):
+    memory_format = torch.channels_last if channels_last else torch.preserve_format
+    return inputs.to(device, memory_format=memory_format)
+
+
+def train_epoch(model, loader, optimizer, criterion, device, scaler=None, amp=False,
+                channels_last=False):
     running_loss = 0.0
-    for i, data in enumerate(trainloader, 0):
+    samples = 0
+    for i, data in enumerate(loader, 0):
         inputs, targets = data
-        inputs, targets = inputs.to(DEVICE), targets.to(DEVICE)
+        inputs, targets = to_device(inputs, device, channels_last), targets.to(device)
 
         optimizer.zero_grad()
 
-        preds = model(inputs)
-        loss = criterion(preds, targets)
-        loss.backward()
-        optimizer.step()
+        with autocast(device, amp):
+            preds = model(inputs)
+            loss = criterion(preds, targets)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
 
         # print statistics
         running_loss += loss.item()
+        samples += len(targets)
+    return running_loss, len(loader), samples
 
-    epoch_loss = running_loss / len(trainloader)
-    log = 'Epoch: %d | loss: %.6f' % (epoch + 1, epoch_loss) + '\n'
-    f.write(log)
-    print(log)
 
-    # Validation
+def evaluate(model, loader, device, amp=False, channels_last=False, distributed=False):
+    """
+    Accuracy in %. With distributed, each process evaluates its own shard and the
+    counts of all processes are summed.
+    """
     correct = 0
     total = 0
-    with torch.no_grad():
-        for data in tqdm(valloader):
+    with torch.no_grad(), autocast(device, amp):
+        for data in tqdm(loader):
             inputs, targets = data
-            inputs, targets = inputs.to(DEVICE), targets.to(DEVICE)
+            inputs, targets = to_device(inputs, device, channels_last), targets.to(device)
 
             preds = model(inputs)
             _, predicted = torch.max(preds.data, 1)  # max of logits
 
             total += targets.size(0)
             correct += (predicted == targets).sum().item()
-
-    log = 'Validation Accuracy of the network: %d %%' % (100 * correct / total) + '\n'
+    if distributed:
+        counts = torch.tensor([correct, total], dtype=torch.float64, device=device)
+        dist.all_reduce(counts)
+        correct, total = counts.tolist()
+    return 100 * correct / total
+
+
+def run(rank, world_size, args):
+    distributed = world_size > 1
+    if distributed:
+        dist.init_process_group(args.backend, rank=rank, world_size=world_size)
+        if args.backend == "nccl":
+            # One GPU per process; mp.spawn ranks are local, torchrun sets LOCAL_RANK
+            local_rank = int(os.environ.get("LOCAL_RANK", rank))
+            torch.cuda.set_device(local_rank)
+            device = torch.device("cuda", local_rank)
+        else:
+            # Share cores between processes instead of oversubscribing them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+            device = torch.device("cpu")
+    else:
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    is_main = rank == 0
+
+    dataset = load_dataset(args)
+    split = None
+    if is_main:
+        print("Loaded Data.....")
+        split = load_split(args.split, len(dataset), args.seed)
+    if distributed:
+        # The split is loaded or made once, by the main process, and sent to the others
+        # (which may run on machines without the split file)
+        split_list = [split]
+        dist.broadcast_object_list(split_list, src=0)
+        split = split_list[0]
+    trainloader, valloader, testloader = build_loaders(dataset, split, args, world_size, rank)
+    if is_main:
+        print("Loaded Data Splits.....")
+
+    """
+    Set up to train
+    """
+
+    model = torchvision.models.resnet50().to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.CrossEntropyLoss()
+    # Gradient scaling is only needed for fp16; bf16 has the range of fp32
+    scaler = torch.cuda.amp.GradScaler() if args.amp and device.type == "cuda" else None
+
+    start_epoch = 0
+    run_id = uuid.uuid4()
+    if args.resume:
+        checkpoint = load_checkpoint(args.checkpoints, args.resume)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        if scaler is not None and checkpoint.get("scaler"):
+            scaler.load_state_dict(checkpoint["scaler"])
+        start_epoch, run_id = checkpoint["epoch"], checkpoint["run_id"]
+        if is_main:
+            print("Resumed run %s after epoch %d....." % (run_id, start_epoch))
+    train_model = model
+    if distributed:
+        device_ids = [device.index] if device.type == "cuda" else None
+        train_model = DistributedDataParallel(model, device_ids=device_ids)
+
+    if is_main:
+        print("Loaded Model and Optimizer.....")
+
+    """
+    Train model
+    """
+
+    if is_main:
+        print("Beginning to Train.....")
+        # Write to training log
+        os.makedirs("./logs", exist_ok=True)
+        f = open("./logs/train_" + str(run_id) + ".txt", "a")
+
+    for epoch in range(start_epoch, args.epochs):
+        if is_main:
+            print('\nSTARTING EPOCH:', epoch+1,'/',args.epochs)
+        if distributed:
+            trainloader.sampler.set_epoch(epoch)
+        train_model.train()
+        epoch_start = time.perf_counter()
+        running_loss, batches, samples = train_epoch(train_model, trainloader, optimizer,
+                                                     criterion, device, scaler, args.amp,
+                                                     args.channels_last)
+        epoch_time = time.perf_counter() - epoch_start
+        if distributed:
+            totals = torch.tensor([running_loss, batches, samples], dtype=torch.float64,
+                                  device=device)
+            dist.all_reduce(totals)
+            running_loss, batches, samples = totals.tolist()
+
+        if is_main:
+            epoch_loss = running_loss / batches
+            log = 'Epoch: %d | loss: %.6f' % (epoch + 1, epoch_loss) + '\n'
+            log += 'Epoch time: %.1f s | %.1f samples/sec' % (epoch_time, samples / epoch_time) + '\n'
+            f.write(log)
+            print(log)
+
+        # Validation, sharded across processes
+        model.eval()
+        accuracy = evaluate(model, valloader, device, args.amp, args.channels_last, distributed)
+        if is_main:
+            log = 'Validation Accuracy of the network: %d %%' % accuracy + '\n'
+            f.write(log)
+            f.flush()
+            print(log)
+
+            save_checkpoint(args.checkpoints, run_id, epoch + 1, model, optimizer, scaler)
+        if distributed:
+            dist.barrier()
+
+    if not is_main:
+        dist.destroy_process_group()
+        return
+    f.close()
+
+    """
+    Test model
+    """
+
+    print("Beginning to test.....")
+
+    # Write to test log
+    f = open("./logs/test_" + str(run_id) + ".txt", "w")
+
+    model.eval()
+    log = 'Accuracy of the network on the test images: %d %%' % evaluate(model, testloader, device, args.amp, args.channels_last) + '\n'
     f.write(log)
+    f.close()
     print(log)
 
-f.close()
-
-
-
-"""
-Test model
-"""
-
-print("Beginning to test.....")
-
-# Write to test log
-f = open("./logs/test_" + str(new_id) + ".txt", "w")
-
-correct = 0
-total = 0
-with torch.no_grad():
-    for data in tqdm(testloader):
-        inputs, targets = data
-        inputs, targets = inputs.to(DEVICE), targets.to(DEVICE)
-
-        preds = model(inputs)
-        _, predicted = torch.max(preds.data, 1)  # max of logits
-
-        total += targets.size(0)
-        correct += (predicted == targets).sum().item()
-
-log = 'Accuracy of the network on the test images: %d %%' % (100 * correct / total) + '\n'
-f.write(log)
-f.close()
-print(log)
-
-torch.save(model.state_dict(), "./saved_models/" + str(new_id) +".pth")
-print("Saved model:", str(new_id))
+    os.makedirs("./saved_models", exist_ok=True)
+    torch.save(model.state_dict(), "./saved_models/" + str(run_id) +".pth")
+    print("Saved model:", str(run_id))
+    if distributed:
+        dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if "WORLD_SIZE" in os.environ:
+        # Launched by torchrun, possibly across machines
+        run(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), args)
+    elif args.nprocs > 1:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", "29500")
+        mp.spawn(run, args=(args.nprocs, args), nprocs=args.nprocs)
+    else:
+        run(0, 1, args)
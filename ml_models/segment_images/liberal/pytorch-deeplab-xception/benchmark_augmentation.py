@@ -0,0 +1,64 @@
+import argparse
+import time
+import torch
+
+from dataloaders import make_batch_transform, make_data_loader
+
+
+def throughput(args, batches):
+    """:return images/s of loading and augmenting train batches (moved to the device)"""
+    kwargs = {'num_workers': args.workers, 'pin_memory': args.cuda}
+    train_loader = make_data_loader(args, **kwargs)[0]
+    batch_transform = make_batch_transform(args)
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    num_images = 0
+    start = None
+    for i, sample in enumerate(train_loader):
+        if i == 2:
+            # (after the workers have started)
+            if args.cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+        elif i == batches + 2:
+            break
+        image, target = sample['image'].to(device), sample['label'].to(device)
+        if batch_transform is not None:
+            sample = batch_transform({'image': image, 'label': target, 'size': sample['size']})
+            image, target = sample['image'], sample['label']
+        if start is not None:
+            num_images += image.shape[0]
+    if args.cuda:
+        torch.cuda.synchronize()
+    return num_images / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per sample vs batched train augmentation throughput")
+    parser.add_argument('--dataset', type=str, default='cityscapes',
+                        choices=['pascal', 'coco', 'cityscapes'],
+                        help='dataset name (default: cityscapes)')
+    parser.add_argument('--workers', type=int, default=4,
+                        metavar='N', help='dataloader threads')
+    parser.add_argument('--base-size', type=int, default=513,
+                        help='base image size')
+    parser.add_argument('--crop-size', type=int, default=513,
+                        help='crop image size')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        metavar='N', help='input batch size (default: 8)')
+    parser.add_argument('--batches', type=int, default=50,
+                        help='number of batches to time (default: 50)')
+    parser.add_argument('--no-cuda', action='store_true', default=False,
+                        help='augment batches on the cpu')
+    args = parser.parse_args()
+    args.cuda = not args.no_cuda and torch.cuda.is_available()
+    args.use_sbd = False
+
+    for batched_augment in [False, True]:
+        args.batched_augment = batched_augment
+        rate = throughput(args, args.batches)
+        print('%-10s %8.1f images/s' % ('batched' if batched_augment else 'per sample', rate))
+
+
+if __name__ == "__main__":
+    main()
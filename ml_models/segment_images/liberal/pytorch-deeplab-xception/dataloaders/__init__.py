@@ -1,5 +1,38 @@
 from dataloaders.datasets import cityscapes, coco, combine_dbs, pascal, sbd
-from torch.utils.data import DataLoader
+from dataloaders import custom_transforms as tr
+from dataloaders.samplers import ShardSampler
+from torch.utils.data import DataLoader, DistributedSampler
+from torchvision import transforms
+from utils.distributed import is_distributed
+
+def make_batch_transform(args):
+    """Train augmentation of whole batches (on the device they are moved to), for
+        train loaders with --batched-augment, which load uint8 images
+    """
+    if not getattr(args, 'batched_augment', False):
+        return None
+    return transforms.Compose([
+        tr.BatchToTensor(),
+        tr.BatchRandomHorizontalFlip(),
+        tr.BatchRandomScaleCrop(base_size=args.base_size, crop_size=args.crop_size,
+                                fill=255 if args.dataset == 'cityscapes' else 0),
+        tr.BatchRandomGaussianBlur(),
+        tr.BatchNormalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))])
+
+def make_train_loader(dataset, args, **kwargs):
+    if getattr(args, 'batched_augment', False):
+        # (uint8 images of different sizes)
+        kwargs = dict(kwargs, collate_fn=tr.pad_collate)
+    # Under torch.distributed, each process trains on its own shard, reshuffled every epoch
+    if is_distributed():
+        return DataLoader(dataset, batch_size=args.batch_size, sampler=DistributedSampler(dataset), **kwargs)
+    return DataLoader(dataset, batch_size=args.batch_size, shuffle=True, **kwargs)
+
+def make_eval_loader(dataset, args, **kwargs):
+    # Under torch.distributed, each process evaluates its own shard
+    if is_distributed():
+        return DataLoader(dataset, batch_size=args.batch_size, sampler=ShardSampler(dataset), **kwargs)
+    return DataLoader(dataset, batch_size=args.batch_size, shuffle=False, **kwargs)
 
 def make_data_loader(args, **kwargs):
 
@@ -11,8 +44,8 @@ def make_data_loader(args, **kwargs):
             train_set = combine_dbs.CombineDBs([train_set, sbd_train], excluded=[val_set])
 
         num_class = train_set.NUM_CLASSES
-        train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, **kwargs)
-        val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, **kwargs)
+        train_loader = make_train_loader(train_set, args, **kwargs)
+        val_loader = make_eval_loader(val_set, args, **kwargs)
         test_loader = None
 
         return train_loader, val_loader, test_loader, num_class
@@ -22,9 +55,9 @@ def make_data_loader(args, **kwargs):
         val_set = cityscapes.CityscapesSegmentation(args, split='val')
         test_set = cityscapes.CityscapesSegmentation(args, split='test')
         num_class = train_set.NUM_CLASSES
-        train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, **kwargs)
-        val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, **kwargs)
-        test_loader = DataLoader(test_set, batch_size=args.batch_size, shuffle=False, **kwargs)
+        train_loader = make_train_loader(train_set, args, **kwargs)
+        val_loader = make_eval_loader(val_set, args, **kwargs)
+        test_loader = make_eval_loader(test_set, args, **kwargs)
 
         return train_loader, val_loader, test_loader, num_class
 
@@ -32,8 +65,8 @@ def make_data_loader(args, **kwargs):
         train_set = coco.COCOSegmentation(args, split='train')
         val_set = coco.COCOSegmentation(args, split='val')
         num_class = train_set.NUM_CLASSES
-        train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, **kwargs)
-        val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, **kwargs)
+        train_loader = make_train_loader(train_set, args, **kwargs)
+        val_loader = make_eval_loader(val_set, args, **kwargs)
         test_loader = None
         return train_loader, val_loader, test_loader, num_class
 
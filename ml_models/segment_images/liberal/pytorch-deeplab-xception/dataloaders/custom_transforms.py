@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 import random
 import numpy as np
 
@@ -162,4 +163,163 @@ class FixedResize(object):
         mask = mask.resize(self.size, Image.NEAREST)
 
         return {'image': img,
-                'label': mask}
\ No newline at end of file
+                'label': mask}
+
+
+class ToUint8Tensor(object):
+    """Convert PIL images in sample to uint8 Tensors (image: H x W x C, label: H x W),
+    to be augmented as a batch by the Batch* transforms below."""
+
+    def __call__(self, sample):
+        img = torch.from_numpy(np.array(sample['image'], dtype=np.uint8))
+        mask = torch.from_numpy(np.array(sample['label'], dtype=np.uint8))
+
+        return {'image': img,
+                'label': mask}
+
+
+def pad_collate(samples):
+    """Collate uint8 samples of different sizes into a batch, padded at the bottom
+    and right. 'size' holds the (h, w) of each image in the batch."""
+    h = max(sample['image'].shape[0] for sample in samples)
+    w = max(sample['image'].shape[1] for sample in samples)
+    img = torch.zeros((len(samples), h, w, 3), dtype=torch.uint8)
+    mask = torch.zeros((len(samples), h, w), dtype=torch.uint8)
+    size = torch.zeros((len(samples), 2), dtype=torch.long)
+    for i, sample in enumerate(samples):
+        ih, iw = sample['label'].shape
+        img[i, :ih, :iw] = sample['image']
+        mask[i, :ih, :iw] = sample['label']
+        size[i, 0], size[i, 1] = ih, iw
+
+    return {'image': img,
+            'label': mask,
+            'size': size}
+
+
+class BatchToTensor(object):
+    """Convert a collated uint8 batch (see pad_collate), on any device, to float
+    tensors: image N x C x H x W (in [0, 255]), label N x H x W."""
+
+    def __call__(self, sample):
+        img = sample['image'].permute(0, 3, 1, 2).float()
+        mask = sample['label'].float()
+
+        return {'image': img,
+                'label': mask,
+                'size': sample['size'].to(img.device)}
+
+
+class BatchRandomHorizontalFlip(object):
+    """RandomHorizontalFlip of each image of a batch (within its own width)."""
+
+    def __call__(self, sample):
+        img = sample['image']
+        mask = sample['label']
+        size = sample['size']
+        n, c, h, w = img.shape
+        flip = torch.rand(n, device=img.device) < 0.5
+        cols = torch.arange(w, device=img.device).expand(n, w)
+        flipped = (size[:, 1:] - 1 - cols).clamp(min=0)
+        cols = torch.where(flip[:, None] & (cols < size[:, 1:]), flipped, cols)
+        img = img.gather(3, cols[:, None, None, :].expand(n, c, h, w))
+        mask = mask.gather(2, cols[:, None, :].expand(n, h, w))
+
+        return {'image': img,
+                'label': mask,
+                'size': size}
+
+
+class BatchRandomScaleCrop(object):
+    """RandomScaleCrop of each image of a batch, as a single resampling to the crops:
+    bilinear for images (without the antialiasing of PIL when downscaling), nearest
+    for labels."""
+    def __init__(self, base_size, crop_size, fill=0):
+        self.base_size = base_size
+        self.crop_size = crop_size
+        self.fill = fill
+
+    def __call__(self, sample):
+        img = sample['image']
+        mask = sample['label']
+        size = sample['size']
+        n, c, h, w = img.shape
+        device = img.device
+        crop = self.crop_size
+        # random scale (short edge)
+        short_size = torch.randint(int(self.base_size * 0.5), int(self.base_size * 2.0) + 1, (n,), device=device)
+        ih, iw = size[:, 0], size[:, 1]
+        oh = torch.where(ih > iw, ih * short_size // iw, short_size)
+        ow = torch.where(ih > iw, short_size, iw * short_size // ih)
+        # random crop crop_size (of the image padded to at least crop_size)
+        x1 = (torch.rand(n, device=device) * ((ow - crop).clamp(min=0) + 1)).long()
+        y1 = (torch.rand(n, device=device) * ((oh - crop).clamp(min=0) + 1)).long()
+        ys = y1[:, None] + torch.arange(crop, device=device)  # (n, crop), in the scaled image
+        xs = x1[:, None] + torch.arange(crop, device=device)
+        valid = (ys < oh[:, None])[:, :, None] & (xs < ow[:, None])[:, None, :]
+
+        # Source coordinates of the crop pixel centers
+        sy = (ys + 0.5) * (ih / oh)[:, None]
+        sx = (xs + 0.5) * (iw / ow)[:, None]
+
+        # nearest: pixel containing the center
+        ry = torch.min(sy.long(), ih[:, None] - 1)
+        rx = torch.min(sx.long(), iw[:, None] - 1)
+        index = (ry[:, :, None] * w + rx[:, None, :]).view(n, -1)
+        mask = mask.view(n, -1).gather(1, index).view(n, crop, crop)
+        mask = torch.where(valid, mask, torch.full_like(mask, self.fill))
+
+        # bilinear: grid_sample, with coordinates clamped to the image (not its padding in the batch)
+        gy = torch.min((sy - 0.5).clamp(min=0), (ih - 1)[:, None].float())
+        gx = torch.min((sx - 0.5).clamp(min=0), (iw - 1)[:, None].float())
+        grid = torch.stack(torch.broadcast_tensors((gx[:, None, :] + 0.5) / w * 2 - 1,
+                                                   (gy[:, :, None] + 0.5) / h * 2 - 1), dim=-1)
+        img = F.grid_sample(img, grid, mode='bilinear', align_corners=False)
+        img = img * valid[:, None].to(img.dtype)
+
+        return {'image': img,
+                'label': mask,
+                'size': torch.full_like(size, crop)}
+
+
+class BatchRandomGaussianBlur(object):
+    """RandomGaussianBlur of each image of a batch, with a separable convolution
+    of per image kernels."""
+    def __init__(self, max_radius=1.0):
+        self.max_radius = max_radius
+
+    def __call__(self, sample):
+        img = sample['image']
+        n, c, h, w = img.shape
+        device = img.device
+        blur = torch.rand(n, device=device) < 0.5
+        sigma = torch.where(blur, torch.rand(n, device=device) * self.max_radius,
+                            torch.zeros(n, device=device)).clamp(min=1e-3)
+        k = int(np.ceil(3 * self.max_radius))
+        x = torch.arange(-k, k + 1, device=device, dtype=img.dtype)
+        kernel = torch.exp(-x ** 2 / (2 * sigma[:, None] ** 2))
+        kernel = (kernel / kernel.sum(dim=1, keepdim=True)).repeat_interleave(c, dim=0)
+        out = img.reshape(1, n * c, h, w)
+        out = F.conv2d(F.pad(out, (k, k, 0, 0), mode='replicate'), kernel[:, None, None, :], groups=n * c)
+        out = F.conv2d(F.pad(out, (0, 0, k, k), mode='replicate'), kernel[:, None, :, None], groups=n * c)
+
+        return {'image': out.view(n, c, h, w),
+                'label': sample['label'],
+                'size': sample['size']}
+
+
+class BatchNormalize(object):
+    """Normalize a batch of images in [0, 255] with mean and standard deviation."""
+    def __init__(self, mean=(0., 0., 0.), std=(1., 1., 1.)):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, sample):
+        img = sample['image']
+        mean = torch.tensor(self.mean, device=img.device, dtype=img.dtype).view(1, -1, 1, 1)
+        std = torch.tensor(self.std, device=img.device, dtype=img.dtype).view(1, -1, 1, 1)
+        img = (img / 255.0 - mean) / std
+
+        return {'image': img,
+                'label': sample['label'],
+                'size': sample['size']}
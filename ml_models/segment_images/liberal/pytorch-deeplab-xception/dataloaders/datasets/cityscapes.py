@@ -1,14 +1,19 @@
 import os
+import json
 import numpy as np
+from multiprocessing import Pool
 import scipy.misc as m
 from PIL import Image
 from torch.utils import data
 from mypath import Path
 from torchvision import transforms
 from dataloaders import custom_transforms as tr
+from dataloaders.manifest import load_manifest, image_entry
 
 class CityscapesSegmentation(data.Dataset):
     NUM_CLASSES = 2  # 19
+    ENCODED_SUFFIX = 'gtFine_encoded.png'
+    ENCODED_MARKER = 'encoded_labels.json'
 
     def __init__(self, args, root=Path.db_root_dir('cityscapes'), split="train"):
 
@@ -20,7 +25,10 @@ class CityscapesSegmentation(data.Dataset):
         self.images_base = os.path.join(self.root, 'leftImg8bit', self.split)
         self.annotations_base = os.path.join(self.root, 'gtFine', self.split)
 
-        self.files[split] = self.recursive_glob(rootdir=self.images_base, suffix='.png')
+        # File list, label paths and image sizes are scanned once, and cached in a manifest
+        self.manifest = load_manifest(os.path.join(self.root, 'manifest_%s.json' % split),
+                                      self.images_base, self.manifest_entry, suffix='.png')
+        self.files[split] = [entry['path'] for entry in self.manifest]
 
         self.void_classes = [0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 14, 15, 16, 18, 29, 30, -1, 11, 12, 13,
                              17, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 31, 32, 33]
@@ -33,6 +41,9 @@ class CityscapesSegmentation(data.Dataset):
 
         self.ignore_index = 0 #255
         self.class_map = dict(zip(self.valid_classes, range(self.NUM_CLASSES)))
+        self.label_lut = self.build_label_lut()
+        # Labels pre-encoded with the same lookup table by encode_labels() are read as-is
+        self.encoded_labels = self.has_encoded_labels()
 
         if not self.files[split]:
             raise Exception("No files for split=[%s] found in %s" % (split, self.images_base))
@@ -42,17 +53,22 @@ class CityscapesSegmentation(data.Dataset):
     def __len__(self):
         return len(self.files[self.split])
 
+    def label_path(self, img_path, suffix='gtFine_labelIds.png'):
+        return os.path.join(self.annotations_base,
+                            img_path.split(os.sep)[-2],
+                            os.path.basename(img_path)[:-15] + suffix)
+
     def __getitem__(self, index):
 
         img_path = self.files[self.split][index].rstrip()
-        lbl_path = os.path.join(self.annotations_base,
-                                img_path.split(os.sep)[-2],
-                                os.path.basename(img_path)[:-15] + 'gtFine_labelIds.png')
 
         _img = Image.open(img_path).convert('RGB')
-        _tmp = np.array(Image.open(lbl_path), dtype=np.uint8)
-        _tmp = self.encode_segmap(_tmp)
-        _target = Image.fromarray(_tmp)
+        if self.encoded_labels:
+            _target = Image.open(self.label_path(img_path, self.ENCODED_SUFFIX))
+        else:
+            _tmp = np.array(Image.open(self.label_path(img_path)), dtype=np.uint8)
+            _tmp = self.encode_segmap(_tmp)
+            _target = Image.fromarray(_tmp)
 
         sample = {'image': _img, 'label': _target}
 
@@ -63,13 +79,47 @@ class CityscapesSegmentation(data.Dataset):
         elif self.split == 'test':
             return self.transform_ts(sample)
 
-    def encode_segmap(self, mask):
+    def build_label_lut(self):
+        """Lookup table from label id to encoded class, for all 256 uint8 values"""
+        lut = np.arange(256, dtype=np.uint8)
         # Put all void classes to zero
         for _voidc in self.void_classes:
-            mask[mask == _voidc] = self.ignore_index
+            lut[lut == _voidc] = self.ignore_index
         for _validc in self.valid_classes:
-            mask[mask == _validc] = self.class_map[_validc] + 1
-        return mask
+            lut[lut == _validc] = self.class_map[_validc] + 1
+        return lut
+
+    def encode_segmap(self, mask):
+        return self.label_lut[mask]
+
+    def has_encoded_labels(self):
+        marker = os.path.join(self.annotations_base, self.ENCODED_MARKER)
+        if not os.path.isfile(marker):
+            return False
+        with open(marker) as f:
+            return json.load(f).get('lut') == self.label_lut.tolist()
+
+    def _encode_label(self, img_path):
+        mask = np.array(Image.open(self.label_path(img_path)), dtype=np.uint8)
+        Image.fromarray(self.encode_segmap(mask)).save(self.label_path(img_path, self.ENCODED_SUFFIX))
+
+    def encode_labels(self, workers=1):
+        """Write encoded label PNGs next to the originals, so that they are not
+            converted in __getitem__ for every sample of every epoch
+        """
+        marker = os.path.join(self.annotations_base, self.ENCODED_MARKER)
+        if os.path.isfile(marker):
+            os.remove(marker)
+        img_paths = [img_path.rstrip() for img_path in self.files[self.split]]
+        with Pool(workers) as pool:
+            pool.map(self._encode_label, img_paths, chunksize=16)
+        # Written last, and with the table used, so that partial or outdated labels are not used
+        with open(marker, 'w') as f:
+            json.dump({'lut': self.label_lut.tolist()}, f)
+        self.encoded_labels = True
+
+    def manifest_entry(self, img_path):
+        return image_entry(img_path, label_path=self.label_path(img_path))
 
     def recursive_glob(self, rootdir='.', suffix=''):
         """Performs recursive glob with given suffix and rootdir
@@ -81,6 +131,10 @@ class CityscapesSegmentation(data.Dataset):
                 for filename in filenames if filename.endswith(suffix)]
 
     def transform_tr(self, sample):
+        if getattr(self.args, 'batched_augment', False):
+            # Augmented as a batch on the device of the model, see make_batch_transform
+            return tr.ToUint8Tensor()(sample)
+
         composed_transforms = transforms.Compose([
             tr.RandomHorizontalFlip(),
             tr.RandomScaleCrop(base_size=self.args.base_size, crop_size=self.args.crop_size, fill=255),
@@ -115,10 +169,20 @@ if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser()
+    parser.add_argument('--encode-labels', action='store_true', default=False,
+                        help='write pre-encoded label PNGs for all splits, and exit')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes for encoding labels')
     args = parser.parse_args()
     args.base_size = 513
     args.crop_size = 513
 
+    if args.encode_labels:
+        for split in ['train', 'val', 'test']:
+            if os.path.isdir(os.path.join(Path.db_root_dir('cityscapes'), 'leftImg8bit', split)):
+                CityscapesSegmentation(args, split=split).encode_labels(args.workers)
+        raise SystemExit
+
     cityscapes_train = CityscapesSegmentation(args, split='train')
 
     dataloader = DataLoader(cityscapes_train, batch_size=2, shuffle=True, num_workers=2)
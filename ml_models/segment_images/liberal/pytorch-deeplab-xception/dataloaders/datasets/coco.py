@@ -95,6 +95,10 @@ class COCOSegmentation(Dataset):
         return mask
 
     def transform_tr(self, sample):
+        if getattr(self.args, 'batched_augment', False):
+            # Augmented as a batch on the device of the model, see make_batch_transform
+            return tr.ToUint8Tensor()(sample)
+
         composed_transforms = transforms.Compose([
             tr.RandomHorizontalFlip(),
             tr.RandomScaleCrop(base_size=self.args.base_size, crop_size=self.args.crop_size),
@@ -82,6 +82,10 @@ class VOCSegmentation(Dataset):
         return _img, _target
 
     def transform_tr(self, sample):
+        if getattr(self.args, 'batched_augment', False):
+            # Augmented as a batch on the device of the model, see make_batch_transform
+            return tr.ToUint8Tensor()(sample)
+
         composed_transforms = transforms.Compose([
             tr.RandomHorizontalFlip(),
             tr.RandomScaleCrop(base_size=self.args.base_size, crop_size=self.args.crop_size),
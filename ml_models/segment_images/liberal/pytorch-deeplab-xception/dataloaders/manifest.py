@@ -0,0 +1,67 @@
+import os
+import json
+from PIL import Image
+
+
+def scan_files(rootdir, suffix=''):
+    """Walk rootdir for files with the given suffix
+        :return sorted file paths, and all walked directories
+    """
+    files, dirs = [], []
+    for looproot, _, filenames in os.walk(rootdir):
+        dirs.append(looproot)
+        files.extend(os.path.join(looproot, filename)
+                     for filename in filenames if filename.endswith(suffix))
+    return sorted(files), dirs
+
+
+def image_entry(img_path, **paths):
+    """Manifest entry of an image: path, file size, dimensions, and related paths
+        (e.g. label_path)
+    """
+    with Image.open(img_path) as img:  # (only the header is read)
+        width, height = img.size
+    entry = {'path': img_path, 'size': os.path.getsize(img_path),
+             'width': width, 'height': height}
+    entry.update(paths)
+    return entry
+
+
+def dir_mtimes(dirs):
+    try:
+        return {d: os.stat(d).st_mtime_ns for d in dirs}
+    except OSError:
+        return None
+
+
+def load_manifest(manifest_path, rootdir, make_entry, suffix=''):
+    """Load the manifest of files under rootdir, or build it if there is none yet, or
+        if any of its directories was modified since (i.e. files were added or removed).
+        Only directories are checked, so launching does not list or stat every file.
+        :param manifest_path is the path of the manifest file
+        :param rootdir is the root directory, searched recursively
+        :param make_entry maps a file path to its manifest entry (a dict), or None to skip it
+        :param suffix is the suffix of files to be searched
+        :return manifest entries, in sorted path order
+    """
+    previous = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('suffix') == suffix:
+            if dir_mtimes(manifest['dirs']) == manifest['dirs']:
+                return manifest['entries']
+            # Entries of files that are still there are reused
+            previous = {entry['path']: entry for entry in manifest['entries']}
+
+    files, dirs = scan_files(rootdir, suffix)
+    mtimes = dir_mtimes(dirs)
+    entries = [previous[path] if path in previous else make_entry(path) for path in files]
+    entries = [entry for entry in entries if entry is not None]
+    try:
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump({'suffix': suffix, 'dirs': mtimes, 'entries': entries}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except OSError as e:
+        print('Could not write dataset manifest %s: %s' % (manifest_path, e))
+    return entries
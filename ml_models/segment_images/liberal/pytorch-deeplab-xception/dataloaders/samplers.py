@@ -0,0 +1,20 @@
+from torch.utils.data import Sampler
+
+from utils.distributed import get_rank, get_world_size
+
+
+class ShardSampler(Sampler):
+    """Sequential sampler over a disjoint shard of a dataset for each process. Unlike
+        DistributedSampler, shards are not padded to equal size, so that no sample is
+        evaluated twice when metrics of all shards are summed.
+    """
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        self.num_samples = len(dataset)
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+
+    def __iter__(self):
+        return iter(range(self.rank, self.num_samples, self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, self.num_samples, self.num_replicas))
@@ -3,12 +3,17 @@ import numpy as np
 import torch
 
 def decode_seg_map_sequence(label_masks, dataset='pascal'):
-    rgb_masks = []
-    for label_mask in label_masks:
-        rgb_mask = decode_segmap(label_mask, dataset)
-        rgb_masks.append(rgb_mask)
-    rgb_masks = torch.from_numpy(np.array(rgb_masks).transpose([0, 3, 1, 2]))
-    return rgb_masks
+    """Decode a batch of segmentation class labels into color images
+    Args:
+        label_masks (np.ndarray or torch.Tensor): an (N,M,K) batch of class labels,
+          tensors can be on any device.
+    Returns:
+        (torch.Tensor): (N,3,M,K) color images, on the device of label_masks.
+    """
+    rgb_masks = colorize(label_masks, get_palette(dataset))
+    if isinstance(rgb_masks, np.ndarray):
+        rgb_masks = torch.from_numpy(rgb_masks)
+    return rgb_masks.permute(0, 3, 1, 2)
 
 
 def decode_segmap(label_mask, dataset, plot=False):
@@ -21,31 +26,45 @@ def decode_segmap(label_mask, dataset, plot=False):
     Returns:
         (np.ndarray, optional): the resulting decoded color image.
     """
+    rgb = colorize(label_mask, get_palette(dataset))
+    if plot:
+        plt.imshow(rgb)
+        plt.show()
+    else:
+        return rgb
+
+
+def get_palette(dataset):
+    """Color (in [0, 1]) of each of the 256 label values of a dataset: the class
+    colors, and gray levels for values that are not classes (e.g. 255 for ignored pixels)
+    Returns:
+        np.ndarray with dimensions (256, 3)
+    """
     if dataset == 'pascal' or dataset == 'coco':
-        n_classes = 21
         label_colours = get_pascal_labels()
     elif dataset == 'cityscapes':
-        n_classes = 19
         label_colours = get_cityscapes_labels()
     else:
         raise NotImplementedError
 
-    r = label_mask.copy()
-    g = label_mask.copy()
-    b = label_mask.copy()
-    for ll in range(0, n_classes):
-        r[label_mask == ll] = label_colours[ll, 0]
-        g[label_mask == ll] = label_colours[ll, 1]
-        b[label_mask == ll] = label_colours[ll, 2]
-    rgb = np.zeros((label_mask.shape[0], label_mask.shape[1], 3))
-    rgb[:, :, 0] = r / 255.0
-    rgb[:, :, 1] = g / 255.0
-    rgb[:, :, 2] = b / 255.0
-    if plot:
-        plt.imshow(rgb)
-        plt.show()
-    else:
-        return rgb
+    palette = np.repeat(np.arange(256)[:, np.newaxis], 3, axis=1)
+    palette[:len(label_colours)] = label_colours
+    return palette / 255.0
+
+
+def colorize(label_masks, palette):
+    """Color label masks of any shape (e.g. a batch) with a single palette lookup
+    Args:
+        label_masks (np.ndarray or torch.Tensor): integer class labels.
+        palette (np.ndarray): color of each label value, see get_palette.
+    Returns:
+        colors with an additional last dimension of 3, of the same type (and for
+        tensors, on the same device) as label_masks.
+    """
+    if isinstance(label_masks, torch.Tensor):
+        palette = torch.as_tensor(palette, dtype=torch.float32, device=label_masks.device)
+        return palette[label_masks.long().clamp(0, len(palette) - 1)]
+    return palette[np.clip(label_masks.astype(np.int64), 0, len(palette) - 1)]
 
 
 def encode_segmap(mask):
@@ -8,11 +8,12 @@ from dataloaders import make_data_loader
 from modeling.sync_batchnorm.replicate import patch_replication_callback
 from modeling.deeplab import *
 from utils.loss import SegmentationLosses
-from utils.calculate_weights import calculate_weigths_labels
+from utils.calculate_weights import calculate_weigths_files
 from utils.lr_scheduler import LR_Scheduler
 from utils.saver import Saver
 from utils.summaries import TensorboardSummary
 from utils.metrics import Evaluator
+from utils.distributed import all_reduce_sum, is_main_process
 
 
 class Tester(object):
@@ -28,7 +29,7 @@ class Tester(object):
 
         # Define Dataloader
         kwargs = {'num_workers': args.workers, 'pin_memory': True}
-        _, _, self.test_loader, self.nclass = make_data_loader(args, **kwargs)
+        train_loader, _, self.test_loader, self.nclass = make_data_loader(args, **kwargs)
 
         # Define network
         model = DeepLab(num_classes=self.nclass,
@@ -51,7 +52,7 @@ class Tester(object):
             if os.path.isfile(classes_weights_path):
                 weight = np.load(classes_weights_path)
             else:
-                weight = calculate_weigths_labels(args.dataset, self.train_loader, self.nclass)
+                weight = calculate_weigths_files(args, self.nclass, train_loader, args.workers)
             weight = torch.from_numpy(weight.astype(np.float32))
         else:
             weight = None
@@ -94,6 +95,7 @@ class Tester(object):
         self.evaluator.reset()
         tbar = tqdm(self.test_loader, desc='\r')
         test_loss = 0.0
+        num_images = 0
         for i, sample in enumerate(tbar):
             image, target = sample['image'], sample['label']
             if self.args.cuda:
@@ -102,30 +104,34 @@ class Tester(object):
                 output = self.model(image)
             loss = self.criterion(output, target)
             test_loss += loss.item()
+            num_images += image.shape[0]
             tbar.set_description('Test loss: %.3f' % (test_loss / (i + 1)))
-            pred = output.data.cpu().numpy()
-            target = target.cpu().numpy()
-            pred = np.argmax(pred, axis=1)
-            # Add batch sample into evaluator
-            self.evaluator.add_batch(target, pred)
+            # Add batch sample into evaluator (on the model's device)
+            self.evaluator.add_batch_logits(target, output.data)
 
             # Show 10 * 3 inference results each epoch
-            if i % (len(self.test_loader) // 10) == 0:
+            if i % (len(self.test_loader) // 10) == 0 and is_main_process():
                 global_step = i + len(self.test_loader)
-                self.summary.visualize_image(self.writer, self.args.dataset, image, torch.Tensor(target), output, global_step)
+                self.summary.visualize_image(self.writer, self.args.dataset, image, target, output, global_step)
+
+        # Sum over the test shards of all processes (no-op when not distributed)
+        self.evaluator.all_reduce()
+        test_loss, num_images = all_reduce_sum([test_loss, num_images])
 
         # Fast test during the training
         Acc = self.evaluator.Pixel_Accuracy()
         Acc_class = self.evaluator.Pixel_Accuracy_Class()
         mIoU = self.evaluator.Mean_Intersection_over_Union()
         FWIoU = self.evaluator.Frequency_Weighted_Intersection_over_Union()
+        if not is_main_process():
+            return
         self.writer.add_scalar('test/total_loss_epoch', test_loss)
         self.writer.add_scalar('test/mIoU', mIoU)
         self.writer.add_scalar('test/Acc', Acc)
         self.writer.add_scalar('test/Acc_class', Acc_class)
         self.writer.add_scalar('test/fwIoU', FWIoU)
         print('Testing:')
-        print('[numImages: %5d]' % (i * self.args.batch_size + image.data.shape[0]))
+        print('[numImages: %5d]' % num_images)
         print("Acc:{}, Acc_class:{}, mIoU:{}, fwIoU: {}".format(Acc, Acc_class, mIoU, FWIoU))
         print('Loss: %.3f' % test_loss)
 
@@ -1,33 +1,42 @@
 import argparse
 import os
+import time
 import numpy as np
 from tqdm import tqdm
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler
 
 from mypath import Path
-from dataloaders import make_data_loader
+from dataloaders import make_batch_transform, make_data_loader
 from modeling.sync_batchnorm.replicate import patch_replication_callback
 from modeling.deeplab import *
 from utils.loss import SegmentationLosses
-from utils.calculate_weights import calculate_weigths_labels
+from utils.calculate_weights import calculate_weigths_files
 from utils.lr_scheduler import LR_Scheduler
 from utils.saver import Saver
-from utils.summaries import TensorboardSummary
+from utils.summaries import AsyncImageLogger, TensorboardSummary
 from utils.metrics import Evaluator
+from utils.distributed import all_reduce_sum, barrier, is_distributed, is_main_process
 
 class Trainer(object):
     def __init__(self, args):
         self.args = args
 
-        # Define Saver
-        self.saver = Saver(args)
-        self.saver.save_experiment_config()
-        # Define Tensorboard Summary
-        self.summary = TensorboardSummary(self.saver.experiment_dir)
-        self.writer = self.summary.create_summary()
-        
+        # Define Saver and Tensorboard Summary (only on rank 0 when distributed)
+        self.saver = self.summary = self.writer = self.image_logger = None
+        if is_main_process():
+            self.saver = Saver(args)
+            self.saver.save_experiment_config()
+            self.summary = TensorboardSummary(self.saver.experiment_dir)
+            self.writer = self.summary.create_summary()
+            self.image_logger = AsyncImageLogger(self.summary, self.writer, args.dataset)
+
         # Define Dataloader
         kwargs = {'num_workers': args.workers, 'pin_memory': True}
         self.train_loader, self.val_loader, self.test_loader, self.nclass = make_data_loader(args, **kwargs)
+        self.batch_transform = make_batch_transform(args)
 
         # Define network
         model = DeepLab(num_classes=self.nclass,
@@ -46,11 +55,23 @@ class Trainer(object):
         # Define Criterion
         # whether to use class balanced weights
         if args.use_balanced_weights:
+            # (when distributed, rank 0 computes them first, and the other ranks load them)
+            if not is_main_process():
+                barrier()
             classes_weights_path = os.path.join(Path.db_root_dir(args.dataset), args.dataset+'_classes_weights.npy')
             if os.path.isfile(classes_weights_path):
                 weight = np.load(classes_weights_path)
             else:
-                weight = calculate_weigths_labels(args.dataset, self.train_loader, self.nclass)
+                # (datasets without label files are counted with a loader, which must
+                # cover the whole train set, not the shard of this process)
+                count_loader = self.train_loader
+                if is_distributed():
+                    count_loader = DataLoader(self.train_loader.dataset, batch_size=args.batch_size,
+                                              shuffle=False, collate_fn=self.train_loader.collate_fn,
+                                              **kwargs)
+                weight = calculate_weigths_files(args, self.nclass, count_loader, args.workers)
+            if is_main_process():
+                barrier()
             weight = torch.from_numpy(weight.astype(np.float32))
         else:
             weight = None
@@ -63,8 +84,15 @@ class Trainer(object):
         self.scheduler = LR_Scheduler(args.lr_scheduler, args.lr,
                                             args.epochs, len(self.train_loader))
 
+        # One process per device: native SyncBatchNorm (CUDA only) and DistributedDataParallel
+        if is_distributed():
+            if args.cuda:
+                self.model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(self.model).cuda()
+                self.model = DistributedDataParallel(self.model, device_ids=[torch.cuda.current_device()])
+            else:
+                self.model = DistributedDataParallel(self.model)
         # Using cuda
-        if args.cuda:
+        elif args.cuda:
             self.model = torch.nn.DataParallel(self.model, device_ids=self.args.gpu_ids)
             patch_replication_callback(self.model)
             self.model = self.model.cuda()
@@ -74,9 +102,9 @@ class Trainer(object):
         if args.resume is not None:
             if not os.path.isfile(args.resume):
                 raise RuntimeError("=> no checkpoint found at '{}'" .format(args.resume))
-            checkpoint = torch.load(args.resume)
+            checkpoint = torch.load(args.resume, map_location='cpu')
             args.start_epoch = checkpoint['epoch']
-            if args.cuda:
+            if args.cuda or is_distributed():
                 self.model.module.load_state_dict(checkpoint['state_dict'])
             else:
                 self.model.load_state_dict(checkpoint['state_dict'])
@@ -93,12 +121,20 @@ class Trainer(object):
     def training(self, epoch):
         train_loss = 0.0
         self.model.train()
-        tbar = tqdm(self.train_loader)
+        if isinstance(self.train_loader.sampler, DistributedSampler):
+            self.train_loader.sampler.set_epoch(epoch)
+        tbar = tqdm(self.train_loader, disable=not is_main_process())
         num_img_tr = len(self.train_loader)
+        vis_interval = self.args.vis_interval or max(num_img_tr // 10, 1)
+        num_images = 0
+        start = time.perf_counter()
         for i, sample in enumerate(tbar):
             image, target = sample['image'], sample['label']
             if self.args.cuda:
                 image, target = image.cuda(), target.cuda()
+            if self.batch_transform is not None:
+                sample = self.batch_transform({'image': image, 'label': target, 'size': sample['size']})
+                image, target = sample['image'], sample['label']
             self.scheduler(self.optimizer, i, epoch, self.best_pred)
             self.optimizer.zero_grad()
             output = self.model(image)
@@ -106,16 +142,27 @@ class Trainer(object):
             loss.backward()
             self.optimizer.step()
             train_loss += loss.item()
+            num_images += image.shape[0]
+            if not is_main_process():
+                continue
             tbar.set_description('Train loss: %.3f' % (train_loss / (i + 1)))
             self.writer.add_scalar('train/total_loss_iter', loss.item(), i + num_img_tr * epoch)
 
-            # Show 10 * 3 inference results each epoch
-            if i % (num_img_tr // 10) == 0:
+            # Show 3 inference results every vis_interval steps (by default 10 times each epoch),
+            # written in the background
+            if i % vis_interval == 0:
                 global_step = i + num_img_tr * epoch
-                self.summary.visualize_image(self.writer, self.args.dataset, image, target, output, global_step)
+                self.image_logger.log(image, target, output, global_step)
 
+        # Loss summed over the shards of all processes, and their total throughput
+        elapsed = time.perf_counter() - start
+        train_loss, num_images, world_size = all_reduce_sum([train_loss, num_images, 1])
+        train_loss /= world_size
+        if not is_main_process():
+            return
         self.writer.add_scalar('train/total_loss_epoch', train_loss, epoch)
-        print('[Epoch: %d, numImages: %5d]' % (epoch, i * self.args.batch_size + image.data.shape[0]))
+        self.writer.add_scalar('train/images_per_sec', num_images / elapsed, epoch)
+        print('[Epoch: %d, numImages: %5d, %.1f images/s]' % (epoch, num_images, num_images / elapsed))
         print('Loss: %.3f' % train_loss)
 
         if self.args.no_val:
@@ -130,37 +177,45 @@ class Trainer(object):
 
 
     def validation(self, epoch):
-        self.model.eval()
+        # (shards may have different numbers of batches, so the DDP wrapper, which
+        # synchronizes buffers in forward, is not used)
+        model = self.model.module if is_distributed() else self.model
+        model.eval()
         self.evaluator.reset()
-        tbar = tqdm(self.val_loader, desc='\r')
+        tbar = tqdm(self.val_loader, desc='\r', disable=not is_main_process())
         test_loss = 0.0
+        num_images = 0
         for i, sample in enumerate(tbar):
             image, target = sample['image'], sample['label']
             if self.args.cuda:
                 image, target = image.cuda(), target.cuda()
             with torch.no_grad():
-                output = self.model(image)
+                output = model(image)
             loss = self.criterion(output, target)
             test_loss += loss.item()
+            num_images += image.shape[0]
             tbar.set_description('Test loss: %.3f' % (test_loss / (i + 1)))
-            pred = output.data.cpu().numpy()
-            target = target.cpu().numpy()
-            pred = np.argmax(pred, axis=1)
-            # Add batch sample into evaluator
-            self.evaluator.add_batch(target, pred)
+            # Add batch sample into evaluator (on the model's device)
+            self.evaluator.add_batch_logits(target, output.data)
+
+        # Sum over the val shards of all processes (no-op when not distributed)
+        self.evaluator.all_reduce()
+        test_loss, num_images = all_reduce_sum([test_loss, num_images])
 
         # Fast test during the training
         Acc = self.evaluator.Pixel_Accuracy()
         Acc_class = self.evaluator.Pixel_Accuracy_Class()
         mIoU = self.evaluator.Mean_Intersection_over_Union()
         FWIoU = self.evaluator.Frequency_Weighted_Intersection_over_Union()
+        if not is_main_process():
+            return
         self.writer.add_scalar('val/total_loss_epoch', test_loss, epoch)
         self.writer.add_scalar('val/mIoU', mIoU, epoch)
         self.writer.add_scalar('val/Acc', Acc, epoch)
         self.writer.add_scalar('val/Acc_class', Acc_class, epoch)
         self.writer.add_scalar('val/fwIoU', FWIoU, epoch)
         print('Validation:')
-        print('[Epoch: %d, numImages: %5d]' % (epoch, i * self.args.batch_size + image.data.shape[0]))
+        print('[Epoch: %d, numImages: %5d]' % (epoch, num_images))
         print("Acc:{}, Acc_class:{}, mIoU:{}, fwIoU: {}".format(Acc, Acc_class, mIoU, FWIoU))
         print('Loss: %.3f' % test_loss)
 
@@ -197,6 +252,9 @@ def main():
                         help='whether to use sync bn (default: auto)')
     parser.add_argument('--freeze-bn', type=bool, default=False,
                         help='whether to freeze bn parameters (default: False)')
+    parser.add_argument('--batched-augment', action='store_true', default=False,
+                        help='load uint8 train images, and augment whole batches on the \
+                        gpu instead of each sample in the dataloader workers')
     parser.add_argument('--loss-type', type=str, default='ce',
                         choices=['ce', 'focal'],
                         help='loss func type (default: ce)')
@@ -233,6 +291,16 @@ def main():
                         comma-separated list of integers only (default=0)')
     parser.add_argument('--seed', type=int, default=1, metavar='S',
                         help='random seed (default: 1)')
+    # distributed training
+    parser.add_argument('--distributed', action='store_true', default=False,
+                        help='train with DistributedDataParallel, one process per gpu \
+                        (or --nprocs CPU processes), instead of DataParallel')
+    parser.add_argument('--nprocs', type=int, default=None,
+                        help='number of processes to spawn when not launched by torchrun \
+                        (default: one per gpu id)')
+    parser.add_argument('--dist-backend', type=str, default=None,
+                        choices=['nccl', 'gloo'],
+                        help='torch.distributed backend (default: nccl with cuda, else gloo)')
     # checking point
     parser.add_argument('--resume', type=str, default=None,
                         help='put the path to resuming file if needed')
@@ -246,6 +314,9 @@ def main():
                         help='evaluuation interval (default: 1)')
     parser.add_argument('--no-val', action='store_true', default=False,
                         help='skip validation during training')
+    parser.add_argument('--vis-interval', type=int, default=None,
+                        help='log inference images to tensorboard every N training \
+                        iterations (default: 10 times per epoch)')
 
     args = parser.parse_args()
     args.cuda = not args.no_cuda and torch.cuda.is_available()
@@ -255,7 +326,18 @@ def main():
         except ValueError:
             raise ValueError('Argument --gpu_ids must be a comma-separated list of integers only')
 
-    if args.sync_bn is None:
+    if args.distributed:
+        # (BatchNorm layers are converted to native SyncBatchNorm instead)
+        args.sync_bn = False
+        if 'WORLD_SIZE' in os.environ:
+            # Launched by torchrun: one process per device, LOCAL_RANK is the device
+            args.nprocs = int(os.environ['WORLD_SIZE'])
+        else:
+            args.nprocs = args.nprocs or (len(args.gpu_ids) if args.cuda else 1)
+            if args.cuda and args.nprocs > len(args.gpu_ids):
+                raise ValueError('--nprocs {} is larger than the number of --gpu-ids {}'
+                                 .format(args.nprocs, args.gpu_ids))
+    elif args.sync_bn is None:
         if args.cuda and len(args.gpu_ids) > 1:
             args.sync_bn = True
         else:
@@ -271,7 +353,7 @@ def main():
         args.epochs = epoches[args.dataset.lower()]
 
     if args.batch_size is None:
-        args.batch_size = 4 * len(args.gpu_ids)
+        args.batch_size = 4 * (args.nprocs if args.distributed else len(args.gpu_ids))
 
     if args.test_batch_size is None:
         args.test_batch_size = args.batch_size
@@ -282,22 +364,53 @@ def main():
             'cityscapes': 0.01,
             'pascal': 0.007,
         }
-        args.lr = lrs[args.dataset.lower()] / (4 * len(args.gpu_ids)) * args.batch_size
+        args.lr = lrs[args.dataset.lower()] / (4 * (args.nprocs if args.distributed else len(args.gpu_ids))) * args.batch_size
 
 
     if args.checkname is None:
         args.checkname = 'deeplab-'+str(args.backbone)
     print(args)
+
+    if not args.distributed:
+        run(0, 1, args)
+    elif 'WORLD_SIZE' in os.environ:
+        run(int(os.environ['LOCAL_RANK']), args.nprocs, args)
+    else:
+        os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+        os.environ.setdefault('MASTER_PORT', '29500')
+        mp.spawn(run, args=(args.nprocs, args), nprocs=args.nprocs)
+
+def run(local_rank, world_size, args):
+    if args.distributed:
+        if args.dist_backend is None:
+            args.dist_backend = 'nccl' if args.cuda else 'gloo'
+        if args.cuda:
+            # (under torchrun, devices are selected with CUDA_VISIBLE_DEVICES, not --gpu-ids)
+            device_id = local_rank if 'LOCAL_RANK' in os.environ else args.gpu_ids[local_rank]
+            torch.cuda.set_device(device_id)
+            args.gpu_ids = [device_id]
+        # (rank and world size from the environment under torchrun)
+        dist.init_process_group(args.dist_backend, rank=int(os.environ.get('RANK', local_rank)),
+                                world_size=world_size)
+        # The batch sizes (and the lr defaults derived from them) are for all processes
+        args.batch_size = max(args.batch_size // world_size, 1)
+        args.test_batch_size = max(args.test_batch_size // world_size, 1)
+
     torch.manual_seed(args.seed)
     trainer = Trainer(args)
-    print('Starting Epoch:', trainer.args.start_epoch)
-    print('Total Epoches:', trainer.args.epochs)
+    if is_main_process():
+        print('Starting Epoch:', trainer.args.start_epoch)
+        print('Total Epoches:', trainer.args.epochs)
     for epoch in range(trainer.args.start_epoch, trainer.args.epochs):
         trainer.training(epoch)
         if not trainer.args.no_val and epoch % args.eval_interval == (args.eval_interval - 1):
             trainer.validation(epoch)
 
-    trainer.writer.close()
+    if is_main_process():
+        trainer.image_logger.close()
+        trainer.writer.close()
+    if args.distributed:
+        dist.destroy_process_group()
 
 if __name__ == "__main__":
    main()
@@ -1,8 +1,22 @@
 import os
+import json
+import glob
+import pickle
+import argparse
+from multiprocessing import Pool
 from tqdm import tqdm
 import numpy as np
+from PIL import Image
 from mypath import Path
 
+def class_weights(frequency):
+    total_frequency = np.sum(frequency)
+    class_weights = []
+    for frequency in frequency:
+        class_weight = 1 / (np.log(1.02 + (frequency / total_frequency)))
+        class_weights.append(class_weight)
+    return np.array(class_weights)
+
 def calculate_weigths_labels(dataset, dataloader, num_classes):
     # Create an instance from the data loader
     z = np.zeros((num_classes,))
@@ -12,18 +26,150 @@ def calculate_weigths_labels(dataset, dataloader, num_classes):
     for sample in tqdm_batch:
         y = sample['label']
         y = y.detach().cpu().numpy()
+        if 'size' in sample:
+            # (batches of pad_collate, with --batched-augment: padding is not counted)
+            y = np.concatenate([label[:h, :w].ravel() for label, (h, w) in zip(y, sample['size'].tolist())])
         mask = (y >= 0) & (y < num_classes)
         labels = y[mask].astype(np.uint8)
         count_l = np.bincount(labels, minlength=num_classes)
         z += count_l
     tqdm_batch.close()
-    total_frequency = np.sum(z)
-    class_weights = []
-    for frequency in z:
-        class_weight = 1 / (np.log(1.02 + (frequency / total_frequency)))
-        class_weights.append(class_weight)
-    ret = np.array(class_weights)
+    ret = class_weights(z)
     classes_weights_path = os.path.join(Path.db_root_dir(dataset), dataset+'_classes_weights.npy')
     np.save(classes_weights_path, ret)
 
-    return ret
\ No newline at end of file
+    return ret
+
+def count_label_file(job):
+    """Pixel count of each class in a raw label file
+        :param job is (label path, number of classes, lookup table from label value to
+            class or None)
+    """
+    label_path, num_classes, lut = job
+    label = np.array(Image.open(label_path), dtype=np.uint8)
+    if lut is not None:
+        label = lut[label]
+    return np.bincount(label.ravel(), minlength=256)[:num_classes]
+
+def count_label_files(label_paths, num_classes, lut=None, cache_path=None, workers=None):
+    """Sum of the pixel counts of each class in label files, counted in a process pool.
+        Counts of each file are cached (with its size and mtime) in cache_path, so that
+        only new or modified files are read on later runs.
+        :param lut is a 256 entry lookup table applied to label values before counting
+        :return array of num_classes pixel counts
+    """
+    key = {'num_classes': num_classes, 'lut': None if lut is None else np.asarray(lut).tolist()}
+    cached = {}
+    if cache_path is not None and os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get('key') == key:
+            cached = cache['files']
+
+    files, todo = {}, []
+    for label_path in label_paths:
+        stat = os.stat(label_path)
+        entry = cached.get(label_path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            files[label_path] = entry
+        else:
+            files[label_path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+            todo.append(label_path)
+
+    print('Counting classes of %d label files (%d cached)' % (len(todo), len(files) - len(todo)))
+    if todo:
+        jobs = [(label_path, num_classes, lut) for label_path in todo]
+        # (workers is e.g. the dataloader --workers, where 0 is valid: then one per cpu)
+        with Pool(workers or None) as pool:
+            for label_path, counts in zip(todo, tqdm(pool.imap(count_label_file, jobs, chunksize=16),
+                                                     total=len(jobs))):
+                files[label_path]['counts'] = counts.tolist()
+        if cache_path is not None:
+            with open(cache_path + '.tmp', 'w') as f:
+                json.dump({'key': key, 'files': files}, f)
+            os.replace(cache_path + '.tmp', cache_path)
+
+    counts = np.zeros((num_classes,), dtype=np.int64)
+    for entry in files.values():
+        counts += entry['counts']
+    return counts
+
+def dataset_label_files(args):
+    """Raw label files of the train split of args.dataset
+        :return label paths, and the lookup table of the dataset from label value to class,
+            or None for datasets without label files (e.g. coco masks are generated from
+            annotations)
+    """
+    if args.dataset == 'cityscapes':
+        from dataloaders.datasets.cityscapes import CityscapesSegmentation
+        train_set = CityscapesSegmentation(args, split='train')
+        if train_set.encoded_labels:
+            return [train_set.label_path(path, train_set.ENCODED_SUFFIX) for path in train_set.files['train']], None
+        return [train_set.label_path(path) for path in train_set.files['train']], train_set.label_lut
+    elif args.dataset == 'pascal':
+        # (only VOC labels: SBD labels are .mat files)
+        from dataloaders.datasets.pascal import VOCSegmentation
+        return VOCSegmentation(args, split='train').categories, None
+    return None
+
+def calculate_weigths_files(args, num_classes, dataloader=None, workers=None):
+    """Class weights of the train split of args.dataset, counted from its raw label
+        files rather than from an augmented data loader epoch, and saved to
+        {dataset}_classes_weights.npy in the dataset root
+        :param dataloader is iterated instead, for datasets without label files
+    """
+    label_files = dataset_label_files(args)
+    if label_files is None:
+        if dataloader is None:
+            raise ValueError('Dataset {} has no label files, a dataloader is needed'.format(args.dataset))
+        return calculate_weigths_labels(args.dataset, dataloader, num_classes)
+    label_paths, lut = label_files
+
+    root = Path.db_root_dir(args.dataset)
+    counts = count_label_files(label_paths, num_classes, lut, workers=workers,
+                               cache_path=os.path.join(root, args.dataset + '_label_counts.json'))
+    ret = class_weights(counts)
+    np.save(os.path.join(root, args.dataset + '_classes_weights.npy'), ret)
+
+    return ret
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Class weights from label frequencies')
+    parser.add_argument('--dataset', type=str, default=None,
+                        choices=['pascal', 'cityscapes'],
+                        help='dataset whose train labels are counted')
+    parser.add_argument('--labels', type=str, default=None,
+                        help='glob of label files, e.g. of the deeplabv3 label_imgs (instead of --dataset)')
+    parser.add_argument('--num-classes', type=int, default=None,
+                        help='number of classes (default: NUM_CLASSES of the dataset)')
+    parser.add_argument('--out', type=str, default=None,
+                        help='output .npy, or .pkl for a pickled list (required with --labels)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of counting processes')
+    args = parser.parse_args()
+    args.base_size = 513
+    args.crop_size = 513
+    args.use_sbd = False
+
+    if args.labels is not None:
+        if args.num_classes is None or args.out is None:
+            parser.error('--labels requires --num-classes and --out')
+        label_paths = sorted(glob.glob(args.labels, recursive=True))
+        counts = count_label_files(label_paths, args.num_classes, workers=args.workers,
+                                   cache_path=os.path.join(os.path.dirname(args.out), 'label_counts.json'))
+        ret = class_weights(counts)
+        if args.out.endswith('.pkl'):
+            with open(args.out, 'wb') as f:
+                pickle.dump(ret.tolist(), f, protocol=2)
+        else:
+            np.save(args.out, ret)
+    elif args.dataset is not None:
+        if args.num_classes is None:
+            from dataloaders.datasets.cityscapes import CityscapesSegmentation
+            from dataloaders.datasets.pascal import VOCSegmentation
+            args.num_classes = {'cityscapes': CityscapesSegmentation,
+                                'pascal': VOCSegmentation}[args.dataset].NUM_CLASSES
+        ret = calculate_weigths_files(args, args.num_classes, workers=args.workers)
+    else:
+        parser.error('one of --dataset or --labels is required')
+    print(ret)
@@ -1,13 +1,20 @@
+import time
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class SegmentationLosses(object):
-    def __init__(self, weight=None, size_average=True, batch_average=True, ignore_index=255, cuda=False):
+    def __init__(self, weight=None, reduction='mean', batch_average=True, ignore_index=255, cuda=False):
         self.ignore_index = ignore_index
-        self.weight = weight
-        self.size_average = size_average
+        self.reduction = reduction
         self.batch_average = batch_average
         self.cuda = cuda
+        # Built once, with the class weights on the device of the logits
+        if cuda and weight is not None:
+            weight = weight.cuda()
+        self.weight = weight
+        self.criterion = nn.CrossEntropyLoss(weight=weight, ignore_index=ignore_index,
+                                             reduction=reduction)
 
     def build_loss(self, mode='ce'):
         """Choices: ['ce' or 'focal']"""
@@ -20,12 +27,7 @@ class SegmentationLosses(object):
 
     def CrossEntropyLoss(self, logit, target):
         n, c, h, w = logit.size()
-        criterion = nn.CrossEntropyLoss(weight=self.weight, ignore_index=self.ignore_index,
-                                        size_average=self.size_average)
-        if self.cuda:
-            criterion = criterion.cuda()
-
-        loss = criterion(logit, target.long())
+        loss = self.criterion(logit, target.long())
 
         if self.batch_average:
             loss /= n
@@ -33,23 +35,48 @@ class SegmentationLosses(object):
         return loss
 
     def FocalLoss(self, logit, target, gamma=2, alpha=0.5):
+        """Focal loss -alpha * w_t * (1 - p_t) ** gamma * log(p_t), weighted per pixel
+            (rather than applied to the mean cross entropy of the batch), from a single
+            log_softmax of the logits. Ignored pixels do not contribute; with
+            reduction='mean', the sum is normalized by the class weights of the other
+            pixels, like nn.CrossEntropyLoss.
+        """
         n, c, h, w = logit.size()
-        criterion = nn.CrossEntropyLoss(weight=self.weight, ignore_index=self.ignore_index,
-                                        size_average=self.size_average)
-        if self.cuda:
-            criterion = criterion.cuda()
+        target = target.long()
+        valid = target != self.ignore_index
+        target = target.masked_fill(~valid, 0)
 
-        logpt = -criterion(logit, target.long())
+        logpt = F.log_softmax(logit, dim=1).gather(1, target.unsqueeze(1)).squeeze(1)
         pt = torch.exp(logpt)
-        if alpha is not None:
-            logpt *= alpha
         loss = -((1 - pt) ** gamma) * logpt
+        if alpha is not None:
+            loss = loss * alpha
+
+        pixel_weight = valid.to(loss.dtype)
+        if self.weight is not None:
+            pixel_weight = pixel_weight * self.weight.to(loss.dtype)[target]
+        loss = (loss * pixel_weight).sum()
+        if self.reduction == 'mean':
+            loss = loss / pixel_weight.sum()
 
         if self.batch_average:
             loss /= n
 
         return loss
 
+def benchmark(loss_fn, logit, target, steps=50):
+    """:return mean seconds of a forward and backward pass of loss_fn"""
+    for _ in range(5):
+        loss_fn(logit, target).backward()
+    if logit.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        loss_fn(logit, target).backward()
+    if logit.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
 if __name__ == "__main__":
     loss = SegmentationLosses(cuda=True)
     a = torch.rand(1, 3, 7, 7).cuda()
@@ -58,6 +85,17 @@ if __name__ == "__main__":
     print(loss.FocalLoss(a, b, gamma=0, alpha=None).item())
     print(loss.FocalLoss(a, b, gamma=2, alpha=0.5).item())
 
+    # Per step time of a Cityscapes sized batch, against building the criterion per call
+    weight = torch.rand(19)
+    loss = SegmentationLosses(weight=weight, cuda=True)
+    logit = torch.randn(4, 19, 513, 513, device='cuda', requires_grad=True)
+    target = torch.randint(0, 19, (4, 513, 513), device='cuda')
+    target[:, :16] = 255
 
+    def rebuilt_ce(logit, target):
+        criterion = nn.CrossEntropyLoss(weight=weight, ignore_index=255).cuda()
+        return criterion(logit, target) / logit.size(0)
 
-
+    print('ce (rebuilt per call): %.2f ms/step' % (1000 * benchmark(rebuilt_ce, logit, target)))
+    print('ce (cached):           %.2f ms/step' % (1000 * benchmark(loss.CrossEntropyLoss, logit, target)))
+    print('focal (per pixel):     %.2f ms/step' % (1000 * benchmark(loss.FocalLoss, logit, target)))
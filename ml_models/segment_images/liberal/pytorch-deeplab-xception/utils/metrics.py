@@ -1,10 +1,28 @@
 import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils.distributed import is_distributed, reduce_device
 
 
 class Evaluator(object):
     def __init__(self, num_class):
         self.num_class = num_class
-        self.confusion_matrix = np.zeros((self.num_class,)*2)
+        self._confusion_matrix = np.zeros((self.num_class,)*2)
+        # Counts accumulated on the model's device by add_batch_logits
+        self._device_matrix = None
+
+    @property
+    def confusion_matrix(self):
+        # Device counts are only transferred (num_class**2 values) when the matrix is used
+        if self._device_matrix is not None:
+            self._confusion_matrix += self._device_matrix.view(self.num_class, self.num_class).cpu().numpy()
+            self._device_matrix = None
+        return self._confusion_matrix
+
+    @confusion_matrix.setter
+    def confusion_matrix(self, confusion_matrix):
+        self._confusion_matrix = confusion_matrix
 
     def Pixel_Accuracy(self):
         Acc = np.diag(self.confusion_matrix).sum() / self.confusion_matrix.sum()
@@ -42,8 +60,34 @@ class Evaluator(object):
         assert gt_image.shape == pre_image.shape
         self.confusion_matrix += self._generate_matrix(gt_image, pre_image)
 
+    def add_batch_logits(self, gt_image, output):
+        """Add a batch of model outputs (logits, N x C x H x W) and targets (N x H x W),
+            both torch tensors. Argmax and counting are done on their device, so that the
+            outputs are not copied to the host.
+        """
+        pre_image = output.argmax(dim=1)
+        assert gt_image.shape == pre_image.shape
+        mask = (gt_image >= 0) & (gt_image < self.num_class)
+        label = self.num_class * gt_image[mask].long() + pre_image[mask]
+        count = torch.bincount(label, minlength=self.num_class**2)
+        if self._device_matrix is None:
+            self._device_matrix = count
+        else:
+            self._device_matrix += count
+
+    def all_reduce(self):
+        """Sum confusion matrices of all processes, when each one has evaluated a
+            disjoint shard of the dataset (see dataloaders.samplers.ShardSampler)
+        """
+        if not is_distributed():
+            return
+        confusion_matrix = torch.from_numpy(self.confusion_matrix).to(reduce_device())
+        dist.all_reduce(confusion_matrix)
+        self.confusion_matrix = confusion_matrix.cpu().numpy()
+
     def reset(self):
         self.confusion_matrix = np.zeros((self.num_class,) * 2)
+        self._device_matrix = None
 
 
 
@@ -1,4 +1,6 @@
 import os
+import queue
+import threading
 import torch
 from torchvision.utils import make_grid
 from tensorboardX import SummaryWriter
@@ -15,9 +17,55 @@ class TensorboardSummary(object):
     def visualize_image(self, writer, dataset, image, target, output, global_step):
         grid_image = make_grid(image[:3].clone().cpu().data, 3, normalize=True)
         writer.add_image('Image', grid_image, global_step)
-        grid_image = make_grid(decode_seg_map_sequence(torch.max(output[:3], 1)[1].detach().cpu().numpy(),
+        # (labels are colored on their device, and only the grids are copied)
+        grid_image = make_grid(decode_seg_map_sequence(torch.max(output[:3], 1)[1].detach(),
                                                        dataset=dataset), 3, normalize=False, range=(0, 255))
-        writer.add_image('Predicted label', grid_image, global_step)
-        grid_image = make_grid(decode_seg_map_sequence(torch.squeeze(target[:3], 1).detach().cpu().numpy(),
+        writer.add_image('Predicted label', grid_image.cpu(), global_step)
+        grid_image = make_grid(decode_seg_map_sequence(torch.squeeze(target[:3], 1).detach(),
                                                        dataset=dataset), 3, normalize=False, range=(0, 255))
-        writer.add_image('Groundtruth label', grid_image, global_step)
\ No newline at end of file
+        writer.add_image('Groundtruth label', grid_image.cpu(), global_step)
+
+class AsyncImageLogger(object):
+    """Logs inference results to tensorboard from a background thread, so that the
+        training loop only snapshots a few tensors (on their device) and goes on.
+        Colorization, copies to the CPU, make_grid and writing are done by the thread.
+        When it is still busy with earlier results, new ones are dropped, rather than
+        stalling a training step.
+    """
+    def __init__(self, summary, writer, dataset, num_images=3, max_queue_size=2):
+        self.summary = summary
+        self.writer = writer
+        self.dataset = dataset
+        self.num_images = num_images
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, image, target, output, global_step):
+        """:return whether the results were queued (False if they were dropped)"""
+        if self.queue.full():
+            return False
+        n = self.num_images
+        snapshot = (image[:n].detach().clone(), target[:n].detach().clone(),
+                    output[:n].detach().clone(), global_step)
+        try:
+            self.queue.put_nowait(snapshot)
+        except queue.Full:
+            return False
+        return True
+
+    def close(self):
+        """Writes the queued results, and stops the thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image, target, output, global_step = item
+            try:
+                self.summary.visualize_image(self.writer, self.dataset, image, target, output, global_step)
+            except Exception as e:
+                print('Could not log images of step %d: %s' % (global_step, e))
@@ -0,0 +1,58 @@
+# compare the throughput (imgs/s) of loading and augmenting train batches per
+# sample in the DataLoader workers (DatasetTrain) against loading uint8 imgs and
+# augmenting whole batches on the GPU (use_batched_augmentation in train.py).
+
+import sys
+
+sys.path.append("/root/deeplabv3")
+from datasets import DatasetTrain # (this needs to be imported before torch, because cv2 needs to be imported before torch for some reason)
+
+sys.path.append("/root/deeplabv3/utils")
+from utils import augment_batch
+
+import torch
+import torch.utils.data
+
+import time
+
+num_batches = 100
+batch_size = 3
+num_workers_list = [1, 4]
+
+def run(batched_augmentation, num_workers):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    train_dataset = DatasetTrain(cityscapes_data_path="/root/deeplabv3/data/cityscapes",
+                                 cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta",
+                                 batched_augmentation=batched_augmentation)
+    train_loader = torch.utils.data.DataLoader(dataset=train_dataset,
+                                               batch_size=batch_size, shuffle=True,
+                                               num_workers=num_workers, pin_memory=True)
+
+    num_imgs = 0
+    for step, (imgs, label_imgs) in enumerate(train_loader):
+        if step == 2: # (start timing after the workers have started)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            start_time = time.time()
+        elif step == num_batches + 2:
+            break
+
+        imgs = imgs.to(device, non_blocking=True)
+        label_imgs = label_imgs.to(device, non_blocking=True)
+        if batched_augmentation:
+            imgs, label_imgs = augment_batch(imgs, label_imgs)
+
+        if step >= 2:
+            num_imgs += imgs.shape[0]
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return num_imgs/(time.time() - start_time)
+
+if __name__ == "__main__":
+    for num_workers in num_workers_list:
+        for batched_augmentation in [False, True]:
+            imgs_per_sec = run(batched_augmentation, num_workers)
+            print ("%-10s num_workers: %d, %.1f imgs/s" % ("batched" if batched_augmentation else "per sample",
+                                                           num_workers, imgs_per_sec))
@@ -0,0 +1,129 @@
+# compare mixed precision and channels_last training modes (use_amp and
+# use_channels_last in train.py) against the fp32 baseline, in step time, peak
+# memory and val mIoU after the same number of training steps.
+
+import sys
+
+sys.path.append("/root/deeplabv3")
+from datasets import DatasetTrain, DatasetVal # (this needs to be imported before torch, because cv2 needs to be imported before torch for some reason)
+
+sys.path.append("/root/deeplabv3/model")
+from deeplabv3 import DeepLabV3
+
+sys.path.append("/root/deeplabv3/utils")
+from utils import add_weight_decay, autocast
+
+import torch
+import torch.utils.data
+import torch.nn as nn
+import torch.multiprocessing as mp
+
+import numpy as np
+import pickle
+import resource
+import time
+
+num_train_steps = 200
+num_val_batches = 50
+batch_size = 3
+learning_rate = 0.0001
+
+modes = [("fp32", False, False),
+         ("amp", True, False),
+         ("channels_last", False, True),
+         ("amp+channels_last", True, True)]
+
+def run_mode(use_amp, use_channels_last, queue):
+    torch.manual_seed(0)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # (bf16 autocast on CPU)
+    memory_format = torch.channels_last if use_channels_last else torch.preserve_format
+
+    network = DeepLabV3("benchmark_precision", project_dir="/root/deeplabv3").to(device)
+    network = network.to(memory_format=memory_format)
+    num_classes = network.num_classes
+
+    train_dataset = DatasetTrain(cityscapes_data_path="/root/deeplabv3/data/cityscapes",
+                                 cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta")
+    val_dataset = DatasetVal(cityscapes_data_path="/root/deeplabv3/data/cityscapes",
+                             cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta")
+    train_loader = torch.utils.data.DataLoader(dataset=train_dataset,
+                                               batch_size=batch_size, shuffle=True,
+                                               num_workers=1)
+    val_loader = torch.utils.data.DataLoader(dataset=val_dataset,
+                                             batch_size=batch_size, shuffle=False,
+                                             num_workers=1)
+
+    params = add_weight_decay(network, l2_value=0.0001)
+    optimizer = torch.optim.Adam(params, lr=learning_rate)
+
+    with open("/root/deeplabv3/data/cityscapes/meta/class_weights.pkl", "rb") as file: # (needed for python3)
+        class_weights = np.array(pickle.load(file))
+    class_weights = torch.from_numpy(class_weights).type(torch.FloatTensor).to(device)
+    loss_fn = nn.CrossEntropyLoss(weight=class_weights)
+    scaler = torch.cuda.amp.GradScaler(enabled=use_amp and device.type == "cuda")
+
+    ############################################################################
+    # train (only the training steps are timed):
+    ############################################################################
+    network.train()
+    step = 0
+    train_time = 0.0
+    while step < num_train_steps:
+        for imgs, label_imgs in train_loader:
+            if step == num_train_steps:
+                break
+            imgs = imgs.to(device).to(memory_format=memory_format) # (shape: (batch_size, 3, img_h, img_w))
+            label_imgs = label_imgs.type(torch.LongTensor).to(device) # (shape: (batch_size, img_h, img_w))
+
+            start_time = time.perf_counter()
+            with autocast(device.type, use_amp):
+                outputs = network(imgs) # (shape: (batch_size, num_classes, img_h, img_w))
+                loss = loss_fn(outputs, label_imgs)
+            optimizer.zero_grad()
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            train_time += time.perf_counter() - start_time
+            step += 1
+
+    ############################################################################
+    # val mIoU (the last class is unlabeled, and not counted):
+    ############################################################################
+    network.eval()
+    confusion_matrix = torch.zeros(num_classes*num_classes, dtype=torch.int64, device=device)
+    for step, (imgs, label_imgs, img_ids) in enumerate(val_loader):
+        if step == num_val_batches:
+            break
+        with torch.no_grad(), autocast(device.type, use_amp):
+            imgs = imgs.to(device).to(memory_format=memory_format)
+            label_imgs = label_imgs.type(torch.LongTensor).to(device)
+            pred_label_imgs = network(imgs).argmax(dim=1) # (shape: (batch_size, img_h, img_w))
+            confusion_matrix += torch.bincount((label_imgs*num_classes + pred_label_imgs).flatten(),
+                                               minlength=num_classes*num_classes)
+    confusion_matrix = confusion_matrix.view(num_classes, num_classes)[:-1, :-1].cpu().numpy().astype(np.float64)
+    intersection = np.diag(confusion_matrix)
+    union = confusion_matrix.sum(axis=0) + confusion_matrix.sum(axis=1) - intersection
+    mIoU = np.nanmean(intersection/np.where(union > 0, union, np.nan))
+
+    if device.type == "cuda":
+        memory = torch.cuda.max_memory_allocated()/2**20
+    else:
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10 # (peak resident memory, kilobytes on Linux)
+    queue.put((1000*train_time/num_train_steps, memory, 100*mIoU))
+
+if __name__ == "__main__":
+    # (each mode runs in its own process, so peak memory is measured separately)
+    context = mp.get_context("spawn")
+    results = []
+    for name, use_amp, use_channels_last in modes:
+        queue = context.Queue()
+        process = context.Process(target=run_mode, args=(use_amp, use_channels_last, queue))
+        process.start()
+        results.append((name,) + queue.get())
+        process.join()
+
+    print ("%-18s %14s %14s %14s" % ("mode", "step time (ms)", "memory (MB)", "val mIoU (%)"))
+    for name, step_time, memory, mIoU in results:
+        print ("%-18s %14.1f %14.1f %14.2f  (%.2fx)" % (name, step_time, memory, mIoU, results[0][1]/step_time))
@@ -6,6 +6,8 @@ import torch.utils.data
 import numpy as np
 import cv2
 import os
+import json
+from PIL import Image
 
 train_dirs = ["jena/", "zurich/", "weimar/", "ulm/", "tubingen/", "stuttgart/",
               "strasbourg/", "monchengladbach/", "krefeld/", "hanover/",
@@ -14,9 +16,56 @@ train_dirs = ["jena/", "zurich/", "weimar/", "ulm/", "tubingen/", "stuttgart/",
 val_dirs = ["frankfurt/", "munster/", "lindau/"]
 test_dirs = ["berlin", "bielefeld", "bonn", "leverkusen", "mainz", "munich"]
 
+def get_dir_mtimes(dir_paths):
+    try:
+        return {dir_path: os.stat(dir_path).st_mtime_ns for dir_path in dir_paths}
+    except OSError:
+        return None
+
+def load_manifest(manifest_path, dir_paths, make_example):
+    # load the list of examples in dir_paths from a manifest file, or (re)build it
+    # if there is none yet or if any of the dirs was modified since (i.e. files
+    # were added or removed). only the dirs are checked, so that files don't need
+    # to be listed on every launch (which takes minutes on network storage).
+    # make_example(dir_path, file_name) returns the example dict of a file.
+    # examples are in sorted order, and also hold file size and image dimensions.
+    previous = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if get_dir_mtimes(manifest["dir_mtimes"]) == manifest["dir_mtimes"] and manifest["dir_paths"] == dir_paths:
+            return manifest["examples"]
+        # (reuse examples of files that are still there)
+        previous = {example["img_path"]: example for example in manifest["examples"]}
+
+    dir_mtimes = get_dir_mtimes(dir_paths)
+    examples = []
+    for dir_path in dir_paths:
+        for file_name in sorted(os.listdir(dir_path)):
+            example = make_example(dir_path, file_name)
+            if example["img_path"] in previous:
+                examples.append(previous[example["img_path"]])
+                continue
+            with Image.open(example["img_path"]) as img: # (only reads the header)
+                example["img_w"], example["img_h"] = img.size
+            example["size"] = os.path.getsize(example["img_path"])
+            examples.append(example)
+
+    try:
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump({"dir_paths": dir_paths, "dir_mtimes": dir_mtimes, "examples": examples}, file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    except OSError as e:
+        print ("could not write dataset manifest %s: %s" % (manifest_path, e))
+    return examples
+
 class DatasetTrain(torch.utils.data.Dataset):
-    def __init__(self, cityscapes_data_path, cityscapes_meta_path):
+    def __init__(self, cityscapes_data_path, cityscapes_meta_path, batched_augmentation=False):
         self.img_dir = cityscapes_data_path + "/leftImg8bit/train/"
+        # (with batched_augmentation == True, uint8 imgs and labels are returned before
+        # the random flip, scale, crop and normalization, which are then done for whole
+        # batches on the GPU by utils.augment_batch)
+        self.batched_augmentation = batched_augmentation
         self.label_dir = cityscapes_meta_path + "/label_imgs/"
 
         self.img_h = 1024
@@ -25,25 +74,24 @@ class DatasetTrain(torch.utils.data.Dataset):
         self.new_img_h = 512
         self.new_img_w = 1024
 
-        self.examples = []
-        for train_dir in train_dirs:
-            train_img_dir_path = self.img_dir + train_dir
+        self.examples = load_manifest(cityscapes_meta_path + "/manifest_train.json",
+                                      [self.img_dir + train_dir for train_dir in train_dirs],
+                                      self.make_example)
 
-            file_names = os.listdir(train_img_dir_path)
-            for file_name in file_names:
-                img_id = file_name.split("_leftImg8bit.png")[0]
+        self.num_examples = len(self.examples)
 
-                img_path = train_img_dir_path + file_name
+    def make_example(self, train_img_dir_path, file_name):
+        img_id = file_name.split("_leftImg8bit.png")[0]
 
-                label_img_path = self.label_dir + img_id + ".png"
+        img_path = train_img_dir_path + file_name
 
-                example = {}
-                example["img_path"] = img_path
-                example["label_img_path"] = label_img_path
-                example["img_id"] = img_id
-                self.examples.append(example)
+        label_img_path = self.label_dir + img_id + ".png"
 
-        self.num_examples = len(self.examples)
+        example = {}
+        example["img_path"] = img_path
+        example["label_img_path"] = label_img_path
+        example["img_id"] = img_id
+        return example
 
     def __getitem__(self, index):
         example = self.examples[index]
@@ -62,6 +110,10 @@ class DatasetTrain(torch.utils.data.Dataset):
         label_img = cv2.resize(label_img, (self.new_img_w, self.new_img_h),
                                interpolation=cv2.INTER_NEAREST) # (shape: (512, 1024))
 
+        if self.batched_augmentation:
+            # convert numpy -> torch (uint8, to be augmented on the GPU):
+            return (torch.from_numpy(img), torch.from_numpy(label_img)) # (shape: (512, 1024, 3), (512, 1024))
+
         # flip the img and the label with 0.5 probability:
         flip = np.random.randint(low=0, high=2)
         if flip == 1:
@@ -148,26 +200,24 @@ class DatasetVal(torch.utils.data.Dataset):
         self.new_img_h = 512
         self.new_img_w = 1024
 
-        self.examples = []
-        for val_dir in val_dirs:
-            val_img_dir_path = self.img_dir + val_dir
+        self.examples = load_manifest(cityscapes_meta_path + "/manifest_val.json",
+                                      [self.img_dir + val_dir for val_dir in val_dirs],
+                                      self.make_example)
 
-            file_names = os.listdir(val_img_dir_path)
-            for file_name in file_names:
-                img_id = file_name.split("_leftImg8bit.png")[0]
+        self.num_examples = len(self.examples)
 
-                img_path = val_img_dir_path + file_name
+    def make_example(self, val_img_dir_path, file_name):
+        img_id = file_name.split("_leftImg8bit.png")[0]
 
-                label_img_path = self.label_dir + img_id + ".png"
-                label_img = cv2.imread(label_img_path, -1) # (shape: (1024, 2048))
+        img_path = val_img_dir_path + file_name
 
-                example = {}
-                example["img_path"] = img_path
-                example["label_img_path"] = label_img_path
-                example["img_id"] = img_id
-                self.examples.append(example)
+        label_img_path = self.label_dir + img_id + ".png"
 
-        self.num_examples = len(self.examples)
+        example = {}
+        example["img_path"] = img_path
+        example["label_img_path"] = label_img_path
+        example["img_id"] = img_id
+        return example
 
     def __getitem__(self, index):
         example = self.examples[index]
@@ -222,20 +272,20 @@ class DatasetSeq(torch.utils.data.Dataset):
         self.new_img_h = 512
         self.new_img_w = 1024
 
-        self.examples = []
+        self.examples = load_manifest(cityscapes_meta_path + "/manifest_seq_" + sequence + ".json",
+                                      [self.img_dir], self.make_example)
 
-        file_names = os.listdir(self.img_dir)
-        for file_name in file_names:
-            img_id = file_name.split("_leftImg8bit.png")[0]
+        self.num_examples = len(self.examples)
 
-            img_path = self.img_dir + file_name
+    def make_example(self, img_dir, file_name):
+        img_id = file_name.split("_leftImg8bit.png")[0]
 
-            example = {}
-            example["img_path"] = img_path
-            example["img_id"] = img_id
-            self.examples.append(example)
+        img_path = img_dir + file_name
 
-        self.num_examples = len(self.examples)
+        example = {}
+        example["img_path"] = img_path
+        example["img_id"] = img_id
+        return example
 
     def __getitem__(self, index):
         example = self.examples[index]
@@ -267,20 +317,22 @@ class DatasetThnSeq(torch.utils.data.Dataset):
     def __init__(self, thn_data_path):
         self.img_dir = thn_data_path + "/"
 
-        self.examples = []
+        # (the manifest is stored next to, not inside, the scanned dir, since writing
+        # it would change the dir's mtime)
+        self.examples = load_manifest(thn_data_path.rstrip("/") + "_manifest.json",
+                                      [self.img_dir], self.make_example)
 
-        file_names = os.listdir(self.img_dir)
-        for file_name in file_names:
-            img_id = file_name.split(".png")[0]
+        self.num_examples = len(self.examples)
 
-            img_path = self.img_dir + file_name
+    def make_example(self, img_dir, file_name):
+        img_id = file_name.split(".png")[0]
 
-            example = {}
-            example["img_path"] = img_path
-            example["img_id"] = img_id
-            self.examples.append(example)
+        img_path = img_dir + file_name
 
-        self.num_examples = len(self.examples)
+        example = {}
+        example["img_path"] = img_path
+        example["img_id"] = img_id
+        return example
 
     def __getitem__(self, index):
         example = self.examples[index]
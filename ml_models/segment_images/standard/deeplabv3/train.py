@@ -8,7 +8,7 @@ sys.path.append("/root/deeplabv3/model")
 from deeplabv3 import DeepLabV3
 
 sys.path.append("/root/deeplabv3/utils")
-from utils import add_weight_decay
+from utils import add_weight_decay, autocast, augment_batch, BackgroundWriter, state_dict_snapshot
 
 import torch
 import torch.utils.data
@@ -22,6 +22,8 @@ import pickle
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import cv2
 
 import time
@@ -32,11 +34,24 @@ model_id = "1"
 num_epochs = 1000
 batch_size = 3
 learning_rate = 0.0001
+# opt-in training modes (see benchmark_precision.py for a comparison with fp32):
+use_amp = False # (mixed precision: fp16 autocast with gradient scaling)
+use_channels_last = False # (channels_last memory format for the model and inputs)
+memory_format = torch.channels_last if use_channels_last else torch.preserve_format
+# (batch losses are summed on the GPU, and only copied to the CPU (which waits for
+# the GPU to finish all queued work) every loss_sync_interval steps and at the end
+# of each epoch, instead of after every step)
+loss_sync_interval = 50
+# (load uint8 imgs and do the random flip, scale and crop, and the normalization, for
+# whole batches on the GPU, see benchmark_augmentation.py for a comparison)
+use_batched_augmentation = False
 
 network = DeepLabV3(model_id, project_dir="/root/deeplabv3").cuda()
+network = network.to(memory_format=memory_format)
 
 train_dataset = DatasetTrain(cityscapes_data_path="/root/deeplabv3/data/cityscapes",
-                             cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta")
+                             cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta",
+                             batched_augmentation=use_batched_augmentation)
 val_dataset = DatasetVal(cityscapes_data_path="/root/deeplabv3/data/cityscapes",
                          cityscapes_meta_path="/root/deeplabv3/data/cityscapes/meta")
 
@@ -63,6 +78,29 @@ class_weights = Variable(class_weights.type(torch.FloatTensor)).cuda()
 # loss function
 loss_fn = nn.CrossEntropyLoss(weight=class_weights)
 
+# (with use_amp == False, the scaler passes the loss and the optimization step through)
+scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+
+def save_pickle(obj, path):
+    with open(path, "wb") as file:
+        pickle.dump(obj, file)
+
+def save_loss_plot(epoch_losses, title, path):
+    # (uses a Figure instead of plt, since pyplot is not thread safe)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(epoch_losses, "k^")
+    ax.plot(epoch_losses, "k")
+    ax.set_ylabel("loss")
+    ax.set_xlabel("epoch")
+    ax.set_title(title)
+    fig.savefig(path)
+
+# (the loss pickles and plots, and the checkpoints, are written in the background
+# while the next epoch runs)
+writer = BackgroundWriter()
+
 epoch_losses_train = []
 epoch_losses_val = []
 for epoch in range(num_epochs):
@@ -74,41 +112,42 @@ for epoch in range(num_epochs):
     ############################################################################
     # train:
     ############################################################################
+    epoch_start = time.time()
     network.train() # (set in training mode, this affects BatchNorm and dropout)
-    batch_losses = []
+    loss_sum = torch.zeros((), device="cuda") # (sum of the batch losses, on the GPU)
     for step, (imgs, label_imgs) in enumerate(train_loader):
         #current_time = time.time()
 
-        imgs = Variable(imgs).cuda() # (shape: (batch_size, 3, img_h, img_w))
-        label_imgs = Variable(label_imgs.type(torch.LongTensor)).cuda() # (shape: (batch_size, img_h, img_w))
+        if use_batched_augmentation:
+            imgs, label_imgs = augment_batch(imgs.cuda(), label_imgs.cuda())
+
+        imgs = Variable(imgs).cuda().to(memory_format=memory_format) # (shape: (batch_size, 3, img_h, img_w))
+        label_imgs = Variable(label_imgs.long()).cuda() # (shape: (batch_size, img_h, img_w))
 
-        outputs = network(imgs) # (shape: (batch_size, num_classes, img_h, img_w))
+        with autocast("cuda", use_amp):
+            outputs = network(imgs) # (shape: (batch_size, num_classes, img_h, img_w))
 
-        # compute the loss:
-        loss = loss_fn(outputs, label_imgs)
-        loss_value = loss.data.cpu().numpy()
-        batch_losses.append(loss_value)
+            # compute the loss:
+            loss = loss_fn(outputs, label_imgs)
+        loss_sum += loss.detach().float()
 
         # optimization step:
         optimizer.zero_grad() # (reset gradients)
-        loss.backward() # (compute gradients)
-        optimizer.step() # (perform optimization step)
+        scaler.scale(loss).backward() # (compute gradients)
+        scaler.step(optimizer) # (perform optimization step)
+        scaler.update()
+
+        if (step+1) % loss_sync_interval == 0:
+            print ("step %d: train loss %g" % (step+1, loss_sum.item()/(step+1)))
 
         #print (time.time() - current_time)
 
-    epoch_loss = np.mean(batch_losses)
+    epoch_loss = loss_sum.item()/(step+1)
     epoch_losses_train.append(epoch_loss)
-    with open("%s/epoch_losses_train.pkl" % network.model_dir, "wb") as file:
-        pickle.dump(epoch_losses_train, file)
+    writer.submit(save_pickle, list(epoch_losses_train), "%s/epoch_losses_train.pkl" % network.model_dir)
     print ("train loss: %g" % epoch_loss)
-    plt.figure(1)
-    plt.plot(epoch_losses_train, "k^")
-    plt.plot(epoch_losses_train, "k")
-    plt.ylabel("loss")
-    plt.xlabel("epoch")
-    plt.title("train loss per epoch")
-    plt.savefig("%s/epoch_losses_train.png" % network.model_dir)
-    plt.close(1)
+    writer.submit(save_loss_plot, list(epoch_losses_train), "train loss per epoch",
+                  "%s/epoch_losses_train.png" % network.model_dir)
 
     print ("####")
 
@@ -116,33 +155,30 @@ for epoch in range(num_epochs):
     # val:
     ############################################################################
     network.eval() # (set in evaluation mode, this affects BatchNorm and dropout)
-    batch_losses = []
+    loss_sum = torch.zeros((), device="cuda")
     for step, (imgs, label_imgs, img_ids) in enumerate(val_loader):
-        with torch.no_grad(): # (corresponds to setting volatile=True in all variables, this is done during inference to reduce memory consumption)
-            imgs = Variable(imgs).cuda() # (shape: (batch_size, 3, img_h, img_w))
+        with torch.no_grad(), autocast("cuda", use_amp): # (corresponds to setting volatile=True in all variables, this is done during inference to reduce memory consumption)
+            imgs = Variable(imgs).cuda().to(memory_format=memory_format) # (shape: (batch_size, 3, img_h, img_w))
             label_imgs = Variable(label_imgs.type(torch.LongTensor)).cuda() # (shape: (batch_size, img_h, img_w))
 
             outputs = network(imgs) # (shape: (batch_size, num_classes, img_h, img_w))
 
             # compute the loss:
             loss = loss_fn(outputs, label_imgs)
-            loss_value = loss.data.cpu().numpy()
-            batch_losses.append(loss_value)
+            loss_sum += loss.float()
 
-    epoch_loss = np.mean(batch_losses)
+    epoch_loss = loss_sum.item()/(step+1)
     epoch_losses_val.append(epoch_loss)
-    with open("%s/epoch_losses_val.pkl" % network.model_dir, "wb") as file:
-        pickle.dump(epoch_losses_val, file)
+    writer.submit(save_pickle, list(epoch_losses_val), "%s/epoch_losses_val.pkl" % network.model_dir)
     print ("val loss: %g" % epoch_loss)
-    plt.figure(1)
-    plt.plot(epoch_losses_val, "k^")
-    plt.plot(epoch_losses_val, "k")
-    plt.ylabel("loss")
-    plt.xlabel("epoch")
-    plt.title("val loss per epoch")
-    plt.savefig("%s/epoch_losses_val.png" % network.model_dir)
-    plt.close(1)
-
-    # save the model weights to disk:
+    writer.submit(save_loss_plot, list(epoch_losses_val), "val loss per epoch",
+                  "%s/epoch_losses_val.png" % network.model_dir)
+
+    # save the model weights to disk (in the background, from a copy of the weights):
     checkpoint_path = network.checkpoints_dir + "/model_" + model_id +"_epoch_" + str(epoch+1) + ".pth"
-    torch.save(network.state_dict(), checkpoint_path)
+    writer.submit(torch.save, state_dict_snapshot(network), checkpoint_path)
+
+    # (time of the epoch, without the writes that are still running in the background)
+    print ("epoch time: %g s" % (time.time() - epoch_start))
+
+writer.close()
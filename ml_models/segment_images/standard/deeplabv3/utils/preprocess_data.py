@@ -5,6 +5,7 @@ import numpy as np
 import cv2
 import os
 from collections import namedtuple
+from multiprocessing import Pool
 
 # (NOTE! this is taken from the official Cityscapes scripts:)
 Label = namedtuple( 'Label' , [
@@ -83,9 +84,12 @@ labels = [
     Label(  'license plate'        , -1 ,       19 , 'vehicle'         , 7       , False        , True         , (  0,  0,142) ),
 ]
 
-# create a function which maps id to trainId:
+# create a lookup table which maps id to trainId (ids that are not listed, e.g. the
+# license plate id -1, are mapped to 19):
 id_to_trainId = {label.id: label.trainId for label in labels}
-id_to_trainId_map_func = np.vectorize(id_to_trainId.get)
+id_to_trainId_lut = np.full(256, 19, dtype=np.uint8)
+for label_id, trainId in id_to_trainId.items():
+    id_to_trainId_lut[label_id % 256] = trainId
 
 train_dirs = ["jena/", "zurich/", "weimar/", "ulm/", "tubingen/", "stuttgart/",
               "strasbourg/", "monchengladbach/", "krefeld/", "hanover/",
@@ -97,94 +101,80 @@ test_dirs = ["berlin", "bielefeld", "bonn", "leverkusen", "mainz", "munich"]
 cityscapes_data_path = "/root/deeplabv3/data/cityscapes"
 cityscapes_meta_path = "/root/deeplabv3/data/cityscapes/meta"
 
-if not os.path.exists(cityscapes_meta_path):
-    os.makedirs(cityscapes_meta_path)
-if not os.path.exists(cityscapes_meta_path + "/label_imgs"):
-    os.makedirs(cityscapes_meta_path + "/label_imgs")
-
-################################################################################
-# convert all labels to label imgs with trainId pixel values (and save to disk):
-################################################################################
-train_label_img_paths = []
-
-img_dir = cityscapes_data_path + "/leftImg8bit/train/"
-label_dir = cityscapes_data_path + "/gtFine/train/"
-for train_dir in train_dirs:
-    print (train_dir)
-
-    train_img_dir_path = img_dir + train_dir
-    train_label_dir_path = label_dir + train_dir
-
-    file_names = os.listdir(train_img_dir_path)
-    for file_name in file_names:
-        img_id = file_name.split("_leftImg8bit.png")[0]
-
-        gtFine_img_path = train_label_dir_path + img_id + "_gtFine_labelIds.png"
-        gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (1024, 2048))
-
-        # convert gtFine_img from id to trainId pixel values:
-        label_img = id_to_trainId_map_func(gtFine_img) # (shape: (1024, 2048))
-        label_img = label_img.astype(np.uint8)
-
-        cv2.imwrite(cityscapes_meta_path + "/label_imgs/" + img_id + ".png", label_img)
-        train_label_img_paths.append(cityscapes_meta_path + "/label_imgs/" + img_id + ".png")
-
-img_dir = cityscapes_data_path + "/leftImg8bit/val/"
-label_dir = cityscapes_data_path + "/gtFine/val/"
-for val_dir in val_dirs:
-    print (val_dir)
-
-    val_img_dir_path = img_dir + val_dir
-    val_label_dir_path = label_dir + val_dir
-
-    file_names = os.listdir(val_img_dir_path)
-    for file_name in file_names:
-        img_id = file_name.split("_leftImg8bit.png")[0]
-
-        gtFine_img_path = val_label_dir_path + img_id + "_gtFine_labelIds.png"
-        gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (1024, 2048))
-
-        # convert gtFine_img from id to trainId pixel values:
-        label_img = id_to_trainId_map_func(gtFine_img) # (shape: (1024, 2048))
-        label_img = label_img.astype(np.uint8)
-
-        cv2.imwrite(cityscapes_meta_path + "/label_imgs/" + img_id + ".png", label_img)
-
-################################################################################
-# compute the class weigths:
-################################################################################
-print ("computing class weights")
-
 num_classes = 20
-
-trainId_to_count = {}
-for trainId in range(num_classes):
-    trainId_to_count[trainId] = 0
-
-# get the total number of pixels in all train label_imgs that are of each object class:
-for step, label_img_path in enumerate(train_label_img_paths):
-    if step % 100 == 0:
-        print (step)
-
-    label_img = cv2.imread(label_img_path, -1)
-
-    for trainId in range(num_classes):
-        # count how many pixels in label_img which are of object class trainId:
-        trainId_mask = np.equal(label_img, trainId)
-        trainId_count = np.sum(trainId_mask)
-
-        # add to the total count:
-        trainId_to_count[trainId] += trainId_count
-
-# compute the class weights according to the ENet paper:
-class_weights = []
-total_count = sum(trainId_to_count.values())
-for trainId, count in trainId_to_count.items():
-    trainId_prob = float(count)/float(total_count)
-    trainId_weight = 1/np.log(1.02 + trainId_prob)
-    class_weights.append(trainId_weight)
-
-print (class_weights)
-
-with open(cityscapes_meta_path + "/class_weights.pkl", "wb") as file:
-    pickle.dump(class_weights, file, protocol=2) # (protocol=2 is needed to be able to open this file with python2)
+num_processes = os.cpu_count()
+
+def convert_label_img(paths):
+    gtFine_img_path, label_img_path = paths
+
+    gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (1024, 2048))
+
+    # convert gtFine_img from id to trainId pixel values:
+    label_img = id_to_trainId_lut[gtFine_img] # (shape: (1024, 2048))
+
+    cv2.imwrite(label_img_path, label_img)
+
+    # count how many pixels in label_img which are of each object class:
+    return np.bincount(label_img.ravel(), minlength=num_classes)
+
+def list_label_imgs(split, dirs):
+    img_dir = cityscapes_data_path + "/leftImg8bit/" + split + "/"
+    label_dir = cityscapes_data_path + "/gtFine/" + split + "/"
+
+    paths = []
+    for city_dir in dirs:
+        img_dir_path = img_dir + city_dir
+        label_dir_path = label_dir + city_dir
+
+        file_names = os.listdir(img_dir_path)
+        for file_name in file_names:
+            img_id = file_name.split("_leftImg8bit.png")[0]
+
+            gtFine_img_path = label_dir_path + img_id + "_gtFine_labelIds.png"
+            label_img_path = cityscapes_meta_path + "/label_imgs/" + img_id + ".png"
+            paths.append((gtFine_img_path, label_img_path))
+
+    return paths
+
+if __name__ == "__main__":
+    if not os.path.exists(cityscapes_meta_path):
+        os.makedirs(cityscapes_meta_path)
+    if not os.path.exists(cityscapes_meta_path + "/label_imgs"):
+        os.makedirs(cityscapes_meta_path + "/label_imgs")
+
+    ############################################################################
+    # convert all labels to label imgs with trainId pixel values (and save to
+    # disk), and count pixels of each object class in the train label imgs:
+    ############################################################################
+    train_paths = list_label_imgs("train", train_dirs)
+    val_paths = list_label_imgs("val", val_dirs)
+    print ("converting %d train and %d val label imgs" % (len(train_paths), len(val_paths)))
+
+    trainId_counts = np.zeros(num_classes, dtype=np.int64)
+    with Pool(num_processes) as pool:
+        # (train label imgs first, so that their counts come first in order:)
+        for step, counts in enumerate(pool.imap(convert_label_img, train_paths + val_paths, chunksize=8)):
+            if step % 100 == 0:
+                print (step)
+            if step < len(train_paths):
+                trainId_counts += counts[:num_classes]
+
+    ############################################################################
+    # compute the class weigths:
+    ############################################################################
+    print ("computing class weights")
+
+    trainId_to_count = {trainId: trainId_counts[trainId] for trainId in range(num_classes)}
+
+    # compute the class weights according to the ENet paper:
+    class_weights = []
+    total_count = sum(trainId_to_count.values())
+    for trainId, count in trainId_to_count.items():
+        trainId_prob = float(count)/float(total_count)
+        trainId_weight = 1/np.log(1.02 + trainId_prob)
+        class_weights.append(trainId_weight)
+
+    print (class_weights)
+
+    with open(cityscapes_meta_path + "/class_weights.pkl", "wb") as file:
+        pickle.dump(class_weights, file, protocol=2) # (protocol=2 is needed to be able to open this file with python2)
@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 
 import numpy as np
+import threading
+import queue
 
 def add_weight_decay(net, l2_value, skip_list=()):
     # https://raberrytv.wordpress.com/2017/10/29/pytorch-weight-decay-made-easy/
@@ -19,7 +21,109 @@ def add_weight_decay(net, l2_value, skip_list=()):
 
     return [{'params': no_decay, 'weight_decay': 0.0}, {'params': decay, 'weight_decay': l2_value}]
 
+def autocast(device_type="cuda", enabled=True):
+    # mixed precision: fp16 on GPU (use together with a GradScaler), bf16 on CPU
+    dtype = torch.float16 if device_type == "cuda" else torch.bfloat16
+    return torch.autocast(device_type=device_type, dtype=dtype, enabled=enabled)
+
+def augment_batch(imgs, label_imgs, crop_size=256, min_scale=0.7, max_scale=2.0,
+                  mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+    # (the random flip, scale and crop, and the normalization, of DatasetTrain, for a
+    # whole batch of uint8 imgs (shape: (batch_size, img_h, img_w, 3)) and label_imgs
+    # (shape: (batch_size, img_h, img_w)) on their device (e.g. the GPU). the nearest
+    # neighbour scaling and the crop are done together, as one gather of the crop
+    # pixels from the original img, for the img and label_img alike)
+    batch_size, img_h, img_w = label_imgs.shape
+    device = imgs.device
+
+    # flip the img and the label with 0.5 probability:
+    flip = torch.rand(batch_size, device=device) < 0.5
+
+    # randomly scale the img and the label:
+    scale = min_scale + (max_scale - min_scale)*torch.rand(batch_size, device=device)
+    new_img_h = (scale*img_h).long()
+    new_img_w = (scale*img_w).long()
+
+    # select a crop_size x crop_size random crop (of the scaled img):
+    start_y = (torch.rand(batch_size, device=device)*(new_img_h - crop_size).float()).long()
+    start_x = (torch.rand(batch_size, device=device)*(new_img_w - crop_size).float()).long()
+    ys = start_y[:, None] + torch.arange(crop_size, device=device) # (shape: (batch_size, crop_size))
+    xs = start_x[:, None] + torch.arange(crop_size, device=device) # (shape: (batch_size, crop_size))
+
+    # pixels of the original img (nearest neighbour, like cv2.INTER_NEAREST):
+    ys = torch.clamp((ys.float()*img_h/new_img_h[:, None].float()).long(), max=img_h-1)
+    xs = torch.clamp((xs.float()*img_w/new_img_w[:, None].float()).long(), max=img_w-1)
+    xs = torch.where(flip[:, None], img_w-1-xs, xs)
+
+    batch = torch.arange(batch_size, device=device)[:, None, None]
+    imgs = imgs[batch, ys[:, :, None], xs[:, None, :]] # (shape: (batch_size, crop_size, crop_size, 3))
+    label_imgs = label_imgs[batch, ys[:, :, None], xs[:, None, :]] # (shape: (batch_size, crop_size, crop_size))
+
+    # normalize the img (with the mean and std for the pretrained ResNet):
+    mean = torch.tensor(mean, device=device)
+    std = torch.tensor(std, device=device)
+    imgs = (imgs.float()/255.0 - mean)/std
+    imgs = imgs.permute(0, 3, 1, 2).contiguous() # (shape: (batch_size, 3, crop_size, crop_size))
+
+    return imgs, label_imgs
+
+class BackgroundWriter(object):
+    # (runs write jobs (e.g. saving checkpoints, pickles and plots) in order on a
+    # background thread, so that they do not block training. at most max_queue_size
+    # jobs wait at a time, after that submit() blocks. an exception in a job is
+    # raised by the next submit() or by close())
+
+    def __init__(self, max_queue_size=4):
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((fn, args))
+
+    def close(self):
+        # (waits for all submitted jobs to finish)
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            fn, args = job
+            if self.error is None:
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.error = e
+
+def state_dict_snapshot(net):
+    # (copy of the weights, made on their device: unlike a copy to the cpu, this
+    # does not wait for the queued gpu work to finish. the copy is safe to save from
+    # a background thread while training goes on)
+    return {name: tensor.detach().clone() for name, tensor in net.state_dict().items()}
+
 # function for colorizing a label image:
+def _colorize(img, label_to_color):
+    # (colorize all pixels at once by indexing a palette with the label img, which
+    # also works for batches of label imgs, and for torch tensors on any device.
+    # only the RGB values of each color are used:)
+    palette = np.array([label_to_color[label][:3] for label in range(len(label_to_color))], dtype=np.float64)
+    if torch.is_tensor(img):
+        palette = torch.as_tensor(palette, dtype=torch.float32, device=img.device)
+        return palette[img.long()] # (shape: (*img.shape, 3))
+
+    img_color = palette[img] # (shape: (*img.shape, 3))
+
+    return img_color
+
 def label_img_to_color(img):
     label_to_color = {
         0: [128, 64,128],
@@ -44,16 +148,7 @@ def label_img_to_color(img):
         19: [81,  0, 81]
         }
 
-    img_height, img_width = img.shape
-
-    img_color = np.zeros((img_height, img_width, 3))
-    for row in range(img_height):
-        for col in range(img_width):
-            label = img[row, col]
-
-            img_color[row, col] = np.array(label_to_color[label])
-
-    return img_color
+    return _colorize(img, label_to_color)
 
 # function for colorizing a label image:
 def crop_to_sidewalk(img):
@@ -82,13 +177,4 @@ def crop_to_sidewalk(img):
         19: [255,255,255]
         }
 
-    img_height, img_width = img.shape
-
-    img_color = np.zeros((img_height, img_width, 3))
-    for row in range(img_height):
-        for col in range(img_width):
-            label = img[row, col]
-
-            img_color[row, col] = np.array(label_to_color[label])
-
-    return img_color
+    return _colorize(img, label_to_color)
@@ -0,0 +1,90 @@
+# camera-ready
+
+import threading
+import queue
+
+import numpy as np
+import cv2
+
+class CombinedVideoWriter(object):
+    # (writes combined frames (img and pred on top, overlay centered below) to a
+    # video in frame order. frames are encoded (and optionally saved as pngs) on an
+    # encoder thread, so that encoding overlaps with inference. frames can be added
+    # in any order, they are held in a small reorder buffer until all frames before
+    # them have been written)
+
+    def __init__(self, video_path, fps, frame_ids, png_dir=None, max_queue_size=16):
+        self.video_path = video_path
+        self.fps = fps
+        self.png_dir = png_dir
+        self.frame_indices = {frame_id: index for index, frame_id in enumerate(sorted(frame_ids))}
+
+        self.out = None
+        self.combined_img = None
+        self.error = None
+
+        # (bounded, so that inference blocks instead of buffering the whole sequence if encoding is slower)
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self._encode)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, frame_id, img, pred_img, overlayed_img):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((frame_id, img, pred_img, overlayed_img))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.out is not None:
+            self.out.release()
+        if self.error is not None:
+            raise self.error
+
+    def _encode(self):
+        pending = {} # (reorder buffer, frame index -> frame)
+        next_index = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue # (keep draining the queue so that add() does not block)
+
+            try:
+                frame_id, img, pred_img, overlayed_img = item
+                if self.png_dir is not None:
+                    cv2.imwrite(self.png_dir + "/" + frame_id + ".png", img)
+                    cv2.imwrite(self.png_dir + "/" + frame_id + "_pred.png", pred_img)
+                    cv2.imwrite(self.png_dir + "/" + frame_id + "_overlayed.png", overlayed_img)
+
+                pending[self.frame_indices[frame_id]] = (img, pred_img, overlayed_img)
+                while next_index in pending:
+                    self._write(*pending.pop(next_index))
+                    next_index += 1
+            except Exception as e:
+                self.error = e
+
+        # (frames after a missing frame id are written in order as well)
+        if self.error is None:
+            try:
+                for index in sorted(pending):
+                    self._write(*pending[index])
+            except Exception as e:
+                self.error = e
+
+    def _write(self, img, pred_img, overlayed_img):
+        img_h = img.shape[0]
+        img_w = img.shape[1]
+
+        if self.out is None:
+            self.out = cv2.VideoWriter(self.video_path, cv2.VideoWriter_fourcc(*"MJPG"), self.fps, (2*img_w, 2*img_h))
+            self.combined_img = np.zeros((2*img_h, 2*img_w, 3), dtype=np.uint8)
+
+        combined_img = self.combined_img # (reused for all frames, only the image areas are overwritten)
+        combined_img[0:img_h, 0:img_w] = img
+        combined_img[0:img_h, img_w:(2*img_w)] = pred_img
+        combined_img[img_h:(2*img_h), (int(img_w/2)):(img_w + int(img_w/2))] = overlayed_img
+
+        self.out.write(combined_img)
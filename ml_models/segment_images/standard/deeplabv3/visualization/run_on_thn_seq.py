@@ -10,6 +10,7 @@ from deeplabv3 import DeepLabV3
 
 sys.path.append("/root/deeplabv3/utils")
 from utils import label_img_to_color
+from video import CombinedVideoWriter
 
 import torch
 import torch.utils.data
@@ -27,6 +28,8 @@ import cv2
 
 batch_size = 2
 
+save_pngs = False # (also save the raw, pred and overlayed img of each frame as pngs)
+
 network = DeepLabV3("eval_seq_thn", project_dir="/root/deeplabv3").cuda()
 network.load_state_dict(torch.load("/root/deeplabv3/pretrained_models/model_13_2_2_2_epoch_580.pth"))
 
@@ -40,7 +43,11 @@ val_loader = torch.utils.data.DataLoader(dataset=val_dataset,
                                          num_workers=1)
 
 network.eval() # (set in evaluation mode, this affects BatchNorm and dropout)
-unsorted_img_ids = []
+
+# (frames are streamed to the video in img_id order while inference runs)
+video_writer = CombinedVideoWriter("%s/thn_combined.avi" % network.model_dir, 12,
+                                   [example["img_id"] for example in val_dataset.examples],
+                                   png_dir=network.model_dir if save_pngs else None)
 for step, (imgs, img_ids) in enumerate(val_loader):
     with torch.no_grad(): # (corresponds to setting volatile=True in all variables, this is done during inference to reduce memory consumption)
         imgs = Variable(imgs).cuda() # (shape: (batch_size, 3, img_h, img_w))
@@ -70,32 +77,6 @@ for step, (imgs, img_ids) in enumerate(val_loader):
             overlayed_img = 0.35*img + 0.65*pred_label_img_color
             overlayed_img = overlayed_img.astype(np.uint8)
 
-            img_h = overlayed_img.shape[0]
-            img_w = overlayed_img.shape[1]
-
-            # TODO! do this using network.model_dir instead
-            cv2.imwrite(network.model_dir + "/" + img_id + ".png", img)
-            cv2.imwrite(network.model_dir + "/" + img_id + "_pred.png", pred_label_img_color)
-            cv2.imwrite(network.model_dir + "/" + img_id + "_overlayed.png", overlayed_img)
-
-            unsorted_img_ids.append(img_id)
-
-################################################################################
-# create visualization video:
-################################################################################
-out = cv2.VideoWriter("%s/thn_combined.avi" % network.model_dir, cv2.VideoWriter_fourcc(*"MJPG"), 12, (2*img_w, 2*img_h))
-sorted_img_ids = sorted(unsorted_img_ids)
-for img_id in sorted_img_ids:
-    img = cv2.imread(network.model_dir + "/" + img_id + ".png", -1)
-    pred_img = cv2.imread(network.model_dir + "/" + img_id + "_pred.png", -1)
-    overlayed_img = cv2.imread(network.model_dir + "/" + img_id + "_overlayed.png", -1)
-
-    combined_img = np.zeros((2*img_h, 2*img_w, 3), dtype=np.uint8)
-
-    combined_img[0:img_h, 0:img_w] = img
-    combined_img[0:img_h, img_w:(2*img_w)] = pred_img
-    combined_img[img_h:(2*img_h), (int(img_w/2)):(img_w + int(img_w/2))] = overlayed_img
-
-    out.write(combined_img)
+            video_writer.add(img_id, img, pred_label_img_color, overlayed_img)
 
-out.release()
+video_writer.close()
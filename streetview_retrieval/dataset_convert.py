@@ -6,31 +6,48 @@
 import sys
 import tools.coordinate_conversion as corcv
 
-def run():
-    if len(sys.argv) != 5:
-        print("Usage: dataset_convert.py [STREETDB_IN] [SIDEWALKDB_IN] [STREETDB_OUT] [SIDEWALKDB_OUT]")
-        return
-
-    _STREET_DB_PATH, _SIDEWALK_DB_PATH, _STREET_CONV_OUT_PATH, _SIDEWALK_CONV_OUT_PATH = sys.argv[1:]
+def conversion_params(street_db, sidewalk_db, street_out, sidewalk_out, backend="epsg.io"):
+    """ Conversion settings (CoordinateConversionToolset arguments) for Boston's
+        street and sidewalk datasets.
+    """
     _SRC_CODE, _TGT_CODE = 6492, 4326  # EPSG codes
 
     _PARAMS_ST = {
-        "input_file": _STREET_DB_PATH, "output_file": _STREET_CONV_OUT_PATH,
+        "input_file": street_db, "output_file": street_out,
         "source_code": _SRC_CODE, "target_code": _TGT_CODE, "xy_coordinate": True,
-        "record_map": lambda rec: {"name": rec["GREENBOOK"]}
+        "record_map": lambda rec: {"name": rec["GREENBOOK"]}, "backend": backend
     }
 
     _PARAMS_SW = {
-        "input_file": _SIDEWALK_DB_PATH, "output_file": _SIDEWALK_CONV_OUT_PATH,
-        "source_code": _SRC_CODE, "target_code": _TGT_CODE, "xy_coordinate": True
+        "input_file": sidewalk_db, "output_file": sidewalk_out,
+        "source_code": _SRC_CODE, "target_code": _TGT_CODE, "xy_coordinate": True,
+        "backend": backend
     }
+    return _PARAMS_ST, _PARAMS_SW
+
+def run():
+    arguments = sys.argv[1:]
+    backend = "pyproj" if "--local" in arguments else "epsg.io"
+    workers = [int(arg.split("=", 1)[1]) for arg in arguments if arg.startswith("--workers=")]
+    workers = workers[-1] if workers else 1
+    arguments = [arg for arg in arguments if arg != "--local" and not arg.startswith("--workers=")]
+    if len(arguments) != 4:
+        print("Usage: dataset_convert.py [STREETDB_IN] [SIDEWALKDB_IN] [STREETDB_OUT] [SIDEWALKDB_OUT] "
+              "[--local] [--workers=N]")
+        return
+
+    _PARAMS_ST, _PARAMS_SW = conversion_params(*arguments, backend=backend)
+
+    if backend == "pyproj":
+        error = corcv.CoordinateConversionToolset(**_PARAMS_SW).cross_check()
+        print("Local conversion matches reference points (max error: {:.2e})".format(error))
 
     print("Start converting street dataset coordinates...")
     toolkit = corcv.CoordinateConversionToolset(**_PARAMS_ST)
-    toolkit.convert_shape_coordinates()
+    toolkit.convert_shape_coordinates(workers=workers, verbose=True)
     print("Start converting sidewalk dataset coordinates...")
     toolkit = corcv.CoordinateConversionToolset(**_PARAMS_SW)
-    toolkit.convert_shape_coordinates()
+    toolkit.convert_shape_coordinates(workers=workers, verbose=True)
     print("Done!")
 
 
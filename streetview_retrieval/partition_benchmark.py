@@ -0,0 +1,172 @@
+""" partition_benchmark.py
+
+    Compare batched geodesic partitioning against the former per-quad
+    linear lat/lon interpolation, in both speed and partition spacing, and
+    oriented rectangle quad fitting against the former extreme-point heuristic,
+    in number of generated queries and in how well quads cover their blocks.
+"""
+import sys
+import json
+import math
+from time import perf_counter
+import numpy as np
+import tools.sidewalk_partition as sp
+
+
+def approx_quadrilateral_extreme(pts):
+    """ Former approx_quadrilateral: points obtaining extreme X/Y values.
+    """
+    if type(pts) != list or len(pts) < 3:
+        return None
+    data_arr = np.array(pts)
+    p_idx_min_x, p_idx_min_y = data_arr.argmin(axis=0)
+    p_idx_max_x, p_idx_max_y = data_arr.argmax(axis=0)
+    return data_arr[p_idx_max_x], data_arr[p_idx_max_y], \
+            data_arr[p_idx_min_x], data_arr[p_idx_min_y]
+
+
+def is_convex_quad(quad):
+    """ Whether a quad is convex and not degenerate. Extreme-point quads may
+        self-intersect, or have coinciding corners (e.g. when one point has both
+        the maximal X and Y values).
+    """
+    quad = np.asarray(quad, dtype=np.float64)
+    edges = np.roll(quad, -1, axis=0) - quad
+    cross = edges[:, 0] * np.roll(edges[:, 1], -1) - edges[:, 1] * np.roll(edges[:, 0], -1)
+    tol = 1e-9 * (edges ** 2).sum(axis=1).max()
+    return bool(np.all(cross > tol) or np.all(cross < -tol))
+
+
+def overlap_area(poly, quad, tool):
+    """ Area of the part of a polygon inside a convex quad, by clipping the polygon
+        with the half-plane of each quad side.
+    """
+    if np.cross(quad[1] - quad[0], quad[2] - quad[1]) < 0:
+        quad = quad[::-1]
+    parts = [poly]
+    for corner, next_corner in zip(quad, np.roll(quad, -1, axis=0)):
+        normal = np.array([next_corner[1] - corner[1], corner[0] - next_corner[0]])
+        parts = [clipped for part in parts
+                 for clipped in tool._clip_half_plane(part, normal, corner @ normal)]
+    return sum(tool.polygon_area(part) for part in parts)
+
+
+def coverage(pts, quads, tool):
+    """ Share of block area inside its quads, and share of quad area outside the
+        block (covered by redundant queries). Computed in a local metric plane.
+
+        Return:
+            (tuple[2](float)) Covered share of block, excess share of quads
+    """
+    poly, frame = tool._to_local(np.array(pts, dtype=np.float64))
+    lon_0, lat_0, lon_scale = frame
+    local_quads = [np.stack([(np.asarray(quad)[:, 0] - lon_0) * lon_scale,
+                             (np.asarray(quad)[:, 1] - lat_0) * tool._METERS_PER_DEGREE],
+                            axis=-1) for quad in quads]
+    block_area = tool.polygon_area(poly)
+    quads_area = sum(tool.polygon_area(quad) for quad in local_quads)
+    inside = sum(overlap_area(poly, quad, tool) for quad in local_quads)
+    return min(inside / block_area, 1.0), max(1.0 - inside / quads_area, 0.0)
+
+
+def partition_linear(quad, part_length):
+    """ Former partition_with_direction: per-quad geopy lengths and np.linspace
+        in raw lon/lat space.
+    """
+    tool = sp.SidewalkQueryToolkit
+    line_points_ref = [(0, 1), (1, 2), (2, 3), (3, 0)]
+    quad_yx = [np.array([y, x]) for (x, y) in quad]
+    side_lengths = [tool.compute_coordinate_distance(quad_yx[i1], quad_yx[i2])
+                    for i1, i2 in line_points_ref]
+    ref_side_1_idx = np.argmax(side_lengths)
+    ref_side_1 = line_points_ref[ref_side_1_idx]
+    start_1, end_1 = quad[ref_side_1[0]], quad[ref_side_1[1]]
+    ref_side_2 = line_points_ref[(ref_side_1_idx + 2) % 4]
+    start_2, end_2 = quad[ref_side_2[1]], quad[ref_side_2[0]]
+    partition_size = math.ceil(side_lengths[ref_side_1_idx] / float(part_length))
+    partitions_1 = np.linspace(start_1, end_1, partition_size * 2, endpoint=False)[1::2]
+    partitions_2 = np.linspace(start_2, end_2, partition_size * 2, endpoint=False)[1::2]
+    partition_centers = [tuple(np.mean([seg_cen_1, seg_cen_2], axis=0))
+                         for (seg_cen_1, seg_cen_2) in zip(partitions_1, partitions_2)]
+    return partition_centers, tool.get_angels(start_1, end_1, False)
+
+
+def spacing_error(centers, owners, part_counts, tool):
+    """ Max deviation (in meters) of distances between adjacent centers from the
+        mean spacing of their quad.
+    """
+    same_quad = owners[1:] == owners[:-1]
+    gaps = tool.geodesic_distance(centers[:-1], centers[1:])[same_quad]
+    gap_owner = owners[1:][same_quad]
+    mean_gap = np.bincount(gap_owner, gaps, len(part_counts)) / \
+               np.maximum(np.bincount(gap_owner, minlength=len(part_counts)), 1)
+    return np.abs(gaps - mean_gap[gap_owner]).max() if len(gaps) else 0.0
+
+
+def run():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: partition_benchmark.py [SIDEWALKDB_CONVERTED] ([PART_LEN])")
+        return
+    part_len = float(sys.argv[2]) if len(sys.argv) == 3 else 20.0
+    tool = sp.SidewalkQueryToolkit
+
+    with open(sys.argv[1], "r") as fd_r:
+        polygons = [json.loads(line)["points"] for line in fd_r]
+
+    # Quad fitting: each partition results in two camera queries
+    time_start = perf_counter()
+    fitted = [tool.approx_quadrilaterals(pts) for pts in polygons]
+    time_fit = perf_counter() - time_start
+    extreme = [quad for quad in map(approx_quadrilateral_extreme, polygons) if quad]
+    queries_extreme = 2 * len(tool.partition_quads(extreme, part_len)[0])
+    queries_fitted = 2 * len(tool.partition_quads(
+        [quad for quads in fitted for quad in quads], part_len)[0])
+    # Coverage of blocks with non-degenerate area, leaving out degenerate extreme quads
+    blocks = [(pts, quads) for pts, quads in zip(polygons, fitted)
+              if quads and tool.polygon_area(np.array(pts, dtype=np.float64)) > 0]
+    cover_fitted = np.array([coverage(pts, quads, tool) for pts, quads in blocks])
+    extreme_quads = [np.array(approx_quadrilateral_extreme(pts)) for pts, _ in blocks]
+    cover_extreme = np.array([coverage(pts, [quad], tool)
+                              for (pts, _), quad in zip(blocks, extreme_quads)
+                              if is_convex_quad(quad)]).reshape(-1, 2)
+    queries_diff = queries_extreme - queries_fitted
+    print("Quad fitting: {:.3f} s, {} of {} blocks split into multiple quads".format(
+        time_fit, sum(len(quads) > 1 for quads in fitted), len(polygons)))
+    print("Queries: extreme points {}, oriented rectangles {} ({} {})".format(
+        queries_extreme, queries_fitted, abs(queries_diff),
+        "fewer" if queries_diff >= 0 else "more"))
+    print("Mean share of block inside quads: extreme points {:.3f}, oriented rectangles "
+          "{:.3f}".format(cover_extreme[:, 0].mean(), cover_fitted[:, 0].mean()))
+    print("Mean share of quad area outside block: extreme points {:.3f}, oriented rectangles "
+          "{:.3f}".format(cover_extreme[:, 1].mean(), cover_fitted[:, 1].mean()))
+    print("({} of {} extreme point quads are degenerate or self-intersecting, and left "
+          "out)".format(len(blocks) - len(cover_extreme), len(blocks)))
+
+    quads = extreme
+    print("Partitioning {} quads with part_len={}".format(len(quads), part_len))
+
+    time_start = perf_counter()
+    linear = [partition_linear(quad, part_len) for quad in quads]
+    time_linear = perf_counter() - time_start
+
+    time_start = perf_counter()
+    centers, owners, _ = tool.partition_quads(quads, part_len)
+    time_batch = perf_counter() - time_start
+
+    lin_centers = np.array([cent for cents, _ in linear for cent in cents]).reshape(-1, 2)
+    lin_owners = np.repeat(np.arange(len(linear)), [len(cents) for cents, _ in linear])
+    part_counts = np.bincount(owners, minlength=len(quads))
+
+    print("Linear loop:    {:.3f} s, {} partitions".format(time_linear, len(lin_centers)))
+    print("Geodesic batch: {:.3f} s, {} partitions ({:.1f}x)".format(
+        time_batch, len(centers), time_linear / max(time_batch, 1e-9)))
+    print("Max spacing error (m): linear {:.4f}, geodesic {:.4f}".format(
+        spacing_error(lin_centers, lin_owners, part_counts, tool),
+        spacing_error(centers, owners, part_counts, tool)))
+    if len(lin_centers) == len(centers):
+        print("Max center shift (m): {:.4f}".format(
+            tool.geodesic_distance(lin_centers, centers).max()))
+
+
+if __name__ == "__main__":
+    run()
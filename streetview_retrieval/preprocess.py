@@ -0,0 +1,63 @@
+""" preprocess.py
+
+    Single entry point for street and sidewalk preprocessing: coordinate
+    conversion, street indexing, partitioning and query generation. Stages
+    whose inputs and parameters are unchanged are skipped on re-run.
+"""
+import argparse
+import dataset_convert
+import tools.preprocess_pipeline as pp
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Combined preprocessing routine for Boston \
+                                     StreetCaster project, with cached intermediate artifacts.")
+    """
+        Required Arguments
+    """
+    parser.add_argument("--street_db", dest="street_db", type=str, required=True,
+                        help="Shapefile dataset of streets.")
+    parser.add_argument("--sidewalk_db", dest="sidewalk_db", type=str, required=True,
+                        help="Shapefile dataset of sidewalks.")
+    parser.add_argument("--work_path", dest="work_path", type=str, required=True,
+                        help="Folder path to store intermediate artifacts (converted datasets \
+                        and street index).")
+    parser.add_argument("--out_path", dest="out_path", type=str, required=True,
+                        help="Output folder path to store query parameters and metadata.")
+
+    """
+        Optional Arguments
+    """
+    parser.add_argument("--local", dest="local", required=False, action="store_true",
+                        help="Convert coordinates locally with pyproj instead of epsg.io.")
+    parser.add_argument("--workers", dest="workers", type=int, required=False, default=1,
+                        help="Number of worker processes for coordinate conversion.")
+    parser.add_argument("--part_len", dest="part_len", type=float, required=False,
+                        help="Partition lengh for sidewalk blocks (in meters).")
+    parser.add_argument("--threshold", dest="threshold", type=float, required=False,
+                        help="Threshod for identifying matching street segment (in degrees).")
+    parser.add_argument("--shot_angle", dest="shot_angle", type=float, required=False,
+                        help="Camera angle difference to sidwalk's direction (in degrees).")
+    parser.add_argument("--shot_dist", dest="shot_dist", type=float, required=False,
+                        help="Camera distance to sidewalk partition's center (in meters).")
+    parser.add_argument("--columnar", dest="columnar", required=False, action="store_true",
+                        help="Also write queries and sidewalk info as memory-mappable NumPy \
+                        columns under out_path/columnar.")
+    parser.add_argument("--verbose", dest="verbose", required=False, action="store_true",
+                        help="Print out progress of each stage.")
+
+    return parser.parse_args()
+
+def run():
+    """ Main routine.
+    """
+    args = parse_args()
+    street_params, sidewalk_params = dataset_convert.conversion_params(
+        args.street_db, args.sidewalk_db, None, None, "pyproj" if args.local else "epsg.io")
+    query_params = {key: getattr(args, key) for key in
+                    ("part_len", "threshold", "shot_angle", "shot_dist", "columnar")
+                    if getattr(args, key)}
+    pp.PreprocessPipeline(street_params, sidewalk_params, args.work_path, args.out_path,
+                          query_params, args.workers, args.verbose).run()
+
+if __name__ == "__main__":
+    run()
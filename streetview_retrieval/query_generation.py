@@ -28,16 +28,45 @@ def parse_args():
                         help="Camera angle difference to sidwalk's direction (in degrees).")
     parser.add_argument("--shot_dist", dest="shot_dist", type=float, required=False,
                         help="Camera distance to sidewalk partition's center (in meters).")
+    parser.add_argument("--tile_level", dest="tile_level", type=int, required=False,
+                        help="Level of global Hilbert curve tiles that sidewalks are grouped \
+                        and ordered by (2^level tiles per axis).")
+    parser.add_argument("--tiles", dest="tiles", type=int, nargs="+", required=False,
+                        help="Only generate queries for sidewalks in these tiles.")
+    parser.add_argument("--bbox", dest="bbox", type=float, nargs=4, required=False,
+                        metavar=("LEFT", "BOTTOM", "RIGHT", "TOP"),
+                        help="Only generate queries for sidewalks inside this lon-lat \
+                        bounding box.")
+    parser.add_argument("--incremental", dest="incremental", required=False, action="store_true",
+                        help="Reuse results of the previous run in out_path, and only regenerate \
+                        queries for added, modified or street-affected sidewalks.")
+    parser.add_argument("--columnar", dest="columnar", required=False, action="store_true",
+                        help="Also write queries and sidewalk info as memory-mappable NumPy \
+                        columns under out_path/columnar.")
+    parser.add_argument("--sweep_part_len", dest="sweep_part_len", type=float, nargs="+",
+                        required=False, help="Sweep mode: partition lengths to evaluate.")
+    parser.add_argument("--sweep_shot_angle", dest="sweep_shot_angle", type=float, nargs="+",
+                        required=False, help="Sweep mode: camera angles to evaluate.")
+    parser.add_argument("--sweep_shot_dist", dest="sweep_shot_dist", type=float, nargs="+",
+                        required=False, help="Sweep mode: camera distances to evaluate.")
     parser.add_argument("--verbose", dest="verbose", required=False, action="store_true",
                         help="Print out query parameter settings for each partition.")
 
-    return {key: val for key, val in vars(parser.parse_args()).items() if val}
+    # (tile_level 0 is a valid level, the other options are left out when unset or 0)
+    return {key: val for key, val in vars(parser.parse_args()).items()
+            if val or (key == "tile_level" and val is not None)}
 
 def run():
     """ Main routine.
     """
     arguments = parse_args()
-    sp.QueryGenerationRunner(**arguments).run()
+    sweep = [arguments.pop(key, None) for key in
+             ("sweep_part_len", "sweep_shot_angle", "sweep_shot_dist")]
+    runner = sp.QueryGenerationRunner(**arguments)
+    if any(sweep):
+        runner.sweep(*sweep)
+    else:
+        runner.run()
 
 if __name__ == "__main__":
     run()
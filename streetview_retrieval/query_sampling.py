@@ -11,13 +11,30 @@ import csv
 from random import randint, sample
 from copy import deepcopy
 import tools.streetview_retrieval as sr
+import tools.sidewalk_partition as sp
 
 
 def query_count(filepath):
+    if os.path.isdir(filepath):
+        return len(sp.QueryColumnStore.read(filepath)["sidewalk_index"])
     with open(filepath, "r") as fd_r:
         result = len(fd_r.readlines())
     return result
 
+def query_rows(file_queries, file_meta):
+    """ Iterate (metadata dict, query params) pairs, either from text outputs, or from
+        columnar outputs if file_queries is a folder (file_meta is ignored then).
+    """
+    if os.path.isdir(file_queries):
+        headers = sp.QueryGenerationRunner.META_HEADERS
+        for m_row, query_json in sp.QueryColumnStore.iter_metadata(file_queries):
+            yield {key: str(val) for key, val in zip(headers, m_row)}, query_json
+        return
+    with open(file_meta, newline='') as meta_csv, open(file_queries) as query_file:
+        m_reader = csv.DictReader(meta_csv)
+        for m_dict, q_line in zip(m_reader, query_file):
+            yield m_dict, json.loads(q_line)
+
 def sample_runner(file_queries, file_meta, sample_size, credential_path, output_info=None, subsample=None):
     print("Initialize search tool...")
     qrtool = sr.StreetviewQueryToolset(credential_path=credential_path, verbose=True)
@@ -51,42 +68,39 @@ def sample_runner(file_queries, file_meta, sample_size, credential_path, output_
     stream_ct = 0
 
     print("Sampling...")
-    with open(file_meta, newline='') as meta_csv, open(file_queries) as query_file:
-        m_reader = csv.DictReader(meta_csv)
-        for row_id, (m_dict, q_line) in enumerate(zip(m_reader, query_file.readlines())):
-            # Step 0: Work under subsampling
-            if subsample and (row_id not in sample_list):
-                continue
-            # Step 1: Form parameters and check data availability
-            print("Handling data id: {}".format(row_id))
-            query_json = json.loads(q_line)
-            query_data_m["location"] = "{0:f},{1:f}".format(*(query_json["location"][::-1]))
-            query_data_m["heading"] = query_json["heading"]
-            pano_id = qrtool.get_meta(query_data_m)
+    for row_id, (m_dict, query_json) in enumerate(query_rows(file_queries, file_meta)):
+        # Step 0: Work under subsampling
+        if subsample and (row_id not in sample_list):
+            continue
+        # Step 1: Form parameters and check data availability
+        print("Handling data id: {}".format(row_id))
+        query_data_m["location"] = "{0:f},{1:f}".format(*(query_json["location"][::-1]))
+        query_data_m["heading"] = query_json["heading"]
+        pano_id = qrtool.get_meta(query_data_m)
 
-            if pano_id:
-                query_data_s["pano"] = pano_id
-                query_data_s["heading"] = query_json["heading"]
-                # Step 2-1: For the first k ones, insert them anyway
-                if stream_ct < k:
-                    buckets[stream_ct] = {"row_id": row_id, "meta": m_dict, "query": deepcopy(query_data_s)}
-                # Step 2-2: For items afterward, do resevoir sampling
-                else:
-                    rv_decision = randint(0, stream_ct)
-                    if rv_decision < k:
-                        buckets[rv_decision] = {"row_id": row_id, "meta": m_dict, "query": deepcopy(query_data_s)}
-                # Increment counter
-                stream_ct += 1
+        if pano_id:
+            query_data_s["pano"] = pano_id
+            query_data_s["heading"] = query_json["heading"]
+            # Step 2-1: For the first k ones, insert them anyway
+            if stream_ct < k:
+                buckets[stream_ct] = {"row_id": row_id, "meta": m_dict, "query": deepcopy(query_data_s)}
+            # Step 2-2: For items afterward, do resevoir sampling
+            else:
+                rv_decision = randint(0, stream_ct)
+                if rv_decision < k:
+                    buckets[rv_decision] = {"row_id": row_id, "meta": m_dict, "query": deepcopy(query_data_s)}
+            # Increment counter
+            stream_ct += 1
 
-        # Step 3: Make queries based on sampled result
-        print("Query based on sample result...")
-        # For safety.
-        if output_info:
-            fd_w = open(output_info, "w")
-            for q_item in buckets:
-                fd_w.write("{}\n".format(json.dumps(q_item)))
-            fd_w.close()
-        print("Done!")
+    # Step 3: Make queries based on sampled result
+    print("Query based on sample result...")
+    # For safety.
+    if output_info:
+        fd_w = open(output_info, "w")
+        for q_item in buckets:
+            fd_w.write("{}\n".format(json.dumps(q_item)))
+        fd_w.close()
+    print("Done!")
 
 def run():
     if not 5 <= len(sys.argv) <= 6:
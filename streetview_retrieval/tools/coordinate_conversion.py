@@ -3,16 +3,24 @@
     Author: Po-Yu Hsieh (pyhsieh@bu.edu)
     Last update: 2019/05/01
 
-    Simple coordinate transform on Shapefile datasetwith the help of MapTiler's API
+    Simple coordinate transform on Shapefile datasetwith the help of MapTiler's API,
+    or locally with pyproj.
 
     Reference:
         Official Website: http://epsg.io/
         GitHub Repo:      https://github.com/klokantech/epsg.io
 """
 import json
-from time import sleep
+from time import sleep, time
+from collections import deque
+from multiprocessing import Pool
+import numpy as np
 import requests
 import shapefile
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
 
 class CoordinateConversionToolset():
     """ Simple toolkit for onverting shape data of a Shapefile dataset.
@@ -20,8 +28,26 @@ class CoordinateConversionToolset():
 
     _URL_CONVERSION = "https://epsg.io/trans"
     _BULK_SIZE = 90
+    BACKENDS = ("epsg.io", "pyproj")
 
-    def __init__(self, input_file, output_file, source_code, target_code, xy_coordinate, record_map=None):
+    # Known (source X-Y, target X-Y) point pairs for cross-checking conversion.
+    # Massachusetts Mainland's false origin: lon -71.5, lat 41.0 at 200000m E, 750000m N,
+    # plus control points away from it (both standard parallels are north of the origin,
+    # so a wrong projection definition shows up there): Boston State House, Worcester
+    # City Hall and Springfield, projected with the Lambert 2SP formulas on GRS80.
+    _REFERENCE_POINTS = {
+        (6492, 4326): [((656166.667, 2460625.0), (-71.5, 41.0)),
+                       ((774088.9154, 2956041.0058), (-71.0637, 42.3587)),
+                       ((574337.3536, 2920863.6057), (-71.8023, 42.2626)),
+                       ((360427.0439, 2863901.1764), (-72.5898, 42.1015))],
+        (26986, 4326): [((200000.0, 750000.0), (-71.5, 41.0)),
+                        ((235942.7733, 901003.1006), (-71.0637, 42.3587)),
+                        ((175058.3755, 890281.0076), (-71.8023, 42.2626)),
+                        ((109858.3827, 872918.8244), (-72.5898, 42.1015))]
+    }
+
+    def __init__(self, input_file, output_file, source_code, target_code, xy_coordinate, record_map=None,
+                 backend="epsg.io"):
         """ Initialize conversion settings.
 
             Args:
@@ -33,13 +59,23 @@ class CoordinateConversionToolset():
                 record_map: (function(dict->dict)) function used to extract
                     additional information from Shapefile record, which will
                     be updated to JSON string of row data. 
+                backend: (str) "epsg.io" to query epsg.io's API, or "pyproj" to
+                    convert locally.
         """
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
+        if backend == "pyproj" and Transformer is None:
+            raise ImportError("pyproj is required for local coordinate conversion.")
         self.input_file = input_file
         self.output_file = output_file
         self.source_code = source_code
         self.target_code = target_code
         self.xy_sys = xy_coordinate
         self.rec_map = record_map
+        self.backend = backend
+        if backend == "pyproj":
+            self._transformer = Transformer.from_crs(
+                int(source_code), int(target_code), always_xy=True)
 
     def query_points(self, points, xy_coordinate=True):
         """ Obtain converted coordinates.
@@ -69,23 +105,154 @@ class CoordinateConversionToolset():
                 result.extend([float(loc_obj["y"]), float(loc_obj["x"])] for loc_obj in r_json)
         return result
 
-    def convert_shape_coordinates(self):
-        """ Simple converter for coordination conversion.
+    def transform_points(self, points, xy_coordinate=True):
+        """ Obtain converted coordinates locally, all points at once.
 
             Args:
+                points - (list(tuple[2](float))) List of coordinates to be converted.
                 xy_coordinate - (bool) Whether input is of X-Y/Lon-Lat format
+
+            Return:
+                (np.array[N, 2](float)) Converted result, with the same coordinate order
         """
-        with shapefile.Reader(self.input_file) as s_file, open(self.output_file, "w") as fd_w:
-            for row_s, row_r in zip(s_file.shapes(), s_file.records()):
-                # Gather several rows into a bulk
-                row_points = row_s.points
-                converted_points = self.query_points(row_points, self.xy_sys)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x_idx, y_idx = (0, 1) if xy_coordinate else (1, 0)
+        result_x, result_y = self._transformer.transform(points[:, x_idx], points[:, y_idx])
+        result = np.stack([result_x, result_y], axis=-1)
+        return result if xy_coordinate else result[:, ::-1]
+
+    def convert_points(self, points, xy_coordinate=True):
+        """ Convert coordinates with selected backend.
+
+            Return:
+                (list(list[2](float))) List of converted result, with the same coordinate order
+        """
+        if self.backend == "pyproj":
+            return self.transform_points(points, xy_coordinate).tolist()
+        return self.query_points(points, xy_coordinate)
+
+    def cross_check(self, tolerance=1e-6):
+        """ Convert known reference points and compare with their expected values.
+
+            Args:
+                tolerance - (float) Maximum allowed difference (in target units)
+
+            Return:
+                (float) Maximum difference, or None if there's no reference points
+                        for this pair of projection systems.
+
+            Raises:
+                ValueError if the difference exceeds tolerance.
+        """
+        references = self._REFERENCE_POINTS.get((int(self.source_code), int(self.target_code)))
+        if not references:
+            return None
+        sources, targets = zip(*references)
+        error = np.abs(np.array(self.convert_points(list(sources))) - np.array(targets)).max()
+        if error > tolerance:
+            raise ValueError("Conversion from EPSG:{} to EPSG:{} deviates from reference points "
+                             "by {}".format(self.source_code, self.target_code, error))
+        return error
+
+    def convert_rows(self, rows_points, xy_coordinate=True):
+        """ Convert coordinates of a batch of rows.
+
+            Args:
+                rows_points - (list(list(tuple[2](float)))) Points of each row
+                xy_coordinate - (bool) Whether input is of X-Y/Lon-Lat format
+
+            Return:
+                (list(list(list[2](float)))) Converted points of each row
+        """
+        if self.backend == "pyproj":
+            # All points of the batch at once, then split them back to rows
+            all_points = [point for row_points in rows_points for point in row_points]
+            converted = self.transform_points(all_points, xy_coordinate).tolist()
+            bounds = np.cumsum([0] + [len(row_points) for row_points in rows_points])
+            return [converted[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        result = []
+        for row_points in rows_points:
+            result.append(self.query_points(row_points, xy_coordinate))
+            sleep(0.08)
+        return result
+
+    def _iter_batches(self, s_file, batch_size):
+        """ Lazily read shape points and mapped records of a Shapefile, in batches of rows.
+        """
+        batch_points, batch_extra = [], []
+        for shape_rec in s_file.iterShapeRecords():
+            batch_points.append(shape_rec.shape.points)
+            batch_extra.append(self.rec_map(shape_rec.record) if self.rec_map else {})
+            if len(batch_points) == batch_size:
+                yield batch_points, batch_extra
+                batch_points, batch_extra = [], []
+        if batch_points:
+            yield batch_points, batch_extra
+
+    def convert_shape_coordinates(self, workers=1, batch_size=None, verbose=False):
+        """ Simple converter for coordination conversion. Rows are read lazily and
+            converted in batches, optionally by a pool of worker processes. At most
+            2 * workers batches are in flight, and results are written in input order.
+
+            Args:
+                workers - (int) Number of worker processes
+                batch_size - (int) Number of rows per batch, by default 1000 for the
+                        local backend, and 10 for epsg.io
+                verbose - (bool) Print out progress and throughput
+        """
+        if not batch_size:
+            batch_size = 1000 if self.backend == "pyproj" else 10
+        time_start = time()
+        row_count = 0
+
+        def write_batch(converted_rows, batch_extra):
+            for converted_points, extra in zip(converted_rows, batch_extra):
                 out_data_row = {"points": converted_points}
-                if self.rec_map:
-                    out_data_row.update(self.rec_map(row_r))
+                out_data_row.update(extra)
                 write_content = json.dumps(out_data_row)
                 fd_w.write(write_content + "\n")
-                sleep(0.08)
+            if verbose:
+                print("Converted {} rows ({:.1f} rows/s)".format(
+                    row_count, row_count / max(time() - time_start, 1e-9)))
+
+        with shapefile.Reader(self.input_file) as s_file, open(self.output_file, "w") as fd_w:
+            batches = self._iter_batches(s_file, batch_size)
+            if workers <= 1:
+                for batch_points, batch_extra in batches:
+                    row_count += len(batch_points)
+                    write_batch(self.convert_rows(batch_points, self.xy_sys), batch_extra)
+                return
+
+            with Pool(workers, initializer=_init_worker,
+                      initargs=(self.source_code, self.target_code, self.backend)) as pool:
+                pending = deque()
+                for batch_points, batch_extra in batches:
+                    pending.append((pool.apply_async(_convert_batch, (batch_points, self.xy_sys)),
+                                    batch_extra))
+                    while len(pending) >= 2 * workers or (pending and pending[0][0].ready()):
+                        result, batch_extra = pending.popleft()
+                        converted_rows = result.get()
+                        row_count += len(converted_rows)
+                        write_batch(converted_rows, batch_extra)
+                while pending:
+                    result, batch_extra = pending.popleft()
+                    converted_rows = result.get()
+                    row_count += len(converted_rows)
+                    write_batch(converted_rows, batch_extra)
+
+
+_WORKER_TOOLSET = None
+
+def _init_worker(source_code, target_code, backend):
+    """ Set up a conversion toolset for each worker process.
+    """
+    global _WORKER_TOOLSET
+    _WORKER_TOOLSET = CoordinateConversionToolset(None, None, source_code, target_code, True,
+                                                  backend=backend)
+
+def _convert_batch(rows_points, xy_coordinate):
+    return _WORKER_TOOLSET.convert_rows(rows_points, xy_coordinate)
 
 """
 _DB_PATH = "../Dataset/Boston_Hacks_Shared_Folder/Streets/Streets.shp"
@@ -0,0 +1,152 @@
+""" preprocess_pipeline.py
+
+    Combined street and sidewalk preprocessing: coordinate conversion, street
+    indexing, partitioning and query generation. Output of each stage is keyed
+    by a hash of its inputs and parameters, so unchanged stages are skipped.
+"""
+import os
+import json
+import hashlib
+from time import time
+import tools.coordinate_conversion as corcv
+import tools.sidewalk_partition as sp
+
+
+class PreprocessPipeline():
+    """ Wrapped routine for running all preprocessing stages with cached artifacts.
+    """
+
+    _CHUNK_SIZE = 1 << 20
+
+    def __init__(self, street_params, sidewalk_params, work_path, out_path, query_params=None,
+                 workers=1, verbose=False):
+        """
+            Args:
+                street_params, sidewalk_params - (dict) CoordinateConversionToolset
+                        arguments for street and sidewalk datasets. output_file is
+                        decided by the pipeline.
+                work_path - (str) Folder path to store intermediate artifacts
+                out_path - (str) Folder path to store result queries and metadata
+                query_params (optional) - (dict) Additional QueryGenerationRunner
+                        arguments, e.g. part_len, threshold, shot_angle, shot_dist
+                workers (optional) - (int) Number of worker processes for conversion
+        """
+        self.street_params = street_params
+        self.sidewalk_params = sidewalk_params
+        self.work_path = work_path
+        self.out_path = out_path
+        self.query_params = query_params or {}
+        self.workers = workers
+        self.verbose = verbose
+        self.timing = []
+
+    @classmethod
+    def hash_files(cls, paths):
+        """ Content hash of files. Missing files are skipped.
+        """
+        digest = hashlib.sha1()
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            digest.update(os.path.basename(path).encode("utf-8"))
+            with open(path, "rb") as fd_r:
+                for chunk in iter(lambda: fd_r.read(cls._CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def shapefile_paths(path):
+        """ Files of a Shapefile dataset that affect conversion result.
+        """
+        base = path[:-4] if path.lower().endswith(".shp") else path
+        return [base + ".shp", base + ".dbf"]
+
+    @staticmethod
+    def stage_key(*items):
+        """ Key of a stage, given its input hashes and parameters.
+        """
+        return hashlib.sha1(json.dumps(items, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _run_stage(self, name, key, marker, routine):
+        """ Run a stage routine unless its marker file for the key exists.
+        """
+        time_start = time()
+        cached = os.path.isfile(marker)
+        if not cached:
+            if self.verbose:
+                print("Running stage {}...".format(name))
+            routine()
+            with open(marker, "w") as fd_w:
+                fd_w.write(key)
+        self.timing.append((name, "cached" if cached else "ran", time() - time_start))
+
+    def _convert(self, name, params):
+        """ Coordinate conversion stage.
+
+            Return:
+                (str) Path to converted JSON dataset.
+        """
+        conv_params = {key: val for key, val in params.items()
+                       if key not in ("input_file", "output_file", "record_map")}
+        key = self.stage_key(name, self.hash_files(self.shapefile_paths(params["input_file"])),
+                             conv_params)
+        output_file = os.path.join(self.work_path, "{}-{}.txt".format(name, key))
+
+        def routine():
+            tmp_file = output_file + ".tmp"
+            toolkit = corcv.CoordinateConversionToolset(**dict(params, output_file=tmp_file))
+            if toolkit.backend == "pyproj":
+                toolkit.cross_check()
+            toolkit.convert_shape_coordinates(workers=self.workers, verbose=self.verbose)
+            os.replace(tmp_file, output_file)
+
+        self._run_stage(name, key, output_file + ".done", routine)
+        return output_file
+
+    def _index(self, street_file):
+        """ Street R-tree index stage.
+
+            Return:
+                (str) Path to R-tree index (without extension).
+        """
+        key = self.stage_key("index", self.hash_files([street_file]))
+        index_path = os.path.join(self.work_path, "index-{}".format(key))
+
+        def routine():
+            sp.SidewalkQueryToolkit.build_geodb(street_file, index_path, True).close()
+
+        self._run_stage("index", key, index_path + ".done", routine)
+        return index_path
+
+    def _queries(self, sidewalk_file, index_path):
+        """ Partitioning and query generation stage.
+        """
+        key = self.stage_key("queries", self.hash_files([sidewalk_file]), index_path,
+                             self.query_params)
+
+        def routine():
+            # Outputs are overwritten, so results of other keys are no longer valid
+            for filename in os.listdir(self.out_path):
+                if filename.startswith("queries-") and filename.endswith(".done"):
+                    os.remove(os.path.join(self.out_path, filename))
+            sp.QueryGenerationRunner(sidewalk_file, index_path, self.out_path,
+                                     **self.query_params).run()
+
+        self._run_stage("queries", key, os.path.join(self.out_path, "queries-{}.done".format(key)),
+                        routine)
+
+    def run(self):
+        """ Run all stages, and print out timing of each stage.
+        """
+        os.makedirs(self.work_path, exist_ok=True)
+        os.makedirs(self.out_path, exist_ok=True)
+        self.timing = []
+
+        street_file = self._convert("streets", self.street_params)
+        sidewalk_file = self._convert("sidewalks", self.sidewalk_params)
+        index_path = self._index(street_file)
+        self._queries(sidewalk_file, index_path)
+
+        for name, status, elapsed in self.timing:
+            print("{:<10s} {:<7s} {:10.3f} s".format(name, status, elapsed))
+        return self.timing
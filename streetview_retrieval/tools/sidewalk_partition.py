@@ -8,7 +8,8 @@ import math
 import os.path
 import json
 import csv
-from itertools import islice
+import hashlib
+from itertools import islice, product
 import numpy as np
 from rtree import index
 import nvector as nv
@@ -118,32 +119,237 @@ class SidewalkQueryToolkit():
         p1_p, p2_p = (p1, p2) if lat_long else ((p1[1], p1[0]), (p2[1], p2[0]))
         return geodesic(p1_p, p2_p).meters
 
+    #################################
+    # Quadrilateral fitting
+    #################################
+    _METERS_PER_DEGREE = 111320.0  # Approximated length of a degree of latitude
+    _MAX_SPLIT_CANDIDATES = 12  # Number of cut positions evaluated on each axis
+
+    @classmethod
+    def _to_local(cls, data_arr):
+        """ Project X-Y/lon-lat points onto a local (approximately) metric plane.
+
+            Return:
+                (np.array[N, 2](float)) Local X-Y points in meters
+                (tuple(float)) Origin and longitude scale, required by _from_local()
+        """
+        lon_0, lat_0 = data_arr.mean(axis=0)
+        lon_scale = cls._METERS_PER_DEGREE * math.cos(math.radians(lat_0))
+        local = np.stack([(data_arr[:, 0] - lon_0) * lon_scale,
+                          (data_arr[:, 1] - lat_0) * cls._METERS_PER_DEGREE], axis=-1)
+        return local, (lon_0, lat_0, lon_scale)
+
+    @classmethod
+    def _from_local(cls, local, frame):
+        lon_0, lat_0, lon_scale = frame
+        return np.stack([local[..., 0] / lon_scale + lon_0,
+                         local[..., 1] / cls._METERS_PER_DEGREE + lat_0], axis=-1)
+
+    @staticmethod
+    def convex_hull(pts):
+        """ Convex hull of points by monotone chain algorithm.
+
+            Return:
+                (np.array[H, 2](float)) Hull points in counter-clockwise order.
+        """
+        pts = np.unique(np.asarray(pts, dtype=np.float64), axis=0)
+        if len(pts) < 3:
+            return pts
+
+        def half_hull(points):
+            chain = []
+            for (x, y) in points:
+                while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (y - chain[-2][1]) -
+                                           (chain[-1][1] - chain[-2][1]) * (x - chain[-2][0])) <= 0:
+                    chain.pop()
+                chain.append((x, y))
+            return chain[:-1]
+
+        pts = pts.tolist()
+        return np.array(half_hull(pts) + half_hull(pts[::-1]))
+
     @staticmethod
-    def approx_quadrilateral(pts, xy_coordinate=True):
-        """ Approximate quadrilateral shape of a polygon.
+    def polygon_area(pts):
+        """ Area of a (closed or unclosed) polygon by shoelace formula.
+        """
+        x, y = pts[:, 0], pts[:, 1]
+        return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0
+
+    @classmethod
+    def min_area_rectangle(cls, pts):
+        """ Minimum-area oriented bounding rectangle of points. One of the rectangle
+            sides is collinear with a convex hull edge, so all hull edge orientations
+            are evaluated at once.
+
+            Args:
+                pts - (np.array[N, 2](float)) Points in a metric plane
+
+            Return:
+                (np.array[4, 2](float)) Rectangle corners in cyclic order
+                (np.array[2](float)) Unit vector of the longer rectangle axis
+        """
+        hull = cls.convex_hull(pts)
+        edges = np.roll(hull, -1, axis=0) - hull
+        angles = np.unique(np.arctan2(edges[:, 1], edges[:, 0]) % (np.pi / 2.0))
+        axis_u = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+        axis_v = np.stack([-np.sin(angles), np.cos(angles)], axis=-1)
+        proj_u, proj_v = hull @ axis_u.T, hull @ axis_v.T
+        min_u, max_u = proj_u.min(axis=0), proj_u.max(axis=0)
+        min_v, max_v = proj_v.min(axis=0), proj_v.max(axis=0)
+        best = np.argmin((max_u - min_u) * (max_v - min_v))
+
+        u, v = axis_u[best], axis_v[best]
+        corners = np.array([min_u[best] * u + min_v[best] * v, max_u[best] * u + min_v[best] * v,
+                            max_u[best] * u + max_v[best] * v, min_u[best] * u + max_v[best] * v])
+        long_axis = u if max_u[best] - min_u[best] >= max_v[best] - min_v[best] else v
+        return corners, long_axis
+
+    @staticmethod
+    def _clip_half_plane(poly, normal, offset):
+        """ Clip a polygon, keeping the part where poly @ normal < offset. The kept part
+            may fall apart into several polygons (e.g. cutting a U-shaped block across
+            its arms), which are returned separately.
+
+            Return:
+                (list(np.array[N, 2](float))) Clipped polygons
+        """
+        dist = poly @ normal - offset
+        inside = dist < -1e-9 * (1.0 + abs(offset))
+        if inside.all():
+            return [poly]
+        if not inside.any():
+            return []
+
+        # Step 1: Collect chains of kept boundary, each one goes from an entry point
+        #         to an exit point on the clipping line.
+        start = np.flatnonzero(~inside)[0]
+        chains = []
+        for step in range(len(poly)):
+            idx, nxt = (start + step) % len(poly), (start + step + 1) % len(poly)
+            if inside[idx] != inside[nxt]:
+                cross = poly[idx] + dist[idx] / (dist[idx] - dist[nxt]) * (poly[nxt] - poly[idx])
+                if inside[nxt]:
+                    chains.append([cross])
+                else:
+                    chains[-1].append(cross)
+            if inside[nxt]:
+                chains[-1].append(poly[nxt])
+
+        # Step 2: Crossing points alternate along the clipping line, so pairing them
+        #         in order gives the line segments bridging an exit to an entry.
+        tangent = np.array([-normal[1], normal[0]])
+        ends = sorted([(chain[0] @ tangent, c_idx, 0) for c_idx, chain in enumerate(chains)] +
+                      [(chain[-1] @ tangent, c_idx, 1) for c_idx, chain in enumerate(chains)])
+        next_chain = {}
+        for (_, c_a, is_exit_a), (_, c_b, _) in zip(ends[::2], ends[1::2]):
+            next_chain[c_a if is_exit_a else c_b] = c_b if is_exit_a else c_a
+
+        # Step 3: Follow the bridges to assemble polygons
+        polys, visited = [], set()
+        for c_idx in range(len(chains)):
+            ring = []
+            while c_idx is not None and c_idx not in visited:
+                visited.add(c_idx)
+                ring.extend(chains[c_idx])
+                c_idx = next_chain.get(c_idx)
+            if len(ring) >= 3:
+                polys.append(np.array(ring))
+        return polys
+
+    @classmethod
+    def _best_split(cls, poly, corners):
+        """ Find the cut across either rectangle axis, through (some of) the polygon
+            vertices, that minimizes the total area of bounding rectangles of the
+            resulting parts.
+
+            Return:
+                (list(np.array[N, 2](float))) Polygons on both sides of the cut, or
+                        None if there's no better cut.
+        """
+        best_area, best_parts = cls.polygon_area(corners), None
+        axes = np.array([corners[1] - corners[0], corners[3] - corners[0]])
+        axes /= np.maximum(np.linalg.norm(axes, axis=1, keepdims=True), 1e-12)
+        for axis in axes:
+            offsets = np.unique(poly @ axis)[1:-1]
+            if len(offsets) > cls._MAX_SPLIT_CANDIDATES:
+                offsets = offsets[np.linspace(0, len(offsets) - 1,
+                                              cls._MAX_SPLIT_CANDIDATES).astype(int)]
+            for offset in offsets:
+                parts = cls._clip_half_plane(poly, -axis, -offset) + \
+                        cls._clip_half_plane(poly, axis, offset)
+                if len(parts) < 2:
+                    continue
+                # Rectangles aligned with the current one are good enough to rank cuts
+                area = sum(np.prod(np.ptp(part @ axes.T, axis=0)) for part in parts)
+                if area < best_area:
+                    best_area, best_parts = area, parts
+        return best_parts
+
+    @classmethod
+    def approx_quadrilaterals(cls, pts, xy_coordinate=True, min_fill=0.6,
+                              min_split_length=40.0, max_depth=3):
+        """ Approximate a polygon with one or more oriented rectangles. If the polygon
+            fills too little of its minimum-area rectangle (e.g. long curved or L-shaped
+            blocks), it is cut across one of the rectangle's axes and both sides are
+            fitted recursively.
 
             Args:
                 pts: list(tuple[2](float)) Polygon points
                 xy_coordinate: Whether x-y/lon-lat system is used.
+                min_fill: Minimum ratio of polygon area to rectangle area to accept a fit
+                min_split_length: Rectangles shorter than this (in meters) are not split
+                max_depth: Maximum depth of recursive splitting
 
             Return:
-                (list[4](tuple[2](floats)))
-                        X-Y points for quadrilateral approximation.
+                (list(list[4](np.array[2](float)))) Quadrilaterals, in the same
+                        coordinate system as input.
         """
         if type(pts) != list or len(pts) < 3:
-            return None
-        # Format data to numpy structure. Swap columns if needed
-        data_arr = np.array(pts)
+            return []
+        data_arr = np.array(pts, dtype=np.float64)
         if not xy_coordinate:
             data_arr[:, [0, 1]] = data_arr[:, [1, 0]]
-        # Find bounding box index for each column
-        # This assumes that most of the blocks have shape similar rectangal, but not all the cases
-        p_idx_min_x, p_idx_min_y = data_arr.argmin(axis=0)
-        p_idx_max_x, p_idx_max_y = data_arr.argmax(axis=0)
+        local, frame = cls._to_local(data_arr)
+
+        rectangles = []
+        pending = [(local, 0)]
+        while pending:
+            poly, depth = pending.pop()
+            if len(poly) < 3:
+                continue
+            corners, long_axis = cls.min_area_rectangle(poly)
+            parts = None
+            if depth < max_depth and np.ptp(corners @ long_axis) > min_split_length and \
+                    cls.polygon_area(poly) < min_fill * cls.polygon_area(corners):
+                parts = cls._best_split(poly, corners)
+            if parts:
+                pending.extend((part, depth + 1) for part in parts[::-1])
+            else:
+                rectangles.append(corners)
+
+        quads = []
+        for corners in rectangles:
+            quad = cls._from_local(corners, frame)
+            if not xy_coordinate:
+                quad = quad[:, ::-1]
+            quads.append(list(quad))
+        return quads
+
+    @classmethod
+    def approx_quadrilateral(cls, pts, xy_coordinate=True):
+        """ Approximate quadrilateral shape of a polygon, by its minimum-area
+            oriented bounding rectangle.
 
-        # Get approximated corners from points obtaining extreme values
-        return data_arr[p_idx_max_x], data_arr[p_idx_max_y], \
-                data_arr[p_idx_min_x], data_arr[p_idx_min_y]
+            Args:
+                pts: list(tuple[2](float)) Polygon points
+                xy_coordinate: Whether x-y/lon-lat system is used.
+
+            Return:
+                (list[4](tuple[2](floats)))
+                        X-Y points for quadrilateral approximation.
+        """
+        quads = cls.approx_quadrilaterals(pts, xy_coordinate, max_depth=0)
+        return tuple(quads[0]) if quads else None
 
     @staticmethod
     def get_angels(p1, p2, yx_cord=True):
@@ -171,6 +377,145 @@ class SidewalkQueryToolkit():
             bearings = (angle, angle - 180.0)
         return bearings
 
+    #################################
+    # Geodesic partitioning (vectorized)
+    #################################
+    _WGS84_A = 6378137.0  # Semi-major axis (in meters)
+    _WGS84_E2 = 6.69437999014e-3  # First eccentricity squared
+
+    @staticmethod
+    def to_nvectors(points):
+        """ Convert X-Y/lon-lat points (in degrees) to unit n-vectors.
+
+            Args:
+                points - (np.array[..., 2](float)) Lon-lat coordinates
+
+            Return:
+                (np.array[..., 3](float)) n-vectors
+        """
+        points = np.radians(np.asarray(points, dtype=np.float64))
+        lon, lat = points[..., 0], points[..., 1]
+        return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+                        axis=-1)
+
+    @staticmethod
+    def from_nvectors(nvecs):
+        """ Convert (not necessarily unit) n-vectors back to X-Y/lon-lat points in degrees.
+        """
+        lat = np.arctan2(nvecs[..., 2], np.hypot(nvecs[..., 0], nvecs[..., 1]))
+        lon = np.arctan2(nvecs[..., 1], nvecs[..., 0])
+        return np.degrees(np.stack([lon, lat], axis=-1))
+
+    @classmethod
+    def geodesic_distance(cls, starts, ends):
+        """ Vectorized distance between X-Y/lon-lat points on WGS84 ellipsoid, using
+            radii of curvature at the mean latitude. This is accurate to ~1e-6 relative
+            error for street-scale (< few km) distances.
+
+            Return:
+                (np.array(float)) Distance by meters.
+        """
+        starts, ends = np.radians(starts), np.radians(ends)
+        lat_m = (starts[..., 1] + ends[..., 1]) / 2.0
+        w_sq = 1.0 - cls._WGS84_E2 * np.sin(lat_m) ** 2
+        r_prime = cls._WGS84_A / np.sqrt(w_sq)
+        r_meridian = cls._WGS84_A * (1.0 - cls._WGS84_E2) / w_sq ** 1.5
+        d_lon = (ends[..., 0] - starts[..., 0] + np.pi) % (2.0 * np.pi) - np.pi
+        return np.hypot(d_lon * r_prime * np.cos(lat_m),
+                        (ends[..., 1] - starts[..., 1]) * r_meridian)
+
+    @staticmethod
+    def initial_bearing(starts, ends):
+        """ Vectorized initial bearing from X-Y/lon-lat starts to ends, same as
+            pygeodesy's bearing().
+
+            Return:
+                (np.array(float)) compass-360 bearings.
+        """
+        starts, ends = np.radians(starts), np.radians(ends)
+        d_lon = ends[..., 0] - starts[..., 0]
+        lat_1, lat_2 = starts[..., 1], ends[..., 1]
+        angle = np.arctan2(np.sin(d_lon) * np.cos(lat_2),
+                           np.cos(lat_1) * np.sin(lat_2) -
+                           np.sin(lat_1) * np.cos(lat_2) * np.cos(d_lon))
+        return np.degrees(angle) % 360.0
+
+    @classmethod
+    def geodesic_partition(cls, starts, ends, counts):
+        """ Evenly partition a batch of lines along their geodesics, and return
+            the center of each partition.
+            For instance, with count=4 centers are placed at fractions 1/8, 3/8, 5/8
+            and 7/8 of the arc length from start to end.
+
+            Args:
+                starts, ends - (np.array[N, 2](float)) X-Y/lon-lat end points of lines
+                counts - (np.array[N](int)) Number of partitions for each line
+
+            Return:
+                (np.array[sum(counts), 2](float)) X-Y/lon-lat partition centers
+                (np.array[sum(counts)](int)) Index of the line each center belongs to
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        owner = np.repeat(np.arange(len(counts)), counts)
+        rank = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        frac = (2.0 * rank + 1.0) / (2.0 * counts[owner])
+
+        # Spherical linear interpolation of n-vectors, which gives equal arc length
+        # spacing. Fall back to linear weights for (nearly) identical end points.
+        n_a, n_b = cls.to_nvectors(starts)[owner], cls.to_nvectors(ends)[owner]
+        omega = np.arctan2(np.linalg.norm(np.cross(n_a, n_b), axis=-1),
+                           np.sum(n_a * n_b, axis=-1))
+        sin_omega = np.sin(omega)
+        is_arc = sin_omega > 1e-12
+        sin_omega = np.where(is_arc, sin_omega, 1.0)
+        w_a = np.where(is_arc, np.sin((1.0 - frac) * omega) / sin_omega, 1.0 - frac)
+        w_b = np.where(is_arc, np.sin(frac * omega) / sin_omega, frac)
+        centers = cls.from_nvectors(w_a[:, None] * n_a + w_b[:, None] * n_b)
+        return centers.reshape(-1, 2), owner
+
+    @classmethod
+    def partition_quads(cls, quads, part_length, dist_f=None):
+        """ Partition a batch of quadrilaterals (see partition_with_direction).
+
+            Args:
+                quads - (np.array[N, 4, 2](float)) X-Y/lon-lat quadrilateral points.
+                part_length - (float) Partition length (in meters).
+                dist_f (optional) - Distance function given two lat-long coordinates.
+                        Vectorized geodesic_distance() is used if not provided.
+
+            Return:
+                (np.array[M, 2](float)) X-Y/lon-lat partition centers of all quads
+                (np.array[M](int)) Index of the quad each center belongs to
+                (np.array[N, 2](float)) Heading/counter-heading of each quad
+        """
+        quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+        rows = np.arange(len(quads))
+
+        # Step 1: Find the longest side, sides are (0, 1), (1, 2), (2, 3) and (3, 0)
+        side_ends = np.roll(quads, -1, axis=1)
+        if dist_f:
+            side_lengths = np.array([[dist_f(st[::-1], ed[::-1]) for st, ed in zip(quad, ends)]
+                                     for quad, ends in zip(quads, side_ends)]).reshape(-1, 4)
+        else:
+            side_lengths = cls.geodesic_distance(quads, side_ends)
+        ref_1 = np.argmax(side_lengths, axis=1)
+
+        # Step 2: Obtain the accrossed side, in opposite direction
+        ref_2 = (ref_1 + 2) % 4
+        start_1, end_1 = quads[rows, ref_1], quads[rows, (ref_1 + 1) % 4]
+        start_2, end_2 = quads[rows, (ref_2 + 1) % 4], quads[rows, ref_2]
+
+        # Step 3: Partition both sides and take geodesic midpoints as centers
+        counts = np.ceil(side_lengths[rows, ref_1] / float(part_length)).astype(np.int64)
+        centers_1, owner = cls.geodesic_partition(start_1, end_1, counts)
+        centers_2, _ = cls.geodesic_partition(start_2, end_2, counts)
+        centers = cls.from_nvectors(cls.to_nvectors(centers_1) + cls.to_nvectors(centers_2))
+
+        angles = cls.initial_bearing(start_1, end_1)
+        headings = np.stack([angles, np.where(angles <= 180.0, angles + 180.0, angles - 180.0)],
+                            axis=-1)
+        return centers.reshape(-1, 2), owner, headings
+
     @classmethod
     def partition_with_direction_line(cls, line, part_length, dist_f=None,
                                  xy_coordinate=True):
@@ -187,19 +532,19 @@ class SidewalkQueryToolkit():
         # is used in general
         if xy_coordinate:
             line_yx = [np.array([y, x]) for (x, y) in line]
+            line_xy = np.asarray(line, dtype=np.float64)
         else:
             line_yx = line
+            line_xy = np.asarray(line, dtype=np.float64)[:, ::-1]
 
         line_length = dist_f(line_yx[0], line_yx[1])
 
-        # First compute how may partitions to be generated, then do 'cyclic partition'
-        # to find out center of each partition.
-        # For instance, to compute 10 centers between evenly partitioned [0, 10]:
-        # s = linspace(0, 10, 10*2, endpoint=False) // [0, 0.5, 1, ..., 9.5] (20)
-        # s[1::2]                                   // [0.5, 1.5, ..., 9.5]  (10)
-        # TODO: Does general geo-library support this functionality to increase precision?
+        # First compute how may partitions to be generated, then place the centers
+        # evenly along the geodesic.
         partition_size = math.ceil(line_length / float(part_length))
-        partitions = np.linspace(line[0], line[1], partition_size * 2, endpoint=False)[1::2]
+        partitions, _ = cls.geodesic_partition(line_xy[:1], line_xy[1:], [partition_size])
+        if not xy_coordinate:
+            partitions = partitions[:, ::-1]
         # For simplicity, make it be tuple
         partition_centers = [tuple(cent) for cent in partitions]
 
@@ -220,41 +565,55 @@ class SidewalkQueryToolkit():
         if not dist_f:
             dist_f = cls.compute_coordinate_distance
 
-        # Step 1: Find the longest side as reference
-        line_points_ref = [(0, 1), (1, 2), (2, 3), (3, 0)]
-
-        # This is required for applying geo-distance functions, where Y/X system
-        # is used in general
-        if xy_coordinate:
-            quad_yx = [np.array([y, x]) for (x, y) in quad]
-        else:
-            quad_yx = quad
-
-        side_lengths = [dist_f(quad_yx[i1], quad_yx[i2]) for i1, i2 in line_points_ref]
-        ref_side_1_idx = np.argmax(side_lengths)
-        ref_side_1 = line_points_ref[ref_side_1_idx]
-
-        # Step 2: Obtain the accrossed side (the 2-next in cyclic index)
-        start_1, end_1 = quad[ref_side_1[0]], quad[ref_side_1[1]]
-        ref_side_2_idx = (ref_side_1_idx + 2) % 4
-        ref_side_2 = line_points_ref[ref_side_2_idx]
-        start_2, end_2 = quad[ref_side_2[1]], quad[ref_side_2[0]] # Adjust opposite direction
-
-        # Step 3: Compute partition "semi-center"s and find the midpoint
-        # First compute how may partitions to be generated, then do 'cyclic partition'
-        # to find out center of each partition.
-        # For instance, to compute 10 centers between evenly partitioned [0, 10]:
-        # s = linspace(0, 10, 10*2, endpoint=False) // [0, 0.5, 1, ..., 9.5] (20)
-        # s[1::2]                                   // [0.5, 1.5, ..., 9.5]  (10)
-        # TODO: Does general geo-library support this functionality to increase precision?
-        partition_size = math.ceil(side_lengths[ref_side_1_idx] / float(part_length))
-        partitions_1 = np.linspace(start_1, end_1, partition_size * 2, endpoint=False)[1::2]
-        partitions_2 = np.linspace(start_2, end_2, partition_size * 2, endpoint=False)[1::2]
+        quad_xy = np.asarray(quad, dtype=np.float64)
+        if not xy_coordinate:
+            quad_xy = quad_xy[:, ::-1]
+        partitions, _, headings = cls.partition_quads(quad_xy[None], part_length, dist_f)
+        if not xy_coordinate:
+            partitions = partitions[:, ::-1]
         # For simplicity, make it be tuple
-        partition_centers = [tuple(np.mean([seg_cen_1, seg_cen_2], axis=0))
-                             for (seg_cen_1, seg_cen_2) in zip(partitions_1, partitions_2)]
+        partition_centers = [tuple(cent) for cent in partitions]
+
+        return partition_centers, tuple(headings[0])
+
+    #################################
+    # Spatial tiling related
+    #################################
+    _HILBERT_ORDER = 24  # Bits per axis of Hilbert curve keys (~2.4 meters in longitude)
+
+    @classmethod
+    def hilbert_keys(cls, points):
+        """ Vectorized Hilbert curve keys of X-Y/lon-lat points. A fixed global grid is
+            used, so keys (and tiles) of a location are stable across datasets and runs.
+
+            Args:
+                points - (np.array[N, 2](float)) Lon-lat coordinates
+
+            Return:
+                (np.array[N](int)) Hilbert curve keys
+        """
+        side = 1 << cls._HILBERT_ORDER
+        points = np.nan_to_num(np.asarray(points, dtype=np.float64)).reshape(-1, 2)
+        x = np.clip(((points[:, 0] + 180.0) / 360.0 * side).astype(np.int64), 0, side - 1)
+        y = np.clip(((points[:, 1] + 90.0) / 180.0 * side).astype(np.int64), 0, side - 1)
+        keys = np.zeros(len(points), dtype=np.int64)
+        s = side >> 1
+        while s > 0:
+            rx, ry = (x & s) > 0, (y & s) > 0
+            keys += s * s * ((3 * rx) ^ ry)
+            # Rotate the quadrant so that the curve stays continuous
+            flip = rx & ~ry
+            x, y = np.where(flip, side - 1 - x, x), np.where(flip, side - 1 - y, y)
+            x, y = np.where(ry, x, y), np.where(ry, y, x)
+            s >>= 1
+        return keys
 
-        return partition_centers, cls.get_angels(start_1, end_1, not xy_coordinate)
+    @classmethod
+    def hilbert_tiles(cls, keys, tile_level):
+        """ Tile index of Hilbert curve keys, where the globe is split into
+            2^tile_level x 2^tile_level tiles. Tiles are numbered in curve order.
+        """
+        return np.asarray(keys) >> (2 * (cls._HILBERT_ORDER - tile_level))
 
     # R-tree index related
     @classmethod
@@ -290,6 +649,37 @@ class SidewalkQueryToolkit():
                     db_idx += 1
         return idx
 
+    @staticmethod
+    def fingerprint(*items):
+        """ Compute a stable fingerprint for JSON-serializable feature data,
+            e.g. polygon points of a sidewalk, or name and points of a street.
+
+            Return:
+                (str) Hex digest of the serialized items.
+        """
+        content = json.dumps(items, sort_keys=True)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def fingerprint_streets(cls, path_streetjson):
+        """ Fingerprint each street row of a street db json file.
+
+            Return:
+                (list(dict)) Street index, name, fingerprint and X-Y bounding box
+                        (left, bottom, right, top) for each street row.
+        """
+        street_info = []
+        with open(path_streetjson, "r") as fd_r:
+            for st_idx, line in enumerate(fd_r):
+                street_data = json.loads(line)
+                points = np.array(street_data["points"])
+                street_info.append({
+                    "street_index": st_idx, "name": street_data["name"],
+                    "fingerprint": cls.fingerprint(street_data["name"], street_data["points"]),
+                    "bbox": list(points.min(axis=0)) + list(points.max(axis=0))
+                })
+        return street_info
+
     @staticmethod
     def read_geodb(filename):
         """ Simple wrapper to read existing R-tree index file.
@@ -299,28 +689,19 @@ class SidewalkQueryToolkit():
         return index.Index(filename, properties=pt)
 
     @classmethod
-    def generate_sidewalk_queries(cls, target_center, target_slope, street_idx, threshold=8.0,
-                                  shot_angle=30.0, shot_dist=10.0):
-        """ Return a list of Google Street View API queries, given
-            street and index data.
+    def match_street(cls, target_center, target_slope, street_idx, threshold=8.0):
+        """ Match a sidewalk partition to the street segment it belongs to.
 
             Args:
                 target_center - (float, float) [X-lon, Y-lat] coordinate
-                target_slope = Target direction in 360-degree unit
+                target_slope = Tuned target direction (within [0, 180]) in 360-degree unit
                 street_idx - (rtree.index.Index) Street index db
                 threshold - (float) Degree threshold for selecting nearest road segment
-                shot_angle - (float) Narrow angle between camera heading and target direction
-                shot_dist - (float) Distance between camera and target
 
             Returns:
-                query_params_1 #
-                query_params_2 - (dict) Query parameters for street view API
-                query_info - (dict) Additional information other than query parameters
+                belong_st - (dict) Matched street segment data of the index
+                dir_facing_road - (float) Direction facing road from the partition center
         """
-        # Step 0: Tune slope
-        if target_slope > 180.0:
-            target_slope -= 180.0
-
         # Step 1: Return nearest candidates
         nn_result = list(street_idx.nearest(target_center, 20, objects="raw"))
         # Step 2: Choose the first one that passes threshold.
@@ -337,31 +718,103 @@ class SidewalkQueryToolkit():
                 min_angle, min_cand = angle_diff, cand
         if not belong_st:
             belong_st = min_cand
-        # Step 3: Identify relative position between road and sidewalk
-        #         Use the relative position between direction facing road from sidewalk,
-        #         and sidewalk direction to decide walkout direction for camera positioning,
-        #         along with camera heading (reverse of walkout direction).
         nearest_proj = cls.nearest_point_on_line(
             target_center, belong_st["segment_points"][0], belong_st["segment_points"][1])
-        dir_facing_road = cls.get_angels(target_center, nearest_proj)[0]
-        if target_slope <= dir_facing_road <= (target_slope + 180):
-            # Road's on clockwise side
-            walkout_dir1 = target_slope + shot_angle
-            walkout_dir2 = target_slope + 180.0 - shot_angle
-        else:
-            # Road's on counter-clockwise side
-            walkout_dir1 = target_slope + (360.0 if target_slope < shot_angle else 0.0) - shot_angle
-            walkout_dir2 = target_slope + 180.0 + shot_angle - \
-                    (360.0 if target_slope + shot_angle > 180.0 else 0.0)
+        return belong_st, cls.get_angels(target_center, nearest_proj)[0]
+
+    @staticmethod
+    def walkout_directions(target_slope, dir_facing_road, shot_angle):
+        """ Use the relative position between direction facing road from sidewalk,
+            and sidewalk direction to decide walkout directions for camera positioning.
+            Vectorized; arguments are broadcast against each other.
+
+            Returns:
+                walkout_dir1, walkout_dir2 - (np.ndarray) Walkout directions of both cameras
+        """
+        target_slope = np.asarray(target_slope, dtype=float)
+        shot_angle = np.asarray(shot_angle, dtype=float)
+        # Road's on clockwise side
+        clockwise = (target_slope <= dir_facing_road) & (dir_facing_road <= target_slope + 180)
+        walkout_dir1 = np.where(
+            clockwise, target_slope + shot_angle,
+            target_slope + np.where(target_slope < shot_angle, 360.0, 0.0) - shot_angle)
+        walkout_dir2 = np.where(
+            clockwise, target_slope + 180.0 - shot_angle,
+            target_slope + 180.0 + shot_angle -
+            np.where(target_slope + shot_angle > 180.0, 360.0, 0.0))
+        return walkout_dir1, walkout_dir2
+
+    @staticmethod
+    def reverse_directions(directions):
+        """ Reverse 360-compass directions, e.g. walkout direction to camera heading.
+        """
+        headings = np.asarray(directions) + 180.0
+        return headings - np.where(headings >= 360.0, 360.0, 0.0)
+
+    @classmethod
+    def outreach_points(cls, starts, directions, distances):
+        """ Vectorized get_outreach() for short (street-scale) distances, using radii of
+            curvature of WGS84 ellipsoid at start points. Arguments are broadcast against
+            each other.
+
+            Args:
+                starts - (np.ndarray[..., 2]) Lat-long start positions
+                directions - (np.ndarray) 360-compass outreach directions
+                distances - (np.ndarray) Distances (in meters) from start points
+
+            Return:
+                (np.ndarray[..., 2]) Lat-long coordinates of outreach destinations.
+        """
+        starts = np.asarray(starts, dtype=float)
+        lat = np.radians(starts[..., 0])
+        w_sq = 1.0 - cls._WGS84_E2 * np.sin(lat) ** 2
+        r_prime = cls._WGS84_A / np.sqrt(w_sq)
+        r_meridian = cls._WGS84_A * (1.0 - cls._WGS84_E2) / w_sq ** 1.5
+        azimuth = np.radians(directions)
+        d_lat = distances * np.cos(azimuth) / r_meridian
+        d_lon = distances * np.sin(azimuth) / (r_prime * np.cos(lat))
+        return np.stack(np.broadcast_arrays(starts[..., 0] + np.degrees(d_lat),
+                                            starts[..., 1] + np.degrees(d_lon)), axis=-1)
+
+    @classmethod
+    def generate_sidewalk_queries(cls, target_center, target_slope, street_idx, threshold=8.0,
+                                  shot_angle=30.0, shot_dist=10.0):
+        """ Return a list of Google Street View API queries, given
+            street and index data.
+
+            Args:
+                target_center - (float, float) [X-lon, Y-lat] coordinate
+                target_slope = Target direction in 360-degree unit
+                street_idx - (rtree.index.Index) Street index db
+                threshold - (float) Degree threshold for selecting nearest road segment
+                shot_angle - (float) Narrow angle between camera heading and target direction
+                shot_dist - (float) Distance between camera and target
+
+            Returns:
+                query_params_1 #
+                query_params_2 - (dict) Query parameters for street view API
+                query_info - (dict) Additional information other than query parameters
+        """
+        # Step 0: Tune slope
+        if target_slope > 180.0:
+            target_slope -= 180.0
+
+        # Step 1-2: Find the street segment the partition belongs to
+        belong_st, dir_facing_road = cls.match_street(
+            target_center, target_slope, street_idx, threshold)
+        # Step 3: Identify relative position between road and sidewalk
+        #         to decide walkout direction for camera positioning,
+        #         along with camera heading (reverse of walkout direction).
+        walkout_dir1, walkout_dir2 = [
+            float(wdir) for wdir in cls.walkout_directions(target_slope, dir_facing_road,
+                                                           shot_angle)]
 
         shot_loc_1 = cls.get_outreach(target_center, walkout_dir1, shot_dist)
         shot_loc_2 = cls.get_outreach(target_center, walkout_dir2, shot_dist)
 
         # Step 4: Reverse walkout direction to obtain camera heading.
-        shot_heading_1 = walkout_dir1 + 180.0
-        shot_heading_2 = walkout_dir2 + 180.0
-        shot_heading_1 -= (360.0 if shot_heading_1 >= 360.0 else 0.0)
-        shot_heading_2 -= (360.0 if shot_heading_2 >= 360.0 else 0.0)
+        shot_heading_1 = float(cls.reverse_directions(walkout_dir1))
+        shot_heading_2 = float(cls.reverse_directions(walkout_dir2))
 
         # Step 5: Output camera parameters and other info
         query_params_1 = {
@@ -379,85 +832,587 @@ class SidewalkQueryToolkit():
 
         return query_params_1, query_params_2, query_info
 
+class QueryColumnStore():
+    """ Columnar storage for generated queries and sidewalk info. Each column is stored
+        as a typed .npy file, so readers can memory-map columns and filter rows by
+        sidewalk or street without parsing the text outputs. The "sidewalks" table
+        has one row per quadrilateral of a sidewalk block.
+    """
+
+    QUERY_COLUMNS = {
+        "sidewalk_index": np.int32, "partition_index": np.int32, "query_id": np.int8,
+        "center": np.float64, "street_name": np.int32, "street_segment_id": np.int32,
+        "location": np.float64, "heading": np.float64
+    }
+    SIDEWALK_COLUMNS = {
+        "sidewalk_index": np.int32, "quad_points": np.float64,
+        "num_partitions": np.int32, "direction": np.float64, "tile": np.int64
+    }
+
+    @classmethod
+    def write(cls, path, meta, sidewalk_info):
+        """ Write metadata rows and sidewalk info as columns.
+
+            Args:
+                path - (str) Folder path to store columns
+                meta - (list(tuple)) Metadata rows, ordered as QueryGenerationRunner's headers
+                sidewalk_info - (list(dict)) Sidewalk info rows
+        """
+        st_names, st_name_ids = np.unique([str(row[5]) for row in meta], return_inverse=True)
+        queries = {
+            "sidewalk_index": [row[0] for row in meta],
+            "partition_index": [row[1] for row in meta],
+            "query_id": [row[2] for row in meta],
+            "center": [(row[3], row[4]) for row in meta],
+            "street_name": st_name_ids,
+            "street_segment_id": [row[6] for row in meta],
+            # Same coordinate order as "location" of queries.txt
+            "location": [(row[7], row[8]) for row in meta],
+            "heading": [row[9] for row in meta]
+        }
+        # One row per quadrilateral of sidewalk blocks
+        sidewalks = {key: [] for key in cls.SIDEWALK_COLUMNS}
+        for info in sidewalk_info:
+            for quad, num_partitions, direction in zip(
+                    info["quad_points"], info["num_partitions"], info["direction"]):
+                for key, val in (("sidewalk_index", info["sidewalk_index"]), ("quad_points", quad),
+                                 ("num_partitions", num_partitions), ("direction", direction),
+                                 ("tile", info["tile"])):
+                    sidewalks[key].append(val)
+
+        for table, columns, types in (("queries", queries, cls.QUERY_COLUMNS),
+                                      ("sidewalks", sidewalks, cls.SIDEWALK_COLUMNS)):
+            os.makedirs(os.path.join(path, table), exist_ok=True)
+            for key, dtype in types.items():
+                # Values copied from previous text outputs are strings; cast them here
+                np.save(os.path.join(path, table, key + ".npy"),
+                        np.asarray(columns[key]).astype(dtype))
+        np.save(os.path.join(path, "queries", "street_names.npy"), st_names)
+
+    @classmethod
+    def iter_metadata(cls, path):
+        """ Iterate stored queries as metadata rows, ordered as QueryGenerationRunner's
+            headers, along with query parameters as in queries.txt.
+        """
+        columns = cls.read(path)
+        st_names = columns["street_names"]
+        for row_id in range(len(columns["sidewalk_index"])):
+            center, location = columns["center"][row_id], columns["location"][row_id]
+            heading = float(columns["heading"][row_id])
+            yield (int(columns["sidewalk_index"][row_id]), int(columns["partition_index"][row_id]),
+                   int(columns["query_id"][row_id]), float(center[0]), float(center[1]),
+                   str(st_names[columns["street_name"][row_id]]),
+                   int(columns["street_segment_id"][row_id]),
+                   float(location[0]), float(location[1]), heading), \
+                  {"location": [float(location[0]), float(location[1])], "heading": heading}
+
+    @classmethod
+    def read(cls, path, table="queries", sidewalks=None, streets=None):
+        """ Read memory-mapped columns of a table, optionally filtered.
+
+            Args:
+                path - (str) Folder path of stored columns
+                table - (str) "queries" or "sidewalks"
+                sidewalks (optional) - (list(int)) Sidewalk indices to keep
+                streets (optional) - (list(str)) Street names to keep (queries only)
+
+            Return:
+                (dict) Column name -> numpy array. "street_name" column holds indices
+                        to the "street_names" array.
+        """
+        types = cls.QUERY_COLUMNS if table == "queries" else cls.SIDEWALK_COLUMNS
+        columns = {key: np.load(os.path.join(path, table, key + ".npy"), mmap_mode="r")
+                   for key in types}
+        if table == "queries":
+            columns["street_names"] = np.load(os.path.join(path, table, "street_names.npy"))
+
+        mask = np.ones(len(columns["sidewalk_index"]), dtype=bool)
+        if sidewalks is not None:
+            mask &= np.isin(columns["sidewalk_index"], sidewalks)
+        if streets is not None and table == "queries":
+            name_ids = np.flatnonzero(np.isin(columns["street_names"], streets))
+            mask &= np.isin(columns["street_name"], name_ids)
+        if sidewalks is None and (streets is None or table != "queries"):
+            return columns
+        return {key: (col if key == "street_names" else col[mask])
+                for key, col in columns.items()}
+
 class QueryGenerationRunner():
     """ Wrapped routine for generating streetview panorama queries.
     """
 
-    __meta_headers = ["Sidewalk_Index", "Partition_Index", "Query_ID", "Center_Lon",
+    META_HEADERS = ["Sidewalk_Index", "Partition_Index", "Query_ID", "Center_Lon",
                       "Center_Lat", "Street_Belonging", "Street_Segment_Id", "Pano_Location_Lon",
                       "Pano_Location_Lat", "Pano_Heading"]
 
+    # Margin (in degrees, ~50 meters) around a changed street segment, within which
+    # sidewalks are re-matched against the street index in incremental mode.
+    _STREET_CHANGE_MARGIN = 0.0005
+    # Distance (in degrees, ~30 meters) within which a changed sidewalk is matched to the
+    # nearest previous one by centroid in incremental mode, and counted as modified.
+    _SIDEWALK_MATCH_MARGIN = 0.0003
+
+    # Tiles of a restricted run are listed in its result folder name up to this count,
+    # otherwise they're abbreviated by count and fingerprint.
+    _RESTRICTED_NAME_TILES = 8
+
     def __init__(self, sidewalk_file, index_path, out_path, street_file=None, part_len=20.0, 
-                 threshold=8.0, shot_angle=30.0, shot_dist=10.0, verbose=False):
+                 threshold=8.0, shot_angle=30.0, shot_dist=10.0, tile_level=16, tiles=None,
+                 bbox=None, incremental=False, columnar=False, verbose=False):
         """
             Args:
                 sidewalk_file - (str) File path to sidewalk JSON dataset
                 index_path - (str) File path to store disk street index
                 out_path - (str) Folder path to store result queries and metadata
                 street_file (optional) - (str) File path to street JSON dataset
+                tile_level (optional) - (int) Sidewalks are processed and written in
+                        Hilbert curve order, grouped into 2^tile_level x 2^tile_level
+                        global tiles (at Boston's latitude, level 16 tiles are ~450
+                        meters wide in longitude and ~305 meters tall in latitude),
+                        from 0 to 24
+                tiles (optional) - (list(int)) Only process sidewalks in these tiles
+                bbox (optional) - (list[4](float)) Only process sidewalks with center
+                        inside this (left, bottom, right, top) lon-lat bounding box.
+                        Results of a restricted run go to a sub-folder of out_path
+                        (see result_path), so they don't overwrite the full results.
+                incremental (optional) - (bool) Reuse results of the previous run in
+                        result_path, and only regenerate queries for changed sidewalks.
+                columnar (optional) - (bool) Also write outputs as memory-mappable
+                        columns under result_path/columnar (see QueryColumnStore).
         """
+        if not 0 <= tile_level <= SidewalkQueryToolkit._HILBERT_ORDER:
+            raise ValueError("tile_level must be between 0 and {}, got {}".format(
+                SidewalkQueryToolkit._HILBERT_ORDER, tile_level))
 
         self.__tlkt = SidewalkQueryToolkit
         self.sidewalk_file = sidewalk_file
 
         if street_file:
             self.st_index = self.__tlkt.build_geodb(street_file, index_path, True)
+            self.street_info = self.__tlkt.fingerprint_streets(street_file)
         else:
             self.st_index = self.__tlkt.read_geodb(index_path)
+            self.street_info = None
         self.out_path = out_path
         self.part_len = part_len
         self.threshold = threshold
         self.shot_angle = shot_angle
         self.shot_dist = shot_dist
+        self.tile_level = tile_level
+        self.tiles = sorted(tiles) if tiles else None
+        self.bbox = list(bbox) if bbox else None
+        self.incremental = incremental
+        self.columnar = columnar
         self.verbose = verbose
 
+    @property
+    def parameters(self):
+        """ Parameters that affect generated queries.
+        """
+        return {"part_len": self.part_len, "threshold": self.threshold,
+                "shot_angle": self.shot_angle, "shot_dist": self.shot_dist,
+                "tile_level": self.tile_level, "tiles": self.tiles, "bbox": self.bbox}
+
+    @property
+    def result_path(self):
+        """ Folder of this run's results: out_path, or for a run restricted with tiles
+            or bbox, a sub-folder of out_path/restricted named after the restriction.
+        """
+        if not (self.tiles or self.bbox):
+            return self.out_path
+        names = []
+        if self.tiles:
+            if len(self.tiles) <= self._RESTRICTED_NAME_TILES:
+                names.append("tiles=" + ",".join(str(tile) for tile in self.tiles))
+            else:
+                names.append("tiles={}-{}".format(
+                    len(self.tiles), self.__tlkt.fingerprint(self.tiles)[:10]))
+        if self.bbox:
+            names.append("bbox=" + ",".join("{:g}".format(val) for val in self.bbox))
+        return os.path.join(self.out_path, "restricted", "-".join(names))
+
+    def _load_previous_run(self):
+        """ Read results of the previous run in result_path.
+
+            Return:
+                (dict) Previous sidewalk info and query rows keyed by sidewalk index,
+                        fingerprint lookup and indices of sidewalks affected by street
+                        changes; or None if the previous run can't be reused.
+        """
+        path_changes = os.path.join(self.result_path, "changes.json")
+        if not os.path.isfile(path_changes):
+            return None
+        with open(path_changes, "r") as fd_r:
+            if json.load(fd_r).get("parameters") != self.parameters:
+                return None
+
+        sidewalks = {}
+        with open(os.path.join(self.result_path, "sidewalk_info.txt"), "r") as fd_r:
+            for line in fd_r:
+                info = json.loads(line)
+                sidewalks[info["sidewalk_index"]] = info
+        fingerprints = {}
+        for sw_idx, info in sidewalks.items():
+            if "fingerprint" in info:
+                fingerprints.setdefault(info["fingerprint"], []).append(sw_idx)
+
+        rows = {sw_idx: [] for sw_idx in sidewalks}
+        with open(os.path.join(self.result_path, "metadata.txt"), "r", newline="") as fd_m, \
+                open(os.path.join(self.result_path, "queries.txt"), "r") as fd_q:
+            m_reader = csv.reader(fd_m)
+            next(m_reader)
+            for m_row, q_line in zip(m_reader, fd_q):
+                rows.setdefault(int(m_row[0]), []).append((m_row, json.loads(q_line)))
+
+        return {"sidewalks": sidewalks, "fingerprints": fingerprints, "rows": rows,
+                "affected": self._streets_affected(sidewalks, rows)}
+
+    def _streets_affected(self, sidewalks, rows):
+        """ Find previous sidewalks whose street matching may change, i.e. the ones
+            matched to a changed street, or lying near a changed street segment.
+        """
+        path_streets = os.path.join(self.result_path, "street_info.txt")
+        if self.street_info is None:
+            return set()
+        if not os.path.isfile(path_streets):
+            return set(sidewalks)
+        with open(path_streets, "r") as fd_r:
+            prev_streets = [json.loads(line) for line in fd_r]
+
+        cur_prints = {st["fingerprint"] for st in self.street_info}
+        prev_prints = {st["fingerprint"] for st in prev_streets}
+        changed = [st for st in self.street_info if st["fingerprint"] not in prev_prints] + \
+                  [st for st in prev_streets if st["fingerprint"] not in cur_prints]
+        if not changed:
+            return set()
+
+        changed_names = {st["name"] for st in changed}
+        changed_bbox = np.array([st["bbox"] for st in changed])
+        changed_bbox[:, :2] -= self._STREET_CHANGE_MARGIN
+        changed_bbox[:, 2:] += self._STREET_CHANGE_MARGIN
+        affected = set()
+        for sw_idx, info in sidewalks.items():
+            if any(m_row[5] in changed_names for m_row, _ in rows.get(sw_idx, [])):
+                affected.add(sw_idx)
+                continue
+            quad = np.array(info["quad_points"]).reshape(-1, 2)
+            if not len(quad):
+                continue
+            (left, bottom), (right, top) = quad.min(axis=0), quad.max(axis=0)
+            if np.any((changed_bbox[:, 0] <= right) & (left <= changed_bbox[:, 2]) &
+                      (changed_bbox[:, 1] <= top) & (bottom <= changed_bbox[:, 3])):
+                affected.add(sw_idx)
+        return affected
+
+    @staticmethod
+    def _centroids(sw_rows):
+        """ Centroid of the points of each sidewalk (NaN for sidewalks without points).
+        """
+        return np.array([np.mean(sw_row["points"], axis=0) if sw_row["points"]
+                         else (np.nan, np.nan) for sw_row in sw_rows]).reshape(-1, 2)
+
+    @staticmethod
+    def _previous_centroid(info):
+        """ Centroid of a previous sidewalk, or of its quads for runs that didn't store it.
+        """
+        if "center" in info:
+            return np.array(info["center"], dtype=np.float64)
+        corners = [point for quad in info["quad_points"] for point in quad]
+        return np.mean(np.array(corners, dtype=np.float64), axis=0) if corners else None
+
+    @classmethod
+    def _classify_sidewalks(cls, fingerprints, centroids, previous):
+        """ Classify current sidewalks against the previous run, independent of file order.
+            Sidewalks are matched by fingerprint first (unchanged ones), and the rest to the
+            nearest unmatched previous sidewalk by centroid (modified ones). Sidewalks without
+            a match are added, and previous ones without a match are removed.
+
+            Return:
+                (dict) Current sidewalk index -> (status, previous sidewalk index)
+                (list(int)) Previous sidewalk indices that are removed
+        """
+        status = {}
+        matched = set()
+        prev_by_print = {fprint: list(prev_idxs)
+                         for fprint, prev_idxs in previous["fingerprints"].items()}
+        for sw_idx, fprint in enumerate(fingerprints):
+            prev_idxs = prev_by_print.get(fprint)
+            if prev_idxs:
+                prev_idx = prev_idxs.pop(0)
+                matched.add(prev_idx)
+                status[sw_idx] = (
+                    "affected" if prev_idx in previous["affected"] else "unchanged", prev_idx)
+
+        # Bucket unmatched previous sidewalks into grid cells of the match margin, so only
+        # neighboring cells are searched for each unmatched current sidewalk.
+        margin = cls._SIDEWALK_MATCH_MARGIN
+        prev_centroids, cells = {}, {}
+        for prev_idx, info in previous["sidewalks"].items():
+            centroid = None if prev_idx in matched else cls._previous_centroid(info)
+            if centroid is not None and np.all(np.isfinite(centroid)):
+                prev_centroids[prev_idx] = centroid
+                cells.setdefault(tuple(np.floor(centroid / margin).astype(int)), []).append(
+                    prev_idx)
+        candidates = []
+        for sw_idx in range(len(fingerprints)):
+            if sw_idx in status or not np.all(np.isfinite(centroids[sw_idx])):
+                continue
+            cell_x, cell_y = np.floor(centroids[sw_idx] / margin).astype(int)
+            for neighbor in product((cell_x - 1, cell_x, cell_x + 1),
+                                    (cell_y - 1, cell_y, cell_y + 1)):
+                for prev_idx in cells.get(neighbor, []):
+                    dist = np.linalg.norm(centroids[sw_idx] - prev_centroids[prev_idx])
+                    if dist <= margin:
+                        candidates.append((dist, sw_idx, prev_idx))
+        # Closest pairs first
+        for _, sw_idx, prev_idx in sorted(candidates):
+            if sw_idx not in status and prev_idx not in matched:
+                matched.add(prev_idx)
+                status[sw_idx] = ("modified", prev_idx)
+
+        for sw_idx in range(len(fingerprints)):
+            status.setdefault(sw_idx, ("added", None))
+        removed = sorted(set(previous["sidewalks"]) - matched)
+        return status, removed
+
+    def _order_sidewalks(self, sw_rows):
+        """ Assign sidewalk blocks to spatial tiles, and order the selected ones in Hilbert
+            curve order, so that nearby blocks (and street index lookups) are handled together.
+
+            Return:
+                (list(int)) Indices of selected sidewalks, in processing order
+                (np.ndarray) Tile of each sidewalk
+        """
+        tool = self.__tlkt
+        centroids = self._centroids(sw_rows)
+        hilbert_keys = tool.hilbert_keys(centroids)
+        sw_tiles = tool.hilbert_tiles(hilbert_keys, self.tile_level)
+        selected = np.ones(len(sw_rows), dtype=bool)
+        if self.tiles:
+            selected &= np.isin(sw_tiles, self.tiles)
+        if self.bbox:
+            left, bottom, right, top = self.bbox
+            selected &= (left <= centroids[:, 0]) & (centroids[:, 0] <= right) & \
+                        (bottom <= centroids[:, 1]) & (centroids[:, 1] <= top)
+        sw_order = [int(sw_idx) for sw_idx in np.argsort(hilbert_keys, kind="stable")
+                    if selected[sw_idx]]
+        return sw_order, sw_tiles
+
+    def _write_outputs(self, out_path, meta, queries, sidewalk_info):
+        """ Write queries, sidewalk info and metadata to text files (and columns).
+        """
+        with open(os.path.join(out_path, "queries.txt"), "w") as fd_wq:
+            for query in queries:
+                fd_wq.write("{}\n".format(json.dumps(query)))
+
+        with open(os.path.join(out_path, "sidewalk_info.txt"), "w") as fd_ws:
+            for info in sidewalk_info:
+                fd_ws.write("{}\n".format(json.dumps(info)))
+
+        with open(os.path.join(out_path, "metadata.txt"), "w") as fd_wm:
+            wtr = csv.writer(fd_wm, delimiter=',')
+            wtr.writerow(self.META_HEADERS)
+            wtr.writerows(meta)
+
+        if self.columnar:
+            QueryColumnStore.write(os.path.join(out_path, "columnar"), meta, sidewalk_info)
+
     def run(self):
         """ Run query-param generation algorithm, and write metadata and query params to files.
+            In incremental mode, results of unchanged sidewalks are copied from the previous
+            run. A change manifest (changes.json) is written for downstream stages.
         """
         tool = self.__tlkt
         meta = []
         queries = []
         sidewalk_info = []
-        # Go through all side walk blocks to do partitioning, and decide camera
-        # settings for each partition.
+        changes = {"parameters": self.parameters, "added": [], "modified": [],
+                   "affected": [], "removed": [], "regenerated_rows": []}
+
         with open(self.sidewalk_file, "r") as fd_r:
-            for sw_idx, line in enumerate(fd_r.readlines()):
-                sw_row = json.loads(line)
-                sw_points = sw_row["points"]
-                quad = tool.approx_quadrilateral(sw_points)
-                if not quad:
-                    continue
-                partitions, (ang_1, ang_2) = tool.partition_with_direction(
-                    quad, self.part_len)
-                minor_ang = min(ang_1, ang_2)
-                sidewalk_info.append({
-                    "sidewalk_index": sw_idx, "quad_points": [list(d) for d in quad],
-                    "num_partitions": len(partitions), "direction": minor_ang
-                })
-                for pt_idx, partition in enumerate(partitions):
-                    q_params_1, q_params_2, q_info = tool.generate_sidewalk_queries(
-                        partition, minor_ang, self.st_index, self.threshold,
-                        self.shot_angle, self.shot_dist)
-                    for qd_idx, param in enumerate([q_params_1, q_params_2], 1):
-                        queries.append(param)
-                        metadata = (sw_idx, pt_idx, qd_idx, partition[0], partition[1],
-                                    q_info["st_name"], q_info["segment_id"],
-                                    param["location"][0], param["location"][1],
-                                    param["heading"])
-                        if self.verbose:
-                            print("Result: {}".format(metadata))
-                        meta.append(metadata)
+            sw_rows = [json.loads(line) for line in fd_r]
+        fingerprints = [tool.fingerprint(sw_row["points"]) for sw_row in sw_rows]
+        centroids = self._centroids(sw_rows)
+
+        previous = self._load_previous_run() if self.incremental else None
+        if previous:
+            status, changes["removed"] = self._classify_sidewalks(fingerprints, centroids,
+                                                                  previous)
+        else:
+            status = {sw_idx: ("added", None) for sw_idx in range(len(sw_rows))}
+
+        sw_order, sw_tiles = self._order_sidewalks(sw_rows)
+
+        # Approximate quadrilaterals of sidewalk blocks to be (re)generated, and
+        # partition all of them at once.
+        quads, quad_owners = [], []
+        for sw_idx in sw_order:
+            if status[sw_idx][0] != "unchanged":
+                sw_quads = tool.approx_quadrilaterals(sw_rows[sw_idx]["points"])
+                quads.extend(sw_quads)
+                quad_owners.extend([sw_idx] * len(sw_quads))
+        centers, owners, headings = tool.partition_quads(quads, self.part_len)
+        owner_bounds = np.searchsorted(owners, np.arange(len(quads) + 1))
+        quad_ranges = {int(sw_idx): range(first, first + count) for sw_idx, first, count
+                       in zip(*np.unique(quad_owners, return_index=True, return_counts=True))}
+
+        # Go through all side walk blocks, and decide camera settings for each partition.
+        for sw_idx in sw_order:
+            sw_status, prev_idx = status[sw_idx]
+            # Step 0: Copy previous result if nothing has changed
+            if sw_status == "unchanged":
+                info = dict(previous["sidewalks"][prev_idx], sidewalk_index=sw_idx)
+                sidewalk_info.append(info)
+                for m_row, query in previous["rows"].get(prev_idx, []):
+                    meta.append([sw_idx] + m_row[1:])
+                    queries.append(query)
+                continue
+
+            if sw_idx not in quad_ranges:
+                continue
+            # Partitions of all quadrilaterals of the block, with their directions
+            sw_quads = quad_ranges[sw_idx]
+            partitions = [(tuple(cent), float(headings[pos].min())) for pos in sw_quads
+                          for cent in centers[owner_bounds[pos]:owner_bounds[pos + 1]]]
+            sidewalk_info.append({
+                "sidewalk_index": sw_idx,
+                "quad_points": [[list(d) for d in quads[pos]] for pos in sw_quads],
+                "num_partitions": [int(owner_bounds[pos + 1] - owner_bounds[pos])
+                                   for pos in sw_quads],
+                "direction": [float(headings[pos].min()) for pos in sw_quads],
+                "tile": int(sw_tiles[sw_idx]), "fingerprint": fingerprints[sw_idx],
+                "center": centroids[sw_idx].tolist()
+            })
+            changes[sw_status].append(sw_idx)
+            for pt_idx, (partition, minor_ang) in enumerate(partitions):
+                q_params_1, q_params_2, q_info = tool.generate_sidewalk_queries(
+                    partition, minor_ang, self.st_index, self.threshold,
+                    self.shot_angle, self.shot_dist)
+                for qd_idx, param in enumerate([q_params_1, q_params_2], 1):
+                    changes["regenerated_rows"].append(len(queries))
+                    queries.append(param)
+                    metadata = (sw_idx, pt_idx, qd_idx, partition[0], partition[1],
+                                q_info["st_name"], q_info["segment_id"],
+                                param["location"][0], param["location"][1],
+                                param["heading"])
+                    if self.verbose:
+                        print("Result: {}".format(metadata))
+                    meta.append(metadata)
+
+        if self.verbose and previous:
+            print("Changes: {} added, {} modified, {} affected by streets, {} removed".format(
+                *(len(changes[key]) for key in ("added", "modified", "affected", "removed"))))
 
         # Write out to text files
-        with open(os.path.join(self.out_path, "queries.txt"), "w") as fd_wq:
-            for query in queries:
-                fd_wq.write("{}\n".format(json.dumps(query)))
+        os.makedirs(self.result_path, exist_ok=True)
+        self._write_outputs(self.result_path, meta, queries, sidewalk_info)
 
-        with open(os.path.join(self.out_path, "sidewalk_info.txt"), "w") as fd_ws:
-            for info in sidewalk_info:
-                fd_ws.write("{}\n".format(json.dumps(info)))
+        if self.street_info is not None:
+            with open(os.path.join(self.result_path, "street_info.txt"), "w") as fd_wst:
+                for info in self.street_info:
+                    fd_wst.write("{}\n".format(json.dumps(info)))
 
-        with open(os.path.join(self.out_path, "metadata.txt"), "w") as fd_wm:
-            wtr = csv.writer(fd_wm, delimiter=',')
-            wtr.writerow(self.__meta_headers)
-            wtr.writerows(meta)
+        with open(os.path.join(self.result_path, "changes.json"), "w") as fd_wc:
+            json.dump(changes, fd_wc)
+
+    def sweep(self, part_lens=None, shot_angles=None, shot_dists=None):
+        """ Run query-param generation for a grid of partition lengths and camera settings.
+            Quadrilaterals are fitted once, partitions and street matching are computed once
+            per partition length, and camera settings of all shot angle and shot distance
+            combinations are evaluated at once. Outputs of each combination are written to
+            a sub-folder of result_path/sweep, and a summary of all combinations to
+            result_path/sweep/summary.csv.
+
+            Args:
+                part_lens, shot_angles, shot_dists (optional) - (list(float)) Values to
+                        sweep; the runner's setting is used if not given.
+
+            Return:
+                (list(dict)) Summary row of each combination.
+        """
+        tool = self.__tlkt
+        part_lens = part_lens or [self.part_len]
+        shot_angles = np.array(shot_angles or [self.shot_angle], dtype=float)
+        shot_dists = np.array(shot_dists or [self.shot_dist], dtype=float)
+        sweep_path = os.path.join(self.result_path, "sweep")
+        summary = []
+
+        with open(self.sidewalk_file, "r") as fd_r:
+            sw_rows = [json.loads(line) for line in fd_r]
+        sw_order, sw_tiles = self._order_sidewalks(sw_rows)
+        quads, quad_owners = [], []
+        for sw_idx in sw_order:
+            sw_quads = tool.approx_quadrilaterals(sw_rows[sw_idx]["points"])
+            quads.extend(sw_quads)
+            quad_owners.extend([sw_idx] * len(sw_quads))
+        quad_owners = np.array(quad_owners, dtype=int)
+
+        for part_len in part_lens:
+            centers, owners, headings = tool.partition_quads(quads, part_len)
+            owner_bounds = np.searchsorted(owners, np.arange(len(quads) + 1))
+            quad_ranges = {int(sw_idx): range(first, first + count) for sw_idx, first, count
+                           in zip(*np.unique(quad_owners, return_index=True, return_counts=True))}
+            sidewalk_info = [{
+                "sidewalk_index": sw_idx,
+                "quad_points": [[list(d) for d in quads[pos]] for pos in quad_ranges[sw_idx]],
+                "num_partitions": [int(owner_bounds[pos + 1] - owner_bounds[pos])
+                                   for pos in quad_ranges[sw_idx]],
+                "direction": [float(headings[pos].min()) for pos in quad_ranges[sw_idx]],
+                "tile": int(sw_tiles[sw_idx]),
+                "fingerprint": tool.fingerprint(sw_rows[sw_idx]["points"])
+            } for sw_idx in sw_order if sw_idx in quad_ranges]
+
+            # Partition index within each sidewalk block (partitions of a block are contiguous)
+            part_sw = quad_owners[owners]
+            _, block_first, block_of = np.unique(part_sw, return_index=True, return_inverse=True)
+            part_ids = np.arange(len(centers)) - block_first[block_of]
+
+            # Street matching does not depend on camera settings
+            slopes = headings.min(axis=1)[owners]
+            slopes = np.where(slopes > 180.0, slopes - 180.0, slopes)
+            matches = [tool.match_street(tuple(cent), slope, self.st_index, self.threshold)
+                       for cent, slope in zip(centers, slopes)]
+            dir_facing_road = np.array([dir_road for _, dir_road in matches])
+
+            # Walkout directions in (camera, shot angle, partition) axes, and camera
+            # locations in (camera, shot angle, shot distance, partition) axes
+            walkouts = np.stack(tool.walkout_directions(
+                slopes, dir_facing_road, shot_angles[:, None]))
+            cam_headings = tool.reverse_directions(walkouts)
+            locations = tool.outreach_points(centers, walkouts[:, :, None, :],
+                                             shot_dists[:, None])
+
+            for ang_idx, shot_angle in enumerate(shot_angles):
+                for dist_idx, shot_dist in enumerate(shot_dists):
+                    meta, queries = [], []
+                    locs = locations[:, ang_idx, dist_idx].tolist()
+                    cam_hdgs = cam_headings[:, ang_idx].tolist()
+                    for pos, (belong_st, _) in enumerate(matches):
+                        for qd_idx in (1, 2):
+                            loc, heading = locs[qd_idx - 1][pos], cam_hdgs[qd_idx - 1][pos]
+                            queries.append({"location": loc, "heading": heading})
+                            meta.append((int(part_sw[pos]), int(part_ids[pos]), qd_idx,
+                                         centers[pos][0], centers[pos][1],
+                                         belong_st["st_name"], belong_st["segment_id"],
+                                         loc[0], loc[1], heading))
+
+                    combo_path = os.path.join(sweep_path, "part_len={:g}-shot_angle={:g}-"
+                                              "shot_dist={:g}".format(part_len, shot_angle,
+                                                                      shot_dist))
+                    os.makedirs(combo_path, exist_ok=True)
+                    self._write_outputs(combo_path, meta, queries, sidewalk_info)
+                    summary.append({
+                        "part_len": part_len, "shot_angle": float(shot_angle),
+                        "shot_dist": float(shot_dist), "sidewalks": len(sidewalk_info),
+                        "partitions": len(centers), "queries": len(queries),
+                        "streets": len({belong_st["st_name"] for belong_st, _ in matches}),
+                        "path": combo_path
+                    })
+                    if self.verbose:
+                        print("Result: {}".format(summary[-1]))
+
+        with open(os.path.join(sweep_path, "summary.csv"), "w", newline="") as fd_ws:
+            wtr = csv.DictWriter(fd_ws, fieldnames=list(summary[0]))
+            wtr.writeheader()
+            wtr.writerows(summary)
+        return summary